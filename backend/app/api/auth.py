@@ -3,21 +3,33 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from app.db.session import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.utils.security import hash_password, verify_password, create_access_token
+from app.utils.security import hash_password_async, verify_and_update_async, create_access_token, PasswordHashBusy
+from app.config import settings
 from app.models.user import User
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_current_user_row
+from app.db.principals import Principal, principal_cache
+from app.media.avatars import avatar_fields, apply_profile_picture
 from sqlalchemy import select
 import traceback
 
 router = APIRouter(prefix="/auth")
 
+
+def _hashing_busy() -> HTTPException:
+    # the hashing pool is saturated; shed the request rather than queue behind it
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="server busy, try again",
+        headers={"Retry-After": str(settings.PASSWORD_BUSY_RETRY_AFTER)},
+    )
+
 @router.get("/profile")
-async def get_profile(user: User = Depends(get_current_user)):
-    print(f"DEBUG: get_profile returning user {user.id}: {user.username}, name={user.full_name}, avatar_len={len(user.avatar) if user.avatar else 0}")
+async def get_profile(user: Principal = Depends(get_current_user)):
+    print(f"DEBUG: get_profile returning user {user.id}: {user.username}, name={user.full_name}, avatar={user.avatar_key}")
     return {
         "id": user.id,
         "username": user.username,
-        "profile_picture": user.avatar,
+        **avatar_fields(user.avatar_key, user.avatar_version),
         "full_name": user.full_name,
         "about": user.about
     }
@@ -30,26 +42,29 @@ class ProfileUpdate(BaseModel):
 
 
 @router.patch("/profile")
-async def update_profile(payload: ProfileUpdate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def update_profile(payload: ProfileUpdate, user: User = Depends(get_current_user_row), db: AsyncSession = Depends(get_db)):
     try:
         if payload.full_name is not None:
             user.full_name = payload.full_name
         if payload.about is not None:
             user.about = payload.about
         if payload.profile_picture is not None:
-            user.avatar = payload.profile_picture
+            await apply_profile_picture(user, payload.profile_picture)
 
         db.add(user)
         await db.commit()
         await db.refresh(user)
+        principal_cache.invalidate(user.id)
 
         return {
             "id": user.id,
             "username": user.username,
-            "profile_picture": user.avatar,
+            **avatar_fields(user.avatar_key, user.avatar_version),
             "full_name": user.full_name,
             "about": user.about
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
@@ -77,9 +92,14 @@ async def register(payload: RegisterIn, db: AsyncSession = Depends(get_db)):
         if existing:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="username taken")
 
+        try:
+            password_hash = await hash_password_async(payload.password)
+        except PasswordHashBusy:
+            raise _hashing_busy()
+
         user = User(
             username=payload.username, 
-            password_hash=hash_password(payload.password),
+            password_hash=password_hash,
             full_name=payload.full_name
         )
         db.add(user)
@@ -94,11 +114,13 @@ async def register(payload: RegisterIn, db: AsyncSession = Depends(get_db)):
                 "username": user.username,
                 "full_name": user.full_name,
                 "about": user.about,
-                "profile_picture": user.avatar
+                **avatar_fields(user.avatar_key, user.avatar_version)
             },
             "access_token": token
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         tb = traceback.format_exc()
         print(tb)  # prints to server console too
@@ -110,18 +132,29 @@ async def register(payload: RegisterIn, db: AsyncSession = Depends(get_db)):
 async def login(payload: LoginIn, db: AsyncSession = Depends(get_db)):
     q = await db.execute(select(User).where(User.username == payload.username))
     user = q.scalars().first()
-    if not user or not verify_password(payload.password, user.password_hash):
+    if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid credentials")
+    try:
+        valid, new_hash = await verify_and_update_async(payload.password, user.password_hash)
+    except PasswordHashBusy:
+        raise _hashing_busy()
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid credentials")
+
+    if new_hash:
+        # legacy SHA256 (or outdated pbkdf2 settings): store the current scheme now that we have the password
+        user.password_hash = new_hash
+        await db.commit()
 
     token = create_access_token(user.id)
-    print(f"DEBUG: login successful for user {user.id}: {user.username}, name={user.full_name}, avatar_len={len(user.avatar) if user.avatar else 0}")
+    print(f"DEBUG: login successful for user {user.id}: {user.username}, name={user.full_name}, avatar={user.avatar_key}")
     return {
         "user": {
             "id": user.id,
             "username": user.username,
             "full_name": user.full_name,
             "about": user.about,
-            "profile_picture": user.avatar
+            **avatar_fields(user.avatar_key, user.avatar_version)
         },
         "access_token": token
     }
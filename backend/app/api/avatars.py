@@ -0,0 +1,42 @@
+# app/api/avatars.py
+import os
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_current_user_row
+from app.db.principals import principal_cache
+from app.config import settings
+from app.db.session import get_db
+from app.media.avatars import KEY_PATTERN, avatar_fields, avatar_path, set_avatar, store_avatar
+from app.models.user import User
+
+router = APIRouter(prefix="/avatars")
+
+
+@router.post("/")
+async def upload_avatar(file: UploadFile = File(...), user: User = Depends(get_current_user_row), db: AsyncSession = Depends(get_db)):
+    # read one byte past the cap so an oversized upload is rejected without buffering all of it
+    data = await file.read(settings.AVATAR_MAX_BYTES + 1)
+    if len(data) > settings.AVATAR_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"avatar larger than {settings.AVATAR_MAX_BYTES} bytes")
+    try:
+        key = await store_avatar(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    set_avatar(user, key)
+    db.add(user)
+    await db.commit()
+    principal_cache.invalidate(user.id)
+    return {"id": user.id, **avatar_fields(user.avatar_key, user.avatar_version)}
+
+
+@router.get("/{key}/{size}.jpg")
+async def get_avatar(key: str, size: int):
+    if not KEY_PATTERN.match(key) or size not in settings.AVATAR_SIZES:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    path = avatar_path(key, size)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    # the key is the content hash, so a URL's bytes never change
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
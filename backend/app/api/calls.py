@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, desc
+from sqlalchemy import select, or_, and_, func, literal, union_all
+from sqlalchemy.dialects import sqlite
 from app.api.deps import get_current_user
+from app.db.principals import Principal
 from app.db.session import get_db
+from app.db import call_stats
 from app.models.user import User
 from app.models.call_log import CallLog
+from app.models.call_stat import CallStat
+from app.media.avatars import avatar_fields
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timezone
 
 router = APIRouter(prefix="/calls", tags=["calls"])
 
@@ -19,7 +24,7 @@ class CallUpdate(BaseModel):
     end_time: datetime | None = None
 
 @router.post("/", response_model=dict)
-async def create_call_log(call: CallCreate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_call_log(call: CallCreate, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     new_call = CallLog(
         caller_id=user.id,
         receiver_id=call.receiver_id,
@@ -31,51 +36,158 @@ async def create_call_log(call: CallCreate, user: User = Depends(get_current_use
     return {"id": new_call.id, "status": new_call.status}
 
 @router.patch("/{call_id}", response_model=dict)
-async def update_call_log(call_id: int, call_update: CallUpdate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def update_call_log(call_id: int, call_update: CallUpdate, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(CallLog).where(CallLog.id == call_id))
     call_log = result.scalars().first()
     
-    if not call_log:
+    # only the two parties may touch a call; to anyone else it doesn't exist
+    if not call_log or user.id not in (call_log.caller_id, call_log.receiver_id):
         raise HTTPException(status_code=404, detail="Call log not found")
-        
-    # Only caller or receiver can update? Usually caller updates 'missed' to 'accepted' if they connect?
-    # Or receiver updates? Let's allow both for now, but in reality, whoever ends the call updates duration.
-    
-    call_log.status = call_update.status
-    if call_update.end_time:
-        call_log.end_time = call_update.end_time
-        
+
+    if call_log.end_time is not None:
+        # closed calls are final; they are already counted in the rollups
+        return {"id": call_log.id, "status": call_log.status, "end_time": call_log.end_time}
+
+    if call_update.end_time is None:
+        if call_update.status == call_stats.ANSWERED and call_log.status != call_stats.ANSWERED:
+            # talk time runs from the answer, not from when it started ringing
+            call_log.start_time = datetime.now(timezone.utc)
+        call_log.status = call_update.status
+    else:
+        end_time = call_stats.clamp_end_time(call_log, call_update.end_time)
+        await call_stats.close_call(db, call_id, call_update.status, end_time)
+
     await db.commit()
     await db.refresh(call_log)
     return {"id": call_log.id, "status": call_log.status, "end_time": call_log.end_time}
 
-@router.get("/", response_model=list)
-async def get_call_history(user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    query = select(CallLog).where(
-        or_(CallLog.caller_id == user.id, CallLog.receiver_id == user.id)
-    ).order_by(desc(CallLog.created_at))
-    
-    result = await db.execute(query)
+CALLS_PAGE_DEFAULT = 50
+CALLS_PAGE_MAX = 200
+
+
+def _parse_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, call_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(call_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _older_than(created_at: datetime, call_id: int, dialect: str):
+    # SQLite keeps server-side now() as 'YYYY-MM-DD HH:MM:SS'; bind the cursor the same
+    # way, or its own row would compare as older than it (string comparison)
+    bound = literal(created_at, type_=sqlite.DATETIME(truncate_microseconds=True) if dialect == "sqlite" else CallLog.created_at.type)
+    # the <= bound is the index range; the OR only breaks ties inside one timestamp
+    return and_(CallLog.created_at <= bound, or_(CallLog.created_at < bound, CallLog.id < call_id))
+
+
+async def _users_by_id(db: AsyncSession, user_ids) -> dict[int, dict]:
+    if not user_ids:
+        return {}
+    result = await db.execute(
+        select(User.id, User.username, User.full_name, User.avatar_key, User.avatar_version)
+        .where(User.id.in_(user_ids))
+    )
+    return {
+        row.id: {
+            "id": row.id,
+            "username": row.username,
+            "full_name": row.full_name,
+            **avatar_fields(row.avatar_key, row.avatar_version),
+        }
+        for row in result.all()
+    }
+
+
+@router.get("/")
+async def get_call_history(
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(CALLS_PAGE_DEFAULT, ge=1, le=CALLS_PAGE_MAX),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Keyset page over (created_at, id), newest first. Each side of the call is its own
+    # branch so it walks its own (caller_id|receiver_id, created_at) index and stops after
+    # limit + 1 rows; the extra row says whether there is another page.
+    before = _parse_cursor(cursor) if cursor else None
+    dialect = db.bind.dialect.name
+    branches = []
+    for column in (CallLog.caller_id, CallLog.receiver_id):
+        branch = select(CallLog.id).where(column == user.id)
+        if before:
+            branch = branch.where(_older_than(*before, dialect))
+        branches.append(branch.order_by(CallLog.created_at.desc(), CallLog.id.desc()).limit(limit + 1))
+    # each branch is wrapped so its ORDER BY/LIMIT is legal inside the UNION
+    page_ids = union_all(*(select(b.subquery().c.id) for b in branches)).subquery()
+    result = await db.execute(
+        select(CallLog)
+        .where(CallLog.id.in_(select(page_ids.c.id)))
+        .order_by(CallLog.created_at.desc(), CallLog.id.desc())
+        .limit(limit + 1)
+    )
     calls = result.scalars().all()
-    
-    history = []
-    for call in calls:
-        other_user_id = call.receiver_id if call.caller_id == user.id else call.caller_id
-        res = await db.execute(select(User).where(User.id == other_user_id))
-        other_user = res.scalars().first()
-        
-        history.append({
-            "id": call.id,
-            "type": "outgoing" if call.caller_id == user.id else "incoming",
-            "status": call.status,
-            "start_time": call.start_time,
-            "end_time": call.end_time,
-            "other_user": {
-                "id": other_user.id,
-                "username": other_user.username,
-                "full_name": other_user.full_name,
-                "profile_picture": other_user.avatar
-            } if other_user else None
-        })
-        
-    return history
+    has_more = len(calls) > limit
+    calls = calls[:limit]
+
+    # everyone on the page in one query
+    other_ids = {call.receiver_id if call.caller_id == user.id else call.caller_id for call in calls}
+    users = await _users_by_id(db, other_ids)
+
+    history = [{
+        "id": call.id,
+        "type": "outgoing" if call.caller_id == user.id else "incoming",
+        "status": call.status,
+        "start_time": call.start_time,
+        "end_time": call.end_time,
+        "other_user": users.get(call.receiver_id if call.caller_id == user.id else call.caller_id),
+    } for call in calls]
+    last = calls[-1] if calls else None
+    return {
+        "calls": history,
+        "next_cursor": f"{last.created_at.isoformat()}|{last.id}" if has_more else None,
+    }
+
+
+@router.get("/stats/")
+async def get_call_stats(
+    limit: int = Query(CALLS_PAGE_DEFAULT, ge=1, le=CALLS_PAGE_MAX),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Served from the call_stats rollups (one row per contact), never from call_logs.
+    totals = (await db.execute(
+        select(
+            func.coalesce(func.sum(CallStat.outgoing), 0),
+            func.coalesce(func.sum(CallStat.incoming), 0),
+            func.coalesce(func.sum(CallStat.missed), 0),
+            func.coalesce(func.sum(CallStat.talk_seconds), 0),
+        ).where(CallStat.user_id == user.id)
+    )).one()
+    result = await db.execute(
+        select(CallStat)
+        .where(CallStat.user_id == user.id)
+        .order_by(CallStat.last_call_at.desc(), CallStat.contact_id)
+        .limit(limit)
+    )
+    rows = result.scalars().all()
+    users = await _users_by_id(db, {row.contact_id for row in rows})
+    outgoing, incoming, missed, talk_seconds = totals
+    return {
+        "totals": {
+            "calls": outgoing + incoming,
+            "outgoing": outgoing,
+            "incoming": incoming,
+            "missed": missed,
+            "talk_seconds": talk_seconds,
+        },
+        # contacts called most recently first
+        "contacts": [{
+            "contact": users.get(row.contact_id),
+            "calls": row.outgoing + row.incoming,
+            "outgoing": row.outgoing,
+            "incoming": row.incoming,
+            "missed": row.missed,
+            "talk_seconds": row.talk_seconds,
+            "last_call_at": row.last_call_at,
+        } for row in rows],
+    }
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.api.deps import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.api.deps import get_current_user, get_current_user_row
+from app.db.principals import Principal, principal_cache
+from app.media.avatars import avatar_fields, apply_profile_picture
 from app.models.user import User
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_db
@@ -12,170 +14,243 @@ class ProfileUpdate(BaseModel):
     about: str | None = None
     profile_picture: str | None = None
 
-from sqlalchemy import select, or_, and_, func
+from sqlalchemy import select, or_, and_, func, case, update
+from sqlalchemy.orm import aliased
 from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
 from app.models.message import Message
 
 @router.get("/contacts/")
-async def get_contacts(user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    # Find all conversations where the user is a participant
-    query = select(Conversation).where(
-        or_(Conversation.user1_id == user.id, Conversation.user2_id == user.id)
+async def get_contacts(user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # One query for the whole inbox: the user's membership rows carry the unread
+    # counters, the other participant is joined in, and the latest message id per
+    # conversation (an index probe on messages(conversation_id, id)) gives the order.
+    other_id = case((Conversation.user1_id == user.id, Conversation.user2_id), else_=Conversation.user1_id)
+    last_message_id = (
+        select(func.max(Message.id))
+        .where(Message.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
     )
-    result = await db.execute(query)
-    conversations = result.scalars().all()
-    
-    contacts = []
-    for conv in conversations:
-        # Determine the "other" user
-        other_user_id = conv.user2_id if conv.user1_id == user.id else conv.user1_id
-        # Fetch the other user's details
-        res = await db.execute(select(User).where(User.id == other_user_id))
-        other_user = res.scalars().first()
-        
-        # Calculate unread count
-        unread_query = select(func.count(Message.id)).where(
-            and_(
-                Message.conversation_id == conv.id,
-                Message.sender_id != user.id,
-                Message.read == False
-            )
+    last_message = aliased(Message)
+    query = (
+        select(
+            Conversation.id,
+            ConversationMember.unread_count,
+            User.id.label("user_id"), User.username, User.full_name, User.about, User.avatar_key, User.avatar_version,
+            last_message.id.label("last_message_id"), last_message.content, last_message.created_at,
         )
-        unread_res = await db.execute(unread_query)
-        unread_count = unread_res.scalar()
-        
-        if other_user:
-            contacts.append({
-                "id": conv.id,
-                "contact_user": {
-                    "id": other_user.id,
-                    "username": other_user.username,
-                    "full_name": other_user.full_name,
-                    "about": other_user.about,
-                    "profile_picture": other_user.avatar
-                },
-                "unread_count": unread_count
-            })
-            
-    return contacts
+        .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+        .join(User, User.id == other_id)
+        .outerjoin(last_message, last_message.id == last_message_id)
+        .where(ConversationMember.user_id == user.id)
+        .order_by(func.coalesce(last_message.id, 0).desc(), Conversation.id.desc())
+    )
+    result = await db.execute(query)
+
+    return [{
+        "id": row.id,
+        "contact_user": {
+            "id": row.user_id,
+            "username": row.username,
+            "full_name": row.full_name,
+            "about": row.about,
+            **avatar_fields(row.avatar_key, row.avatar_version)
+        },
+        "unread_count": row.unread_count,
+        "last_message": {
+            "id": row.last_message_id,
+            "content": row.content,
+            "timestamp": row.created_at.isoformat() if row.created_at else None
+        } if row.last_message_id else None
+    } for row in result.all()]
 
 from app.sockets.connection_manager import manager
+from app.db.conversations import conversation_resolver
+from app.db import user_search, message_search
 
 @router.post("/messages/{contact_id}/read/")
-async def mark_messages_read(contact_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def mark_messages_read(contact_id: int, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     # Find conversation
-    query = select(Conversation).where(
-        or_(
-            and_(Conversation.user1_id == user.id, Conversation.user2_id == contact_id),
-            and_(Conversation.user1_id == contact_id, Conversation.user2_id == user.id)
-        )
-    )
-    result = await db.execute(query)
-    conversation = result.scalars().first()
+    conversation_id = await conversation_resolver.get(db, user.id, contact_id)
     
-    if not conversation:
+    if not conversation_id:
         return {"status": "success", "updated": 0}
-        
-    # Update messages
-    # We want to mark messages sent BY contact_id TO user AS read
-    stmt = select(Message).where(
-        and_(
-            Message.conversation_id == conversation.id,
-            Message.sender_id == contact_id,
-            Message.read == False
+
+    # Read state is a watermark: everything up to the newest message is now read.
+    result = await db.execute(select(func.max(Message.id)).where(Message.conversation_id == conversation_id))
+    watermark = result.scalar()
+    if watermark is None:
+        return {"status": "success", "updated": 0}
+
+    # Only ever move the watermark forward. The counter is recomputed in the same
+    # UPDATE as what is still above the watermark, not reset to 0: a message the
+    # writer committed since we read max(id) has already bumped it and stays unread.
+    still_unread = (
+        select(func.count())
+        .where(Message.conversation_id == conversation_id, Message.id > watermark, Message.sender_id != user.id)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(ConversationMember)
+        .where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id == user.id,
+            func.coalesce(ConversationMember.last_read_message_id, 0) < watermark,
         )
+        .values(last_read_message_id=watermark, unread_count=still_unread)
     )
-    result = await db.execute(stmt)
-    messages = result.scalars().all()
-    
-    if not messages:
+    if result.rowcount == 0:
         return {"status": "success", "updated": 0}
 
-    for msg in messages:
-        msg.read = True
-        
+    # Keep the per-message flags in step with one set-based UPDATE
+    result = await db.execute(
+        update(Message)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.sender_id == contact_id,
+            Message.read == False,
+            Message.id <= watermark,
+        )
+        .values(read=True)
+        .execution_options(synchronize_session=False)
+    )
+    updated = result.rowcount
     await db.commit()
 
-    # Broadcast read receipt to the sender (contact_id)
-    # They need to know that 'user' read their messages
+    # Tell the sender (contact_id) how far 'user' has read
     await manager.send_personal_message({
         "type": "messages_read",
-        "conversation_id": conversation.id,
+        "conversation_id": conversation_id,
         "reader_id": user.id,
-        "message_ids": [m.id for m in messages]
+        "last_read_message_id": watermark
     }, contact_id)
 
-    return {"status": "success", "updated": len(messages)}
+    return {"status": "success", "updated": updated, "last_read_message_id": watermark}
+
+MESSAGES_PAGE_DEFAULT = 50
+MESSAGES_PAGE_MAX = 200
 
 @router.get("/messages/{contact_id}/")
-async def get_messages(contact_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def get_messages(
+    contact_id: int,
+    before_id: int | None = Query(None, description="page of messages older than this id"),
+    after_id: int | None = Query(None, description="page of messages newer than this id"),
+    limit: int = Query(MESSAGES_PAGE_DEFAULT, ge=1, le=MESSAGES_PAGE_MAX),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
     # Find the conversation between these two users
-    # We need to check both combinations: (user, contact) and (contact, user)
-    query = select(Conversation).where(
-        or_(
-            and_(Conversation.user1_id == user.id, Conversation.user2_id == contact_id),
-            and_(Conversation.user1_id == contact_id, Conversation.user2_id == user.id)
-        )
-    )
-    result = await db.execute(query)
-    conversation = result.scalars().first()
+    conversation_id = await conversation_resolver.get(db, user.id, contact_id)
     
-    if not conversation:
-        return []
-        
-    # Fetch messages for this conversation
-    msg_query = select(Message).where(Message.conversation_id == conversation.id).order_by(Message.created_at)
-    msg_result = await db.execute(msg_query)
-    messages = msg_result.scalars().all()
-    
-    # Format for frontend
-    formatted_messages = []
-    for msg in messages:
-        # We need the sender's username. For MVP, we can infer it or fetch it.
-        # Let's fetch it for now to be safe, or optimize later.
-        sender_res = await db.execute(select(User).where(User.id == msg.sender_id))
-        sender = sender_res.scalars().first()
-        
-        formatted_messages.append({
-            "id": msg.id,
-            "content": msg.content,
-            "timestamp": msg.created_at.isoformat(),
-            "sender_id": msg.sender_id,
-            "sender_username": sender.username if sender else "Unknown",
-            "delivered": msg.delivered,
-            "read": msg.read
-        })
+    if not conversation_id:
+        return {"messages": [], "next_cursor": None, "prev_cursor": None}
         
-    return formatted_messages
+    # Keyset page over (conversation_id, id); sender names come from the same query.
+    # Fetch one extra row to know whether there is another page in that direction.
+    msg_query = (
+        select(Message, User.username)
+        .outerjoin(User, User.id == Message.sender_id)
+        .where(Message.conversation_id == conversation_id)
+    )
+    if after_id is not None:
+        msg_query = msg_query.where(Message.id > after_id).order_by(Message.id.asc())
+    else:
+        if before_id is not None:
+            msg_query = msg_query.where(Message.id < before_id)
+        msg_query = msg_query.order_by(Message.id.desc())
+    msg_result = await db.execute(msg_query.limit(limit + 1))
+    rows = msg_result.all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+
+    # Format for frontend (oldest first)
+    formatted_messages = [{
+        "id": msg.id,
+        "content": msg.content,
+        "timestamp": msg.created_at.isoformat(),
+        "sender_id": msg.sender_id,
+        "sender_username": username or "Unknown",
+        "delivered": msg.delivered,
+        "read": msg.read
+    } for msg, username in rows]
+
+    # prev_cursor -> pass as before_id to scroll back; next_cursor -> pass as after_id to catch up
+    if after_id is not None:
+        older, newer = True, has_more
+    else:
+        older, newer = has_more, before_id is not None
+    return {
+        "messages": formatted_messages,
+        "prev_cursor": formatted_messages[0]["id"] if older and formatted_messages else None,
+        "next_cursor": formatted_messages[-1]["id"] if newer and formatted_messages else None,
+    }
 
 @router.get("/search/")
-async def search_users(q: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    if not q:
-        return []
-        
-    # Search by username or full_name, excluding the current user
-    query = select(User).where(
-        and_(
-            User.id != user.id,
-            or_(
-                User.username.ilike(f"%{q}%"),
-                User.full_name.ilike(f"%{q}%")
-            )
-        )
-    )
-    result = await db.execute(query)
-    users = result.scalars().all()
-    
+async def search_users(q: str, limit: int = Query(20, ge=1, le=50), offset: int = Query(0, ge=0, le=500),
+                       user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Ranked: exact username, then username prefix, full name prefix, substring (app/db/user_search.py)
+    rows = await user_search.search_users(db, q, exclude_id=user.id, limit=limit, offset=offset)
     return [{
-        "id": u.id,
-        "username": u.username,
-        "full_name": u.full_name,
-        "profile_picture": u.avatar,
-        "about": u.about
-    } for u in users]
+        "id": row.id,
+        "username": row.username,
+        "full_name": row.full_name,
+        **avatar_fields(row.avatar_key, row.avatar_version),
+        "about": row.about
+    } for row in rows]
+
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+
+@router.get("/search/messages/")
+async def search_messages(
+    q: str,
+    conversation_id: int | None = Query(None, description="search one conversation"),
+    contact_id: int | None = Query(None, description="search the conversation with this user"),
+    before_id: int | None = Query(None, description="page of hits older than this message id"),
+    limit: int = Query(SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    words = message_search.query_words(q)
+    if not words:
+        return {"results": [], "next_cursor": None}
+
+    if contact_id is not None:
+        conversation_id = await conversation_resolver.get(db, user.id, contact_id)
+        if not conversation_id:
+            return {"results": [], "next_cursor": None}
+    if conversation_id is not None:
+        result = await db.execute(select(ConversationMember.conversation_id).where(
+            ConversationMember.conversation_id == conversation_id, ConversationMember.user_id == user.id,
+        ))
+        if result.scalar() is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        scope = [conversation_id]
+    else:
+        scope = select(ConversationMember.conversation_id).where(ConversationMember.user_id == user.id)
+
+    query = message_search.search_query(words, db.bind.dialect.name, scope, before_id, limit + 1)
+    rows = (await db.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = [{
+        "id": row.id,
+        "conversation_id": row.conversation_id,
+        "sender_id": row.sender_id,
+        "sender_username": row.username or "Unknown",
+        "snippet": message_search.make_snippet(row.content, words),
+        "timestamp": row.created_at.isoformat() if row.created_at else None,
+    } for row in rows]
+    # pass next_cursor back as before_id for older hits
+    return {"results": results, "next_cursor": results[-1]["id"] if has_more else None}
 
 @router.patch("/profile/")
-async def update_profile(data: ProfileUpdate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def update_profile(data: ProfileUpdate, user: User = Depends(get_current_user_row), db: AsyncSession = Depends(get_db)):
     print(f"DEBUG: update_profile called with: {data}")
     if data.full_name is not None:
         user.full_name = data.full_name
@@ -183,19 +258,23 @@ async def update_profile(data: ProfileUpdate, user: User = Depends(get_current_u
         user.about = data.about
     if data.profile_picture is not None:
         print(f"DEBUG: Updating profile_picture. Length: {len(data.profile_picture)}")
-        user.avatar = data.profile_picture
+        try:
+            await apply_profile_picture(user, data.profile_picture)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
     print(f"DEBUG: Committing changes for user {user.id}")
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    principal_cache.invalidate(user.id)
     
     return {
         "id": user.id,
         "username": user.username,
         "full_name": user.full_name,
         "about": user.about,
-        "profile_picture": user.avatar
+        **avatar_fields(user.avatar_key, user.avatar_version)
     }
 
 
@@ -1,11 +1,12 @@
 from fastapi import Depends, HTTPException, status, Header
 from app.utils.security import decode_token
 from app.db.session import get_db
+from app.db.principals import Principal, principal_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models.user import User
 
-async def get_current_user(authorization: str | None = Header(None), db: AsyncSession = Depends(get_db)):
+async def get_current_user(authorization: str | None = Header(None)) -> Principal:
     if not authorization:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing auth")
 
@@ -17,6 +18,11 @@ async def get_current_user(authorization: str | None = Header(None), db: AsyncSe
     if scheme.lower() != "bearer":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid auth scheme")
 
+    # a token seen recently was already verified and its user loaded
+    principal = principal_cache.get(token)
+    if principal:
+        return principal
+
     payload = decode_token(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token")
@@ -24,24 +30,32 @@ async def get_current_user(authorization: str | None = Header(None), db: AsyncSe
     user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token payload")
-    
+
     try:
         user_id = int(user_id)
         print(f"DEBUG: user_id cast to int: {user_id} (type: {type(user_id)})")
     except ValueError:
         print(f"ERROR: Could not cast user_id to int: {user_id}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid user id in token")
-        
+
     # Fetch user from DB to ensure they exist
     try:
-        result = await db.execute(select(User).where(User.id == user_id))
-        user = result.scalars().first()
-        if not user:
-            print(f"ERROR: User {user_id} not found in DB")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user not found")
-        return user
+        principal = await principal_cache.load(token, user_id, payload.get("exp"))
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
         print(f"CRITICAL DB ERROR in get_current_user: {e}\n{tb}")
         raise HTTPException(status_code=500, detail=f"DB Error: {str(e)}")
+    if not principal:
+        print(f"ERROR: User {user_id} not found in DB")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user not found")
+    return principal
+
+
+async def get_current_user_row(principal: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> User:
+    """The full ORM row of the authenticated user, for endpoints that modify it."""
+    result = await db.execute(select(User).where(User.id == principal.id))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user not found")
+    return user
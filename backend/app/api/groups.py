@@ -0,0 +1,237 @@
+# app/api/groups.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.api.deps import get_current_user
+from app.config import settings
+from app.db import groups
+from app.db.principals import Principal
+from app.db.session import get_db
+from app.media.avatars import avatar_fields
+from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+from app.models.user import User
+
+router = APIRouter(prefix="/groups")
+
+MESSAGES_PAGE_DEFAULT = 50
+MESSAGES_PAGE_MAX = 200
+# unread counts are counted off the read watermark; past this the client shows "999+"
+UNREAD_COUNT_CAP = 999
+
+
+class GroupCreate(BaseModel):
+    title: str = Field(min_length=1, max_length=100)
+    member_ids: list[int] = []
+
+
+class MembersAdd(BaseModel):
+    user_ids: list[int]
+
+
+async def _require_member(db: AsyncSession, conversation_id: int, user_id: int) -> ConversationMember:
+    membership = await groups.get_membership(db, conversation_id, user_id)
+    if not membership:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return membership
+
+
+async def _check_users_exist(db: AsyncSession, user_ids: set[int]):
+    found = (await db.execute(select(func.count(User.id)).where(User.id.in_(user_ids)))).scalar()
+    if found != len(user_ids):
+        raise HTTPException(status_code=400, detail="Unknown user in member list")
+
+
+def _unread_count(conversation_id, user_id, last_read):
+    # a range over messages(conversation_id, id), capped so a long-muted group stays cheap
+    unread = (
+        select(Message.id)
+        .where(Message.conversation_id == conversation_id, Message.id > func.coalesce(last_read, 0),
+               Message.sender_id != user_id)
+        .limit(UNREAD_COUNT_CAP + 1)
+        .correlate_except(Message)
+        .subquery()
+    )
+    return select(func.count()).select_from(unread).scalar_subquery()
+
+
+@router.post("/")
+async def create_group(data: GroupCreate, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    member_ids = set(data.member_ids) - {user.id}
+    if len(member_ids) + 1 > settings.GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"Groups are limited to {settings.GROUP_MAX_MEMBERS} members")
+    if member_ids:
+        await _check_users_exist(db, member_ids)
+    conversation_id = await groups.create_group(db, user.id, data.title, member_ids)
+    await db.commit()
+    return {"id": conversation_id, "title": data.title, "member_count": len(member_ids) + 1}
+
+
+@router.get("/")
+async def list_groups(user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # one query: the user's memberships, member counts, capped unread counts and the latest message
+    member_count = (
+        select(func.count())
+        .where(ConversationMember.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    last_message_id = (
+        select(func.max(Message.id))
+        .where(Message.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    last_message = aliased(Message)
+    result = await db.execute(
+        select(
+            Conversation.id, Conversation.title, ConversationMember.role, member_count.label("member_count"),
+            _unread_count(Conversation.id, user.id, ConversationMember.last_read_message_id).label("unread_count"),
+            last_message.id.label("last_message_id"), last_message.content, last_message.created_at,
+        )
+        .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+        .outerjoin(last_message, last_message.id == last_message_id)
+        .where(ConversationMember.user_id == user.id, Conversation.is_group == True)
+        .order_by(func.coalesce(last_message.id, 0).desc(), Conversation.id.desc())
+    )
+    return [{
+        "id": row.id,
+        "title": row.title,
+        "role": row.role,
+        "member_count": row.member_count,
+        "unread_count": row.unread_count,
+        "last_message": {
+            "id": row.last_message_id,
+            "content": row.content,
+            "timestamp": row.created_at.isoformat() if row.created_at else None,
+        } if row.last_message_id else None,
+    } for row in result.all()]
+
+
+@router.get("/{conversation_id}/")
+async def get_group(conversation_id: int, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await _require_member(db, conversation_id, user.id)
+    conversation = (await db.execute(select(Conversation).where(Conversation.id == conversation_id))).scalar_one()
+    # members and their profiles in one query
+    result = await db.execute(
+        select(ConversationMember.role, User.id, User.username, User.full_name, User.avatar_key, User.avatar_version)
+        .join(User, User.id == ConversationMember.user_id)
+        .where(ConversationMember.conversation_id == conversation_id)
+        .order_by(User.username)
+    )
+    return {
+        "id": conversation.id,
+        "title": conversation.title,
+        "created_by": conversation.created_by,
+        "members": [{
+            "id": row.id,
+            "username": row.username,
+            "full_name": row.full_name,
+            "role": row.role,
+            **avatar_fields(row.avatar_key, row.avatar_version),
+        } for row in result.all()],
+    }
+
+
+@router.post("/{conversation_id}/members/")
+async def add_members(conversation_id: int, data: MembersAdd, user: Principal = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_db)):
+    membership = await _require_member(db, conversation_id, user.id)
+    if membership.role != groups.ADMIN:
+        raise HTTPException(status_code=403, detail="Only group admins can add members")
+    user_ids = set(data.user_ids)
+    if user_ids:
+        await _check_users_exist(db, user_ids)
+    try:
+        added = await groups.add_members(db, conversation_id, user_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    return {"added": added}
+
+
+@router.delete("/{conversation_id}/members/{member_id}")
+async def remove_member(conversation_id: int, member_id: int, user: Principal = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_db)):
+    membership = await _require_member(db, conversation_id, user.id)
+    # anyone may leave (a last admin hands the role on); only admins remove others
+    if member_id != user.id and membership.role != groups.ADMIN:
+        raise HTTPException(status_code=403, detail="Only group admins can remove members")
+    removed = await groups.remove_member(db, conversation_id, member_id)
+    await db.commit()
+    return {"removed": removed}
+
+
+@router.get("/{conversation_id}/messages/")
+async def get_group_messages(
+    conversation_id: int,
+    before_id: int | None = Query(None, description="page of messages older than this id"),
+    limit: int = Query(MESSAGES_PAGE_DEFAULT, ge=1, le=MESSAGES_PAGE_MAX),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await _require_member(db, conversation_id, user.id)
+    # Keyset page over (conversation_id, id), newest page first; one extra row says whether there is more
+    query = (
+        select(Message, User.username)
+        .outerjoin(User, User.id == Message.sender_id)
+        .where(Message.conversation_id == conversation_id)
+    )
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    rows = (await db.execute(query.order_by(Message.id.desc()).limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = [{
+        "id": msg.id,
+        "content": msg.content,
+        "timestamp": msg.created_at.isoformat(),
+        "sender_id": msg.sender_id,
+        "sender_username": username or "Unknown",
+    } for msg, username in rows]
+    # pass prev_cursor back as before_id to scroll back
+    return {"messages": messages, "prev_cursor": messages[0]["id"] if has_more and messages else None}
+
+
+@router.post("/{conversation_id}/read/")
+async def mark_group_read(conversation_id: int, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await _require_member(db, conversation_id, user.id)
+    watermark = (await db.execute(
+        select(func.max(Message.id)).where(Message.conversation_id == conversation_id)
+    )).scalar()
+    if watermark is None:
+        return {"status": "success", "last_read_message_id": None}
+    # one row: what the member has read is implicitly delivered too. Only ever forward.
+    await db.execute(groups.advance_statement("last_read_message_id"),
+                     [{"cid": conversation_id, "uid": user.id, "mid": watermark}])
+    await db.execute(groups.advance_statement("last_delivered_message_id"),
+                     [{"cid": conversation_id, "uid": user.id, "mid": watermark}])
+    await db.commit()
+    return {"status": "success", "last_read_message_id": watermark}
+
+
+@router.get("/{conversation_id}/messages/{message_id}/receipts/")
+async def get_receipts(conversation_id: int, message_id: int, user: Principal = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_db)):
+    await _require_member(db, conversation_id, user.id)
+    sender_id = (await db.execute(
+        select(Message.sender_id).where(Message.id == message_id, Message.conversation_id == conversation_id)
+    )).scalar()
+    if sender_id is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    # counted off the members' watermarks; a live delivery shows up once its watermark is written
+    others = and_(ConversationMember.conversation_id == conversation_id, ConversationMember.user_id != sender_id)
+    row = (await db.execute(
+        select(
+            func.count(),
+            func.count().filter(ConversationMember.last_delivered_message_id >= message_id),
+            func.count().filter(ConversationMember.last_read_message_id >= message_id),
+        ).where(others)
+    )).one()
+    recipients, delivered, read = row
+    return {"message_id": message_id, "recipients": recipients, "delivered": delivered, "read": read}
@@ -0,0 +1,125 @@
+# app/api/media.py
+"""
+Serves stored uploads and their previews.
+
+URLs are named by content hash, so the bytes behind a URL never change:
+responses carry a strong ETag (the hash), `immutable` caching and byte-range
+support, which is what lets a video seek or a dropped download resume
+without re-sending the whole file. No database access on the byte path.
+"""
+import mimetypes
+import os
+import re
+import aiofiles
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.db.session import get_db
+from app.media.store import media_info, object_path, thumb_path
+from app.models.media_object import MediaObject
+
+router = APIRouter(prefix="/media")
+
+NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(\.[a-z0-9]{1,8})?$")
+SHA_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _parse_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, None if it can't be
+    satisfied, or "full" when the header should be ignored (malformed or
+    multiple ranges; answering those with the whole body is allowed).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return "full"
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return "full"
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+async def _iter_file(path: str, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(settings.UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _send_file(request: Request, path: str, media_type: str, etag: str, headers: dict | None = None):
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes", **(headers or {})}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(path)
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        parsed = _parse_range(range_header, size)
+        if parsed is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if parsed != "full":
+            start, end = parsed
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=status, headers=headers, media_type=media_type)
+
+
+@router.get("/{sha256}/info")
+async def get_media_info(sha256: str, db: AsyncSession = Depends(get_db)):
+    obj = await db.get(MediaObject, sha256) if SHA_PATTERN.match(sha256) else None
+    if not obj:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return media_info(obj)
+
+
+@router.api_route("/{sha256}/thumb/{size}.jpg", methods=["GET", "HEAD"])
+async def get_thumbnail(sha256: str, size: int, request: Request):
+    if not SHA_PATTERN.match(sha256) or size not in settings.MEDIA_THUMB_SIZES:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    path = thumb_path(sha256, size)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return _send_file(request, path, "image/jpeg", f'"{sha256}-{size}"')
+
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+async def get_media(name: str, request: Request):
+    match = NAME_PATTERN.match(name)
+    if not match:
+        raise HTTPException(status_code=404, detail="Media not found")
+    sha256, ext = match.group(1), match.group(2) or ""
+    path = object_path(sha256, ext)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Media not found")
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    # precompressed variant for text-like files; ranges always address the identity bytes
+    if os.path.exists(path + ".gz"):
+        vary = {"Vary": "Accept-Encoding"}
+        if "gzip" in request.headers.get("accept-encoding", "") and "range" not in request.headers:
+            return _send_file(request, path + ".gz", media_type, f'"{sha256}-gz"', {**vary, "Content-Encoding": "gzip"})
+        return _send_file(request, path, media_type, f'"{sha256}"', vary)
+    return _send_file(request, path, media_type, f'"{sha256}"')
@@ -1,33 +1,165 @@
+import asyncio
+import contextlib
+import hashlib
 import os
-import time
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Header, status
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.config import settings
-from app.utils.security import decode_token
+from app.db.session import get_db
+from app.media.store import (
+    UploadTooLarge, commit_object, hash_file, iter_upload_file, media_info, partial_path, process_object, stream_to_file,
+)
+from app.models.upload_session import UploadSession
 from app.models.user import User
-import aiofiles  # pip install aiofiles
 
 router = APIRouter(prefix="/uploads")
 
 from app.api.deps import get_current_user
+from app.db.principals import Principal
 
-# ensure upload dir exists
+# ensure upload dirs exist
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+os.makedirs(settings.UPLOAD_PARTIAL_DIR, exist_ok=True)
+
+# Per-process state for resumable uploads: appends to one session are serialized,
+# and the running hash is kept as (hasher, bytes hashed) so finalize rarely re-reads
+# the file. If a chunk lands on another worker the hash is just recomputed.
+_append_locks: dict[str, asyncio.Lock] = {}
+_hashers: dict[str, tuple] = {}
 
 
 @router.post("/")
-async def upload(file: UploadFile = File(...), user: User = Depends(get_current_user)):
-    filename = f"{user.id}_{int(time.time())}_{file.filename}"
-    path = os.path.join(settings.UPLOAD_DIR, filename)
-
-    # Async write (recommended)
-    async with aiofiles.open(path, "wb") as out_file:
-        content = await file.read()
-        await out_file.write(content)
-
-    # --- fallback (synchronous) if you don't want aiofiles ---
-    # content = await file.read()
-    # with open(path, "wb") as f:
-    #     f.write(content)
-
-    url = f"/uploads/{filename}"
-    return {"url": url}
+async def upload(file: UploadFile = File(...), user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    tmp_path = partial_path(uuid.uuid4().hex)
+    hasher = hashlib.sha256()
+    try:
+        try:
+            size = await stream_to_file(
+                iter_upload_file(file, settings.UPLOAD_CHUNK_SIZE), tmp_path, settings.UPLOAD_MAX_BYTES, hasher=hasher,
+            )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        obj = await commit_object(db, tmp_path, hasher.hexdigest(), size, file.filename, file.content_type)
+    finally:
+        # commit_object moves the file into the store; anything else (too large, a client
+        # disconnect, a failed write) must not leave it behind in UPLOAD_PARTIAL_DIR
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+    obj = await process_object(db, obj)
+    return media_info(obj)
+
+
+# --- resumable uploads: init / append chunk / finalize ----------------------
+
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+    content_type: str | None = None
+
+
+async def _purge_expired_sessions(db: AsyncSession):
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+    result = await db.execute(select(UploadSession.id).where(UploadSession.created_at < cutoff).limit(100))
+    expired = result.scalars().all()
+    if not expired:
+        return
+    for upload_id in expired:
+        _hashers.pop(upload_id, None)
+        _append_locks.pop(upload_id, None)
+        if os.path.exists(partial_path(upload_id)):
+            os.unlink(partial_path(upload_id))
+    await db.execute(delete(UploadSession).where(UploadSession.id.in_(expired)))
+    await db.commit()
+
+
+async def _get_session(db: AsyncSession, upload_id: str, user: User) -> UploadSession:
+    session = await db.get(UploadSession, upload_id)
+    if not session or session.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+def _status(session: UploadSession, offset: int) -> dict:
+    return {"upload_id": session.id, "offset": offset, "size": session.size, "chunk_size": settings.UPLOAD_CHUNK_SIZE}
+
+
+@router.post("/sessions/")
+async def init_upload(payload: UploadInit, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if payload.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    if payload.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"upload larger than {settings.UPLOAD_MAX_BYTES} bytes")
+    await _purge_expired_sessions(db)
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        filename=payload.filename[:255],
+        content_type=payload.content_type,
+        size=payload.size,
+    )
+    open(partial_path(session.id), "wb").close()
+    _hashers[session.id] = (hashlib.sha256(), 0)
+    db.add(session)
+    await db.commit()
+    return _status(session, 0)
+
+
+@router.get("/sessions/{upload_id}")
+async def upload_status(upload_id: str, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # a client resuming after a dropped connection asks where to continue from
+    session = await _get_session(db, upload_id, user)
+    return _status(session, os.path.getsize(partial_path(upload_id)))
+
+
+@router.put("/sessions/{upload_id}")
+async def append_chunk(upload_id: str, request: Request, offset: int = Query(...),
+                       user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Append the raw request body at `offset`, which must be the number of bytes received so far."""
+    session = await _get_session(db, upload_id, user)
+    path = partial_path(upload_id)
+    async with _append_locks.setdefault(upload_id, asyncio.Lock()):
+        current = os.path.getsize(path)
+        if offset != current:
+            raise HTTPException(status_code=409, detail={"error": "offset mismatch", "offset": current})
+
+        hasher, hashed = _hashers.pop(upload_id, (None, None))
+        if hashed != current:
+            hasher = None
+        try:
+            written = await stream_to_file(request.stream(), path, session.size - current, mode="ab", hasher=hasher)
+        except UploadTooLarge as e:
+            os.truncate(path, current)
+            raise HTTPException(status_code=413, detail=str(e))
+        # on a dropped connection the bytes that did arrive are kept; the client resumes from upload_status
+
+        if hasher is not None:
+            _hashers[upload_id] = (hasher, current + written)
+    return _status(session, current + written)
+
+
+@router.post("/sessions/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    session = await _get_session(db, upload_id, user)
+    path = partial_path(upload_id)
+    async with _append_locks.setdefault(upload_id, asyncio.Lock()):
+        current = os.path.getsize(path)
+        if current != session.size:
+            raise HTTPException(status_code=409, detail={"error": "upload incomplete", "offset": current})
+
+        hasher, hashed = _hashers.pop(upload_id, (None, None))
+        if hasher is not None and hashed == current:
+            sha256 = hasher.hexdigest()
+        else:
+            sha256 = await asyncio.to_thread(hash_file, path, settings.UPLOAD_CHUNK_SIZE)
+
+        obj = await commit_object(db, path, sha256, current, session.filename, session.content_type)
+        await db.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+        await db.commit()
+    _append_locks.pop(upload_id, None)
+    obj = await process_object(db, obj)
+    return media_info(obj)
@@ -7,9 +7,110 @@ class Settings(BaseSettings):
 
     # Database (default to sqlite so dev runs out of the box)
     DATABASE_URL: str = "sqlite+aiosqlite:///./test.db"
+    # Engine profile (app/db/profiles.py): "sqlite" (dev), "sqlite_writer" (single-writer SQLite for
+    # small self-hosted deployments), "postgres" (asyncpg, production), or "auto" (sqlite/postgres from the URL)
+    DB_PROFILE: str = "auto"
+    # postgres profile pool, per worker process: steady connections, extra ones under bursts,
+    # and how long a request waits for one before failing
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    # reopen connections older than this (keep it under any server/proxy idle timeout)
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    # prepared statements cached per connection; set 0 behind pgbouncer in transaction pooling mode
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    # sqlite_writer connections (app/db/sqlite_writer.py): how long to wait on another
+    # process's lock, page cache and memory-mapped I/O per connection
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
 
     # Upload folder used by app/api/uploads.py
     UPLOAD_DIR: str = "./uploads"
+    # Uploads stream through here (same filesystem as UPLOAD_DIR, outside the static mount)
+    UPLOAD_PARTIAL_DIR: str = "./uploads-partial"
+    UPLOAD_MAX_BYTES: int = 200 * 1024 * 1024
+    # read/write/hash granularity, and the chunk size suggested to resumable clients
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # unfinished resumable uploads older than this are discarded
+    UPLOAD_SESSION_TTL_HOURS: int = 24
+
+    # Content-addressed image store (app/media/). Avatars are rendered into
+    # AVATAR_SIZES square JPEGs by IMAGE_WORKERS processes; responses link AVATAR_DEFAULT_SIZE.
+    MEDIA_DIR: str = "./media"
+    IMAGE_WORKERS: int = 2
+    AVATAR_MAX_BYTES: int = 5 * 1024 * 1024
+    AVATAR_SIZES: list[int] = [64, 192, 640]
+    AVATAR_DEFAULT_SIZE: int = 192
+    # longest side of the previews generated for uploaded images
+    MEDIA_THUMB_SIZES: list[int] = [320, 1280]
+
+    # Group-commit writers for chat messages (app/db/message_writer.py) and small writes
+    # like last_seen (app/db/group_commit.py). A batch is flushed when it reaches
+    # MESSAGE_BATCH_MAX_SIZE rows or when the oldest queued item has waited
+    # MESSAGE_BATCH_MAX_LINGER_MS, whichever is first.
+    MESSAGE_BATCH_MAX_SIZE: int = 200
+    MESSAGE_BATCH_MAX_LINGER_MS: float = 5.0
+
+    # Password hashing pool (app/utils/security.py): PASSWORD_WORKERS processes, and at most
+    # PASSWORD_QUEUE_SIZE more logins/registrations waiting before new ones get a 503
+    PASSWORD_WORKERS: int = 2
+    PASSWORD_QUEUE_SIZE: int = 32
+    # Retry-After (seconds) sent with that 503
+    PASSWORD_BUSY_RETRY_AFTER: int = 1
+
+    # Verified token -> user principal cache in get_current_user (app/db/principals.py).
+    # Profile edits invalidate it on the worker that handled them; other workers catch up within the TTL.
+    AUTH_CACHE_TTL_SECONDS: float = 30
+    AUTH_CACHE_SIZE: int = 10000
+
+    # Max (user, user) -> conversation_id pairs kept in the resolver's LRU cache
+    CONVERSATION_CACHE_SIZE: int = 10000
+
+    # Cross-worker delivery for websockets (app/sockets/bus.py):
+    #   "local"  - single worker, no bus
+    #   "memory" - in-process bus, for tests
+    #   "unix"   - hub process on BUS_SOCKET_PATH (python -m app.sockets.hub)
+    DELIVERY_BUS: str = "local"
+    BUS_SOCKET_PATH: str = "/tmp/whatsap-bus.sock"
+    # Bytes the hub may buffer for one worker that isn't reading before it
+    # disconnects it (the worker reconnects and re-claims its users)
+    BUS_WORKER_BUFFER_BYTES: int = 8 * 1024 * 1024
+
+    # Per-socket outbound queue (app/sockets/connection_manager.py). When a
+    # receiver falls this far behind:
+    #   "drop_ephemeral" - drop presence/ICE events, disconnect only if a chat event won't fit
+    #   "disconnect"     - disconnect the slow consumer on any overflow
+    OUTBOUND_QUEUE_SIZE: int = 256
+    OUTBOUND_OVERFLOW_POLICY: str = "drop_ephemeral"
+
+    # Online/offline flaps for a user within this window are sent as one final state
+    PRESENCE_COALESCE_MS: float = 2000
+
+    # Messages per inbox_batch frame when pushing the offline backlog on connect
+    INBOX_BATCH_SIZE: int = 200
+
+    # Group conversations (app/db/groups.py)
+    GROUP_MAX_MEMBERS: int = 1024
+    # local sockets fed per step of a group fan-out before yielding to other traffic
+    FANOUT_BATCH_SIZE: int = 256
+    # delivered watermarks of online members are collected and written this often
+    GROUP_DELIVERY_FLUSH_MS: float = 500
+
+    # Resumable websocket sessions (app/sockets/replay.py): the last REPLAY_BUFFER_SIZE chat
+    # events per user, kept REPLAY_RETENTION_SECONDS after their last socket closes
+    REPLAY_BUFFER_SIZE: int = 512
+    REPLAY_RETENTION_SECONDS: float = 120
+
+    # Server-side call sessions (app/sockets/calls.py)
+    # an offer nobody answers ends as a missed call after this long
+    CALL_OFFER_TIMEOUT_SECONDS: float = 45
+    # media is peer to peer, so an active call outlives a dropped chat socket by this long
+    CALL_RECONNECT_GRACE_SECONDS: float = 60
+    # trickled ICE candidates for the same peer within this window go out as one frame
+    ICE_BATCH_MS: float = 20
+    # candidates held per side of a call before it is answered
+    ICE_MAX_PENDING: int = 100
 
     model_config = SettingsConfigDict(
         env_file=".env",
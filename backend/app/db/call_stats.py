@@ -0,0 +1,117 @@
+# app/db/call_stats.py
+"""
+Call rollups behind GET /calls/stats/.
+
+A call counts once it is closed (gets its end_time). The request that closes
+it adds the call to two call_stats rows, one per side, in the same
+transaction, so stats read one row per contact instead of scanning
+call_logs. Increments are upserts, so concurrent calls between the same
+pair just add up.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import select, update, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from app.models.call_log import CallLog
+from app.models.call_stat import CallStat
+
+ANSWERED = "accepted"
+MISSED = "missed"
+
+_COUNTERS = ("outgoing", "incoming", "missed", "talk_seconds")
+
+# rollup rows per upsert statement in the backfill (7 bound parameters each)
+_UPSERT_CHUNK = 500
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes (server-side now() is UTC)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def talk_seconds(call: CallLog) -> int:
+    if call.status != ANSWERED or call.start_time is None or call.end_time is None:
+        return 0
+    return max(0, int((_as_utc(call.end_time) - _as_utc(call.start_time)).total_seconds()))
+
+
+def clamp_end_time(call: CallLog, end_time: datetime | None) -> datetime:
+    """
+    A client-reported end time, kept between the call's start and the server's
+    now (now if none was given), so nobody can add talk time that never happened.
+    """
+    now = datetime.now(timezone.utc)
+    end_time = now if end_time is None else min(_as_utc(end_time), now)
+    if call.start_time is not None:
+        end_time = max(end_time, _as_utc(call.start_time))
+    return end_time
+
+
+def _side_rows(call: CallLog) -> list[dict]:
+    seconds = talk_seconds(call)
+    return [
+        {"user_id": call.caller_id, "contact_id": call.receiver_id, "outgoing": 1, "incoming": 0,
+         "missed": 0, "talk_seconds": seconds, "last_call_at": call.end_time},
+        {"user_id": call.receiver_id, "contact_id": call.caller_id, "outgoing": 0, "incoming": 1,
+         "missed": int(call.status == MISSED), "talk_seconds": seconds, "last_call_at": call.end_time},
+    ]
+
+
+def _upsert(dialect: str, rows: list[dict]):
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(CallStat).values(rows)
+    later = stmt.excluded.last_call_at
+    return stmt.on_conflict_do_update(
+        index_elements=[CallStat.user_id, CallStat.contact_id],
+        set_={
+            **{name: getattr(CallStat, name) + getattr(stmt.excluded, name) for name in _COUNTERS},
+            "last_call_at": case((CallStat.last_call_at > later, CallStat.last_call_at), else_=later),
+        },
+    )
+
+
+async def record_closed_call(db: AsyncSession, call: CallLog):
+    """Add a just-closed call to both sides' rollups; the caller commits."""
+    await db.execute(_upsert(db.bind.dialect.name, _side_rows(call)))
+
+
+async def close_call(db: AsyncSession, call_id: int, status: str, end_time: datetime) -> CallLog | None:
+    """
+    Close a call and count it, unless it is already closed (then None).
+
+    The conditional UPDATE lets only the first of two racing hang-ups close
+    the call, so it reaches the rollups exactly once. The caller commits.
+    """
+    result = await db.execute(
+        update(CallLog)
+        .where(CallLog.id == call_id, CallLog.end_time.is_(None))
+        .values(status=status, end_time=end_time)
+    )
+    if not result.rowcount:
+        return None
+    call = (await db.execute(
+        select(CallLog).where(CallLog.id == call_id).execution_options(populate_existing=True)
+    )).scalar_one()
+    await record_closed_call(db, call)
+    return call
+
+
+async def backfill(conn: AsyncConnection, min_id: int, max_id: int):
+    """Roll up the closed calls with ids in [min_id, max_id] (for the migration)."""
+    result = await conn.execute(
+        select(CallLog).where(CallLog.id >= min_id, CallLog.id <= max_id, CallLog.end_time.is_not(None))
+    )
+    totals: dict[tuple[int, int], dict] = {}
+    for call in result.all():
+        for row in _side_rows(call):
+            key = (row["user_id"], row["contact_id"])
+            if key not in totals:
+                totals[key] = row
+                continue
+            total = totals[key]
+            for name in _COUNTERS:
+                total[name] += row[name]
+            total["last_call_at"] = max(total["last_call_at"], row["last_call_at"], key=_as_utc)
+    rows = list(totals.values())
+    for start in range(0, len(rows), _UPSERT_CHUNK):
+        await conn.execute(_upsert(conn.dialect.name, rows[start:start + _UPSERT_CHUNK]))
@@ -0,0 +1,139 @@
+# app/db/conversations.py
+from collections import OrderedDict
+from sqlalchemy import select, insert, func, and_, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+
+
+def canonical_pair(user_a: int, user_b: int) -> tuple[int, int]:
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+
+class ConversationResolver:
+    """
+    Resolves a (user, user) pair to its 1-on-1 conversation id.
+
+    Pairs are stored in canonical (min, max) order under the
+    uq_conversations_pair index, so a lookup is a single index probe and two
+    racing first messages cannot both insert a row. Resolved ids are kept in
+    a bounded LRU cache; conversations are never re-keyed, so entries don't
+    need invalidating.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_size: int | None = None):
+        self.session_factory = session_factory
+        self.max_size = max_size or settings.CONVERSATION_CACHE_SIZE
+        self._cache: OrderedDict[tuple[int, int], int] = OrderedDict()
+
+    def _remember(self, pair: tuple[int, int], conversation_id: int):
+        self._cache[pair] = conversation_id
+        self._cache.move_to_end(pair)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _lookup(self, db: AsyncSession, pair: tuple[int, int]) -> int | None:
+        low, high = pair
+        result = await db.execute(
+            select(Conversation.id).where(Conversation.user1_id == low, Conversation.user2_id == high)
+        )
+        conversation_id = result.scalar()
+        if conversation_id is None:
+            # rows created before pairs were canonicalised may be stored (high, low)
+            result = await db.execute(
+                select(Conversation.id).where(Conversation.user1_id == high, Conversation.user2_id == low)
+            )
+            conversation_id = result.scalar()
+        return conversation_id
+
+    async def get(self, db: AsyncSession, user_a: int, user_b: int) -> int | None:
+        """Return the conversation id for the pair, or None if they have never talked."""
+        pair = canonical_pair(user_a, user_b)
+        conversation_id = self._cache.get(pair)
+        if conversation_id is not None:
+            self._cache.move_to_end(pair)
+            return conversation_id
+
+        conversation_id = await self._lookup(db, pair)
+        if conversation_id is not None:
+            self._remember(pair, conversation_id)
+        return conversation_id
+
+    async def get_or_create(self, user_a: int, user_b: int) -> int:
+        pair = canonical_pair(user_a, user_b)
+        conversation_id = self._cache.get(pair)
+        if conversation_id is not None:
+            self._cache.move_to_end(pair)
+            return conversation_id
+
+        # Work in a session of our own so losing the insert race doesn't roll back the caller's work.
+        async with self.session_factory() as session:
+            conversation_id = await self._lookup(session, pair)
+            if conversation_id is None:
+                try:
+                    result = await session.execute(
+                        insert(Conversation).values(user1_id=pair[0], user2_id=pair[1]).returning(Conversation.id)
+                    )
+                    conversation_id = result.scalar_one()
+                    await session.execute(insert(ConversationMember), [
+                        {"conversation_id": conversation_id, "user_id": pair[0], "unread_count": 0},
+                        {"conversation_id": conversation_id, "user_id": pair[1], "unread_count": 0},
+                    ])
+                    await session.commit()
+                except IntegrityError:
+                    # Someone else created it between our lookup and insert: use theirs.
+                    await session.rollback()
+                    conversation_id = await self._lookup(session, pair)
+                    if conversation_id is None:
+                        raise
+
+        self._remember(pair, conversation_id)
+        return conversation_id
+
+    def clear(self):
+        self._cache.clear()
+
+
+async def backfill_members(conn: AsyncConnection, min_id: int | None = None, max_id: int | None = None):
+    """
+    Create the missing conversation_members rows for conversations that
+    predate the table, seeding unread_count from the message flags.
+    min_id/max_id limit the run to one range of conversation ids.
+    """
+    conversations = select(Conversation.id, Conversation.user1_id, Conversation.user2_id)
+    if min_id is not None:
+        conversations = conversations.where(Conversation.id >= min_id)
+    if max_id is not None:
+        conversations = conversations.where(Conversation.id <= max_id)
+    conversations = conversations.subquery()
+    participants = union_all(
+        select(conversations.c.id.label("conversation_id"), conversations.c.user1_id.label("user_id")),
+        select(conversations.c.id.label("conversation_id"), conversations.c.user2_id.label("user_id")),
+    ).subquery()
+    unread = (
+        select(func.count(Message.id))
+        .where(
+            Message.conversation_id == participants.c.conversation_id,
+            Message.sender_id != participants.c.user_id,
+            Message.read == False,
+        )
+        .scalar_subquery()
+    )
+    missing = (
+        select(participants.c.conversation_id, participants.c.user_id, unread)
+        .outerjoin(ConversationMember, and_(
+            ConversationMember.conversation_id == participants.c.conversation_id,
+            ConversationMember.user_id == participants.c.user_id,
+        ))
+        .where(ConversationMember.user_id.is_(None))
+    )
+    await conn.execute(
+        insert(ConversationMember).from_select(["conversation_id", "user_id", "unread_count"], missing)
+    )
+
+
+conversation_resolver = ConversationResolver()
@@ -0,0 +1,110 @@
+# app/db/group_commit.py
+import asyncio
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+
+_STOP = object()
+
+
+class GroupCommitQueue:
+    """
+    A single task that drains a queue of (item, future) pairs in batches.
+
+    A batch closes at max_batch_size items or when its first item has waited
+    max_linger_ms, whichever comes first; subclasses write it in one
+    transaction in `_flush` and resolve the futures.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch_size: int | None = None, max_linger_ms: float | None = None):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size or settings.MESSAGE_BATCH_MAX_SIZE
+        linger_ms = settings.MESSAGE_BATCH_MAX_LINGER_MS if max_linger_ms is None else max_linger_ms
+        self.max_linger = linger_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Let everything already queued reach the database before exiting.
+        if not self._task:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _enqueue(self, item):
+        if not self._task or self._task.done():
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_linger
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        raise NotImplementedError
+
+
+class StatementWriter(GroupCommitQueue):
+    """
+    Group commit for small, independent Core writes (last_seen bumps and the like).
+
+    `execute(stmt)` waits until the statement is committed and returns its
+    rowcount. A batch runs in one transaction; if that fails, its statements
+    are retried one per transaction so a bad one only fails its own caller.
+    """
+
+    async def execute(self, stmt) -> int:
+        return await self._enqueue(stmt)
+
+    async def _flush(self, batch: list):
+        try:
+            async with self.session_factory() as db:
+                counts = [(await db.execute(stmt)).rowcount for stmt, _ in batch]
+                await db.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                for item in batch:
+                    await self._flush([item])
+                return
+            print(f"ERROR executing batched write: {e}")
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        for (_, future), count in zip(batch, counts):
+            if not future.done():
+                future.set_result(count)
+
+
+statement_writer = StatementWriter()
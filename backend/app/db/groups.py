@@ -0,0 +1,204 @@
+# app/db/groups.py
+"""
+Group conversations.
+
+A group is a conversation with is_group set and no user pair; its members
+are its conversation_members rows. Nothing is stored per recipient per
+message: each member has two watermarks,
+
+  last_delivered_message_id - everything up to here has been pushed to them
+  last_read_message_id      - everything up to here has been read
+
+so unread counts, backlogs and receipts are ranges over messages(conversation_id, id).
+A member joins with both watermarks at the group's newest message, so they
+start without a backlog of the history.
+"""
+import asyncio
+from sqlalchemy import select, insert, update, delete, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+
+ADMIN = "admin"
+MEMBER = "member"
+
+
+async def get_membership(db: AsyncSession, conversation_id: int, user_id: int) -> ConversationMember | None:
+    """user_id's member row in group conversation_id, or None if either doesn't exist."""
+    result = await db.execute(
+        select(ConversationMember)
+        .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+        .where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id == user_id,
+            Conversation.is_group == True,
+        )
+    )
+    return result.scalars().first()
+
+
+async def member_ids(db: AsyncSession, conversation_id: int) -> list[int]:
+    """Members of group conversation_id (empty if it isn't a group)."""
+    result = await db.execute(
+        select(ConversationMember.user_id)
+        .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+        .where(ConversationMember.conversation_id == conversation_id, Conversation.is_group == True)
+    )
+    return list(result.scalars().all())
+
+
+async def _newest_message_id(db: AsyncSession, conversation_id: int) -> int | None:
+    result = await db.execute(select(func.max(Message.id)).where(Message.conversation_id == conversation_id))
+    return result.scalar()
+
+
+async def create_group(db: AsyncSession, creator_id: int, title: str, user_ids: set[int]) -> int:
+    """Create a group of creator_id (its admin) and user_ids; returns its id. The caller commits."""
+    result = await db.execute(
+        insert(Conversation).values(is_group=True, title=title, created_by=creator_id).returning(Conversation.id)
+    )
+    conversation_id = result.scalar_one()
+    await db.execute(insert(ConversationMember), [
+        {"conversation_id": conversation_id, "user_id": user_id, "unread_count": 0,
+         "role": ADMIN if user_id == creator_id else MEMBER}
+        for user_id in {creator_id, *user_ids}
+    ])
+    return conversation_id
+
+
+async def add_members(db: AsyncSession, conversation_id: int, user_ids: set[int]) -> list[int]:
+    """Add the user_ids that aren't members yet; returns them. The caller commits."""
+    existing = set(await member_ids(db, conversation_id))
+    new_ids = sorted(user_ids - existing)
+    if not new_ids:
+        return []
+    if len(existing) + len(new_ids) > settings.GROUP_MAX_MEMBERS:
+        raise ValueError(f"Groups are limited to {settings.GROUP_MAX_MEMBERS} members")
+    joined_at = await _newest_message_id(db, conversation_id)
+    await db.execute(insert(ConversationMember), [
+        {"conversation_id": conversation_id, "user_id": user_id, "unread_count": 0, "role": MEMBER,
+         "last_delivered_message_id": joined_at, "last_read_message_id": joined_at}
+        for user_id in new_ids
+    ])
+    return new_ids
+
+
+async def remove_member(db: AsyncSession, conversation_id: int, user_id: int) -> bool:
+    """
+    Remove user_id from the group. If that leaves members but no admin, the
+    member with the lowest user id is promoted so the group stays
+    manageable. The caller commits.
+    """
+    result = await db.execute(
+        delete(ConversationMember).where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id == user_id,
+        )
+    )
+    if not result.rowcount:
+        return False
+    admins = (await db.execute(
+        select(func.count()).where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.role == ADMIN,
+        )
+    )).scalar()
+    if not admins:
+        successor = (await db.execute(
+            select(func.min(ConversationMember.user_id)).where(ConversationMember.conversation_id == conversation_id)
+        )).scalar()
+        if successor is not None:
+            await db.execute(
+                update(ConversationMember)
+                .where(ConversationMember.conversation_id == conversation_id, ConversationMember.user_id == successor)
+                .values(role=ADMIN)
+            )
+    return True
+
+
+def advance_statement(column_name: str):
+    """
+    UPDATE moving one member watermark column forward only, for executemany
+    over {"cid", "uid", "mid"} params. Built on the table rather than the
+    mapped class so a session runs it as a plain executemany (on the writer).
+    """
+    members = ConversationMember.__table__
+    column = members.c[column_name]
+    return (
+        update(members)
+        .where(
+            members.c.conversation_id == bindparam("cid"),
+            members.c.user_id == bindparam("uid"),
+            func.coalesce(column, 0) < bindparam("mid"),
+        )
+        .values({column_name: bindparam("mid")})
+    )
+
+
+class DeliveryWatermarks:
+    """
+    Delivered watermarks of members who got a group message live.
+
+    Advancing is in memory (the highest message id per member); a background
+    task writes whatever moved every GROUP_DELIVERY_FLUSH_MS as one
+    executemany. A burst of messages to a busy group costs at most one row
+    write per member per flush instead of one per member per message. A crash
+    loses at most one interval, which only means those messages are pushed
+    again from the backlog on reconnect.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, flush_ms: float | None = None):
+        self.session_factory = session_factory
+        self.interval = (settings.GROUP_DELIVERY_FLUSH_MS if flush_ms is None else flush_ms) / 1000
+        self._pending: dict[tuple[int, int], int] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def advance(self, conversation_id: int, user_ids, message_id: int):
+        pending = self._pending
+        for user_id in user_ids:
+            key = (conversation_id, user_id)
+            if pending.get(key, 0) < message_id:
+                pending[key] = message_id
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with self.session_factory() as db:
+                await db.execute(advance_statement("last_delivered_message_id"), [
+                    {"cid": cid, "uid": uid, "mid": mid} for (cid, uid), mid in pending.items()
+                ])
+                await db.commit()
+        except Exception as e:
+            print(f"ERROR writing {len(pending)} group delivery watermarks: {e}")
+            # keep them for the next round, unless newer marks already replaced them
+            for key, mid in pending.items():
+                if self._pending.get(key, 0) < mid:
+                    self._pending[key] = mid
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+
+delivery_watermarks = DeliveryWatermarks()
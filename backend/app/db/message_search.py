@@ -0,0 +1,102 @@
+# app/db/message_search.py
+"""
+Full-text search over message content.
+
+SQLite: an external-content FTS5 table (unicode61 word tokens) that
+triggers on messages keep current, so rows group-committed by the message
+writer are searchable as soon as their batch commits. Postgres: a GIN
+index on to_tsvector('simple', content).
+
+Queries are the user's words ANDed together, the last one as a prefix
+(search-as-you-type). Results come newest first and page by message id.
+"""
+import html
+import re
+from sqlalchemy import select, func, table, column
+from app.models.message import Message
+from app.models.user import User
+
+_messages_fts = table("messages_fts", column("rowid"), column("messages_fts"))
+
+WORD = re.compile(r"\w+", re.UNICODE)
+SNIPPET_WIDTH = 120
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_fts ON messages USING gin (to_tsvector('simple', coalesce(content, '')))",
+]
+
+
+def query_words(q: str) -> list[str]:
+    return [w.lower() for w in WORD.findall(q or "")]
+
+
+def _match_clause(words: list[str], dialect: str):
+    if dialect == "postgresql":
+        # words are \w+ only, so nothing here can be tsquery syntax
+        terms = " & ".join(words[:-1] + [words[-1] + ":*"])
+        return func.to_tsvector("simple", func.coalesce(Message.content, "")).op("@@")(func.to_tsquery("simple", terms))
+    terms = " ".join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+    return _messages_fts.c.messages_fts.op("MATCH")(terms.strip())
+
+
+def search_query(words: list[str], dialect: str, conversation_ids, before_id: int | None, limit: int):
+    """
+    Newest-first page of (id, conversation_id, sender_id, content, created_at, username).
+    conversation_ids is a list or a subquery of the conversations in scope.
+    """
+    if dialect == "postgresql":
+        key = Message.id
+        query = select(Message.id, Message.conversation_id, Message.sender_id, Message.content,
+                       Message.created_at, User.username)
+    else:
+        # let FTS5 walk its rowids newest first instead of sorting every match
+        key = _messages_fts.c.rowid
+        query = (
+            select(Message.id, Message.conversation_id, Message.sender_id, Message.content,
+                   Message.created_at, User.username)
+            .select_from(_messages_fts)
+            .join(Message, Message.id == _messages_fts.c.rowid)
+        )
+    query = (
+        query.outerjoin(User, User.id == Message.sender_id)
+        .where(_match_clause(words, dialect), Message.conversation_id.in_(conversation_ids))
+    )
+    if before_id is not None:
+        query = query.where(key < before_id)
+    return query.order_by(key.desc()).limit(limit)
+
+
+def make_snippet(content: str | None, words: list[str], width: int = SNIPPET_WIDTH) -> str:
+    """HTML-escaped window of content around the first hit, with hits wrapped in <mark>."""
+    if not content:
+        return ""
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + r")\w*", re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - width // 3) if first else 0
+    end = min(len(content), start + width)
+    piece = content[start:end]
+
+    parts, last = [], 0
+    for m in pattern.finditer(piece):
+        parts.append(html.escape(piece[last:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+        last = m.end()
+    parts.append(html.escape(piece[last:]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(content) else "")
@@ -0,0 +1,85 @@
+# app/db/message_writer.py
+from datetime import datetime
+from collections import Counter
+from sqlalchemy import insert, update, bindparam
+from app.db.group_commit import GroupCommitQueue
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+
+
+class MessageWriter(GroupCommitQueue):
+    """
+    Write-behind stage for chat messages.
+
+    Senders call `submit(...)` and await the stored (id, created_at). A single
+    writer task drains the queue and group-commits everything it collected as
+    one multi-row INSERT ... RETURNING, so N concurrent messages cost one
+    commit (one fsync) instead of N. The recipients' unread counters are
+    bumped in the same transaction, except for group messages: a group
+    member's unread count is read off their watermark instead of being
+    written once per member per message. If a batch fails, its messages are
+    retried one per transaction, so a bad one only fails its own sender.
+    """
+
+    async def submit(self, conversation_id: int, sender_id: int, content: str | None, type: str = "text",
+                     attachment_url: str | None = None, delivered: bool = False,
+                     group: bool = False) -> tuple[int, datetime]:
+        """Queue a message and wait until its batch is durable. Returns (id, created_at)."""
+        return await self._enqueue(({
+            "conversation_id": conversation_id,
+            "sender_id": sender_id,
+            "type": type,
+            "content": content,
+            "attachment_url": attachment_url,
+            # groups keep delivery and read state per member, in conversation_members
+            # watermarks; flagged done so they never sit in the partial undelivered/unread indexes
+            "delivered": delivered or group,
+            "read": group,
+        }, group))
+
+    async def _flush(self, batch: list):
+        rows = [values for (values, _), _ in batch]
+        try:
+            async with self.session_factory() as db:
+                stmt = insert(Message).returning(Message.id, Message.created_at, sort_by_parameter_order=True)
+                result = await db.execute(stmt, rows)
+                stored = result.all()
+                await self._bump_unread(db, [values for (values, group), _ in batch if not group])
+                await db.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                # one bad row fails the whole INSERT; retry one per transaction so it only fails its sender
+                print(f"ERROR flushing message batch of {len(batch)}, retrying one by one: {e}")
+                for item in batch:
+                    await self._flush([item])
+                return
+            print(f"ERROR storing message: {e}")
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        for (_, future), row in zip(batch, stored):
+            if not future.done():
+                future.set_result((row.id, row.created_at))
+
+    async def _bump_unread(self, db, rows: list[dict]):
+        if not rows:
+            return
+        counts = Counter((row["conversation_id"], row["sender_id"]) for row in rows)
+        stmt = (
+            update(ConversationMember)
+            .where(
+                ConversationMember.conversation_id == bindparam("cid"),
+                ConversationMember.user_id != bindparam("sender"),
+            )
+            .values(unread_count=ConversationMember.unread_count + bindparam("n"))
+        )
+        # executemany on the Core connection; the ORM would treat a list of params as bulk-by-primary-key
+        conn = await db.connection()
+        await conn.execute(stmt, [
+            {"cid": cid, "sender": sender, "n": n} for (cid, sender), n in counts.items()
+        ])
+
+
+message_writer = MessageWriter()
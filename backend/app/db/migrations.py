@@ -0,0 +1,392 @@
+# app/db/migrations.py
+"""
+Versioned schema migrations.
+
+Startup calls `migrate(engine)`. It reads the recorded version from
+schema_version and runs only the steps above it, so an up-to-date database
+costs one small query instead of a create_all reflection of every table.
+Append new steps to MIGRATIONS; never edit one that has shipped.
+"""
+import asyncio
+import contextlib
+import re
+import warnings
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select, insert, update, delete, inspect, text, func, or_, and_, bindparam
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex, CreateTable
+from app.models.base import Base
+# every model must be imported so Base.metadata knows its table
+from app.models.user import User
+from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+from app.models.call_log import CallLog
+from app.models.call_stat import CallStat
+from app.models.media_object import MediaObject
+from app.models.upload_session import UploadSession
+from app.db.conversations import backfill_members
+from app.media.avatars import decode_base64_avatar, store_avatar
+from app.db import user_search, message_search, call_stats
+
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# rows per transaction for data migrations, so large tables aren't locked in one go
+BATCH_SIZE = 1000
+
+# base64 avatars are large; convert this many users per round trip
+AVATAR_BATCH_SIZE = 50
+
+# pg_advisory_lock key so only one worker migrates at a time
+_PG_LOCK_KEY = 0x77686174
+
+
+# --- helpers ---------------------------------------------------------------
+
+async def _existing(engine: AsyncEngine, table_name: str) -> tuple[set[str], set[str], set[str]]:
+    """(column names, index names, unique constraint names) of a table as it is in the database."""
+    def read(sync_conn):
+        insp = inspect(sync_conn)
+        if not insp.has_table(table_name):
+            return set(), set(), set()
+        columns = {c["name"] for c in insp.get_columns(table_name)}
+        with warnings.catch_warnings():
+            # expression indexes (lower(username)) can't be reflected; only their names matter here
+            warnings.filterwarnings("ignore", message="Skipped unsupported reflection")
+            indexes = {i["name"] for i in insp.get_indexes(table_name)}
+            uniques = {u["name"] for u in insp.get_unique_constraints(table_name) if u.get("name")}
+        return columns, indexes, uniques
+
+    async with engine.connect() as conn:
+        return await conn.run_sync(read)
+
+
+_INDEX_NAME = re.compile(r'INDEX CONCURRENTLY IF NOT EXISTS\s+"?(\w+)"?')
+
+
+async def create_index_online(engine: AsyncEngine, ddl: str):
+    """
+    Run a CREATE [UNIQUE] INDEX IF NOT EXISTS statement. On Postgres it is built
+    CONCURRENTLY (outside a transaction), so writes to a large table keep
+    flowing while it builds. SQLite has no online build; the table is locked
+    for the duration, which is why this runs before the server takes traffic.
+
+    A concurrent build that failed part-way leaves an INVALID index behind,
+    which IF NOT EXISTS would happily skip; it is dropped and rebuilt.
+    """
+    async with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            ddl = ddl.replace("INDEX IF NOT EXISTS", "INDEX CONCURRENTLY IF NOT EXISTS", 1)
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            name = _INDEX_NAME.search(ddl).group(1)
+            invalid = await conn.execute(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid AND pg_table_is_visible(c.oid)"
+                ),
+                {"name": name},
+            )
+            if invalid.first():
+                print(f"Dropping invalid index {name} left by an interrupted build")
+                await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+            await conn.execute(text(ddl))
+        else:
+            await conn.execute(text(ddl))
+            await conn.commit()
+
+
+async def add_missing_columns(engine: AsyncEngine, table):
+    """ALTER TABLE ... ADD COLUMN for model columns the live table doesn't have yet."""
+    columns, _, _ = await _existing(engine, table.name)
+    if not columns:
+        return
+    for column in table.columns:
+        if column.name in columns:
+            continue
+        if not column.nullable and column.server_default is None:
+            raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} without a server default")
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+        if column.server_default is not None:
+            ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+        async with engine.begin() as conn:
+            await conn.execute(text(ddl))
+
+
+# --- steps -----------------------------------------------------------------
+
+async def _baseline(engine: AsyncEngine):
+    # Fresh database: create everything. Database from before migrations: only the missing tables.
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def _member_columns(engine: AsyncEngine):
+    await add_missing_columns(engine, ConversationMember.__table__)
+
+
+async def _canonical_pairs(engine: AsyncEngine):
+    """
+    Rewrite 1-on-1 conversations to (min, max) order, merging duplicates
+    created by the old racy find-or-create into the oldest conversation,
+    then put the unique index over the pair.
+    """
+    last_id = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                select(Conversation.id, Conversation.user1_id, Conversation.user2_id)
+                .where(Conversation.id > last_id)
+                .order_by(Conversation.id)
+                .limit(BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            for conversation_id, user1_id, user2_id in rows:
+                low, high = min(user1_id, user2_id), max(user1_id, user2_id)
+                keeper = (await conn.execute(
+                    select(func.min(Conversation.id)).where(or_(
+                        and_(Conversation.user1_id == low, Conversation.user2_id == high),
+                        and_(Conversation.user1_id == high, Conversation.user2_id == low),
+                    ))
+                )).scalar()
+                if keeper != conversation_id:
+                    await conn.execute(
+                        update(Message).where(Message.conversation_id == conversation_id).values(conversation_id=keeper)
+                    )
+                    # counters/watermarks of both are recomputed by the member backfill step
+                    await conn.execute(
+                        delete(ConversationMember).where(ConversationMember.conversation_id.in_([conversation_id, keeper]))
+                    )
+                    await conn.execute(delete(Conversation).where(Conversation.id == conversation_id))
+                elif user1_id > user2_id:
+                    await conn.execute(
+                        update(Conversation).where(Conversation.id == conversation_id).values(user1_id=low, user2_id=high)
+                    )
+            last_id = rows[-1][0]
+
+    _, indexes, uniques = await _existing(engine, Conversation.__tablename__)
+    if "uq_conversations_pair" not in indexes | uniques:
+        # tables created before the constraint existed get an equivalent unique index
+        await create_index_online(
+            engine,
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_conversations_pair ON conversations (user1_id, user2_id)",
+        )
+
+
+async def _hot_path_indexes(engine: AsyncEngine):
+    # Every index declared on the models: messages(conversation_id, id), the partial
+    # undelivered/unread indexes, call_logs(caller_id|receiver_id, created_at), ...
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            await create_index_online(engine, ddl)
+
+
+async def _backfill_members(engine: AsyncEngine):
+    last_id = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                select(Conversation.id).where(Conversation.id > last_id).order_by(Conversation.id).limit(BATCH_SIZE)
+            )
+            ids = result.scalars().all()
+            if not ids:
+                break
+            await backfill_members(conn, ids[0], ids[-1])
+            last_id = ids[-1]
+
+
+async def _convert_avatar(user_id: int, value: str) -> str | None:
+    try:
+        return await store_avatar(decode_base64_avatar(value))
+    except ValueError as e:
+        # left in the (never loaded) legacy column rather than thrown away
+        print(f"ERROR converting avatar of user {user_id}: {e}")
+        return None
+
+
+async def _avatars_to_store(engine: AsyncEngine):
+    """Move base64 avatars out of users.avatar into the image store, a batch at a time."""
+    await add_missing_columns(engine, User.__table__)
+    users = User.__table__
+    last_id = 0
+    while True:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(users.c.id, users.c.avatar)
+                .where(users.c.id > last_id, users.c.avatar.is_not(None), users.c.avatar != "")
+                .order_by(users.c.id)
+                .limit(AVATAR_BATCH_SIZE)
+            )
+            rows = result.all()
+        if not rows:
+            break
+
+        # thumbnails render in parallel in the image pool, outside any transaction
+        keys = await asyncio.gather(*(_convert_avatar(row.id, row.avatar) for row in rows))
+        converted = [{"uid": row.id, "new_key": key} for row, key in zip(rows, keys) if key]
+        if converted:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    update(users)
+                    .where(users.c.id == bindparam("uid"))
+                    .values(avatar_key=bindparam("new_key"), avatar=None, avatar_version=users.c.avatar_version + 1),
+                    converted,
+                )
+        last_id = rows[-1].id
+
+
+async def _upload_tables(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[MediaObject.__table__, UploadSession.__table__])
+
+
+async def _media_processing_columns(engine: AsyncEngine):
+    await add_missing_columns(engine, MediaObject.__table__)
+
+
+async def _search_index(engine: AsyncEngine, sqlite_ddl: list[str], postgres_indexes: list[str]):
+    # SQLite: FTS5 table + sync triggers, populated in place; Postgres: GIN indexes built online
+    if engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            for ddl in sqlite_ddl:
+                await conn.execute(text(ddl))
+    elif engine.dialect.name == "postgresql":
+        for ddl in postgres_indexes:
+            await create_index_online(engine, ddl)
+
+
+async def _user_search_index(engine: AsyncEngine):
+    # lower(username)/lower(full_name) expression indexes for prefix search
+    await _hot_path_indexes(engine)
+    if engine.dialect.name == "postgresql":
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await _search_index(engine, user_search.SQLITE_DDL, user_search.POSTGRES_INDEXES)
+
+
+async def _message_search_index(engine: AsyncEngine):
+    await _search_index(engine, message_search.SQLITE_DDL, message_search.POSTGRES_INDEXES)
+
+
+async def _call_stats(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[CallStat.__table__])
+    last_id = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                select(CallLog.id).where(CallLog.id > last_id).order_by(CallLog.id).limit(BATCH_SIZE)
+            )
+            ids = result.scalars().all()
+            if not ids:
+                break
+            await call_stats.backfill(conn, ids[0], ids[-1])
+            last_id = ids[-1]
+
+
+async def _group_conversations(engine: AsyncEngine):
+    """Member roles and delivery watermarks; conversations without a user pair, plus title/is_group."""
+    await add_missing_columns(engine, ConversationMember.__table__)
+    conversations = Conversation.__table__
+    if engine.dialect.name != "sqlite":
+        async with engine.begin() as conn:
+            for column in ("user1_id", "user2_id"):
+                await conn.execute(text(f"ALTER TABLE {conversations.name} ALTER COLUMN {column} DROP NOT NULL"))
+        await add_missing_columns(engine, conversations)
+        return
+
+    # SQLite can't drop NOT NULL in place: create the new table, copy, drop, rename
+    columns, _, _ = await _existing(engine, conversations.name)
+    shared = ", ".join(c.name for c in conversations.columns if c.name in columns)
+    staging_metadata = MetaData()
+    User.__table__.to_metadata(staging_metadata)  # so the users.id foreign keys resolve
+    staging = conversations.to_metadata(staging_metadata, name="conversations_rebuild")
+    async with engine.begin() as conn:
+        await conn.execute(CreateTable(staging))
+        await conn.execute(text(f"INSERT INTO {staging.name} ({shared}) SELECT {shared} FROM {conversations.name}"))
+        await conn.execute(text(f"DROP TABLE {conversations.name}"))
+        await conn.execute(text(f"ALTER TABLE {staging.name} RENAME TO {conversations.name}"))
+        for index in conversations.indexes:
+            await conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "conversation_members columns", _member_columns),
+    (3, "canonical conversation pairs", _canonical_pairs),
+    (4, "hot path indexes", _hot_path_indexes),
+    (5, "backfill conversation_members", _backfill_members),
+    (6, "avatars to image store", _avatars_to_store),
+    (7, "media_objects and upload_sessions", _upload_tables),
+    (8, "media_objects processing columns", _media_processing_columns),
+    (9, "user search index", _user_search_index),
+    (10, "message search index", _message_search_index),
+    (11, "call stats rollup", _call_stats),
+    (12, "group conversations", _group_conversations),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# --- runner ----------------------------------------------------------------
+
+async def current_version(engine: AsyncEngine) -> int:
+    async with engine.connect() as conn:
+        if not await conn.run_sync(lambda c: inspect(c).has_table(schema_version.name)):
+            return 0
+        result = await conn.execute(select(func.max(schema_version.c.version)))
+        return result.scalar() or 0
+
+
+@contextlib.asynccontextmanager
+async def _migration_lock(engine: AsyncEngine):
+    """Serialize migrations across workers booting at the same time."""
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _PG_LOCK_KEY})
+            try:
+                yield
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _PG_LOCK_KEY})
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        import fcntl
+        lock_file = open(f"{engine.url.database}.migrate.lock", "w")
+        try:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+    else:
+        yield
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """Bring the schema up to LATEST_VERSION; returns the version the database is now at."""
+    if await current_version(engine) >= LATEST_VERSION:
+        return LATEST_VERSION
+
+    async with _migration_lock(engine):
+        # another worker may have finished while we waited for the lock
+        version = await current_version(engine)
+        if version == 0:
+            async with engine.begin() as conn:
+                await conn.run_sync(schema_version.create, checkfirst=True)
+        for number, name, step in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Applying migration {number}: {name}")
+            await step(engine)
+            async with engine.begin() as conn:
+                await conn.execute(insert(schema_version).values(version=number, name=name))
+            version = number
+    return version
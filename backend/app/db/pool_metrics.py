@@ -0,0 +1,90 @@
+# app/db/pool_metrics.py
+import time
+from collections import deque
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# recent checkout waits kept for percentiles
+WAIT_SAMPLES = 2048
+
+
+def _percentile(ordered: list[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class PoolMetrics:
+    """
+    Counters for one engine's connection pool.
+
+    Checkout wait is the time from asking the pool for a connection to
+    getting one, so it includes opening a new connection when the pool has
+    none idle. An overflow connect is a connection opened beyond pool_size;
+    a steady stream of them (or any timeouts) means the pool is too small
+    for the load on this worker.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow_connects = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, seconds: float):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.waits.append(seconds)
+
+    def snapshot(self, pool) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "peak_checked_out": self.peak_checked_out,
+            "checkouts": self.checkouts,
+            "overflow_connects": self.overflow_connects,
+            "timeouts": self.timeouts,
+            "wait_ms": {
+                "avg": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "p50": _percentile(waits, 50) * 1000,
+                "p99": _percentile(waits, 99) * 1000,
+                "max": self.wait_max * 1000,
+            },
+        }
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that reports into a PoolMetrics (see metered_pool_class)."""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.checkouts += 1
+        self.metrics.record_wait(time.perf_counter() - start)
+        self.metrics.peak_checked_out = max(self.metrics.peak_checked_out, self.checkedout())
+        return record
+
+    def _inc_overflow(self) -> bool:
+        opened = super()._inc_overflow()
+        # _overflow starts at -pool_size, so it only goes positive past pool_size
+        if opened and self._overflow > 0:
+            self.metrics.overflow_connects += 1
+        return opened
+
+
+def metered_pool_class(metrics: PoolMetrics) -> type[MeteredQueuePool]:
+    # a subclass per engine: Pool.recreate() (on dispose or invalidation) keeps the class, and so the counters
+    return type("MeteredQueuePool", (MeteredQueuePool,), {"metrics": metrics})
@@ -0,0 +1,119 @@
+# app/db/principals.py
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.user import User
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated user as most endpoints need it: identity and display fields, no ORM row."""
+    id: int
+    username: str
+    full_name: str | None
+    about: str | None
+    avatar_key: str | None
+    avatar_version: int
+
+
+class PrincipalCache:
+    """
+    Verified bearer token -> Principal, bounded (LRU) and short-lived.
+
+    An entry lives for AUTH_CACHE_TTL_SECONDS or until the token expires,
+    whichever is first, so a hit skips both the JWT check and the users
+    query. Misses for the same user share one in-flight fetch. Profile
+    changes call invalidate(user_id); other workers' copies age out with the TTL.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_size: int | None = None, ttl: float | None = None):
+        self.session_factory = session_factory
+        self.max_size = max_size or settings.AUTH_CACHE_SIZE
+        self.ttl = settings.AUTH_CACHE_TTL_SECONDS if ttl is None else ttl
+        self._entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self._tokens_by_user: dict[int, set[str]] = {}
+        self._inflight: dict[int, asyncio.Task] = {}
+        # bumped by invalidate() so a fetch that raced it isn't cached
+        self._generation: dict[int, int] = {}
+
+    def get(self, token: str) -> Principal | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        principal, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._drop(token)
+            return None
+        self._entries.move_to_end(token)
+        return principal
+
+    async def load(self, token: str, user_id: int, token_exp: float | None = None) -> Principal | None:
+        """Fetch (or join the fetch of) user_id's principal and cache it under token. None if the user is gone."""
+        generation = self._generation.get(user_id, 0)
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda t: self._fetch_done(user_id, t))
+        # shielded: one caller going away must not cancel the fetch for the others
+        principal = await asyncio.shield(task)
+
+        if principal is not None and self._generation.get(user_id, 0) == generation:
+            expires_at = time.monotonic() + self.ttl
+            if token_exp is not None:
+                expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+            self._store(token, principal, expires_at)
+        return principal
+
+    def invalidate(self, user_id: int):
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        self._inflight.pop(user_id, None)
+        for token in self._tokens_by_user.pop(user_id, set()):
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+        self._inflight.clear()
+        self._generation.clear()
+
+    async def _fetch(self, user_id: int) -> Principal | None:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(User.id, User.username, User.full_name, User.about, User.avatar_key, User.avatar_version)
+                .where(User.id == user_id)
+            )
+            row = result.first()
+        if row is None:
+            return None
+        return Principal(row.id, row.username, row.full_name, row.about, row.avatar_key, row.avatar_version or 0)
+
+    def _fetch_done(self, user_id: int, task: asyncio.Task):
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an error with no waiters left isn't logged as unhandled
+
+    def _store(self, token: str, principal: Principal, expires_at: float):
+        self._entries[token] = (principal, expires_at)
+        self._entries.move_to_end(token)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+
+principal_cache = PrincipalCache()
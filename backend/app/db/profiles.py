@@ -0,0 +1,76 @@
+# app/db/profiles.py
+"""
+Named engine configurations, picked with DB_PROFILE.
+
+  sqlite         - local development on a SQLite file: a small pool, no pre-ping
+                   (there is no server to lose the connection)
+  sqlite_writer  - small self-hosted deployments on one SQLite file: WAL, one
+                   writer connection, a pool of read-only connections
+                   (app/db/sqlite_writer.py)
+  postgres       - asyncpg in production: sized pool and overflow, pre-ping,
+                   recycling, and prepared-statement caching
+  auto           - sqlite or postgres, from the DATABASE_URL scheme
+
+Pool sizes are per worker process; the database sees
+workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections at most.
+"""
+from sqlalchemy.engine import make_url
+from app.config import settings
+from app.db.pool_metrics import PoolMetrics, metered_pool_class
+
+
+def async_url(url: str) -> str:
+    # Render and friends hand out postgres:// or postgresql://, which need the async driver
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+def resolve_profile(url: str, profile: str | None = None) -> str:
+    profile = (profile or settings.DB_PROFILE).lower()
+    if profile == "auto":
+        return "postgres" if make_url(url).get_backend_name() == "postgresql" else "sqlite"
+    if profile not in ("sqlite", "sqlite_writer", "postgres"):
+        raise ValueError(f"Unknown DB_PROFILE {profile!r}")
+    return profile
+
+
+def engine_options(url: str, profile: str, metrics: PoolMetrics) -> tuple[str, dict]:
+    """(url, create_async_engine kwargs) for the sqlite and postgres profiles (sqlite_writer: see sqlite_writer.create_engines)."""
+    if profile == "sqlite":
+        if make_url(url).database in (None, "", ":memory:"):
+            # an in-memory database lives in one connection; keep SQLAlchemy's default pool for it
+            return url, {"echo": False}
+        return url, {
+            "echo": False,
+            "poolclass": metered_pool_class(metrics),
+            "pool_size": 5,
+            "max_overflow": 10,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+        }
+
+    options = {
+        "echo": False,
+        "poolclass": metered_pool_class(metrics),
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        # recycle before server/proxy idle timeouts, and drop connections killed by failovers
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+        # most recently returned connection first, so idle extras can age out
+        "pool_use_lifo": True,
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            # asyncpg's own per-connection prepared statement cache (0 behind pgbouncer in transaction mode)
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"application_name": settings.APP_NAME},
+        }
+        # SQLAlchemy's cache of prepared statements per connection, in front of asyncpg's
+        url = make_url(url).update_query_dict(
+            {"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)}
+        ).render_as_string(hide_password=False)
+    return url, options
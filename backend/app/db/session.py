@@ -2,25 +2,48 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.db.pool_metrics import PoolMetrics, MeteredQueuePool
+from app.db.profiles import async_url, resolve_profile, engine_options
+from app.db import sqlite_writer
 from typing import AsyncGenerator
 
 if not settings.DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set in settings or .env")
 
-# Fix for Render providing postgres:// or postgresql:// which needs to be async
-db_url = settings.DATABASE_URL
-if db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql+asyncpg://", 1)
-elif db_url.startswith("postgresql://"):
-    db_url = db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+db_url = async_url(settings.DATABASE_URL)
+
+# pool sizing, pre-ping, statement caching per DB_PROFILE (app/db/profiles.py)
+db_profile = resolve_profile(db_url)
+pool_metrics = PoolMetrics()
+read_pool_metrics = None
+session_options = {}
+if db_profile == "sqlite_writer":
+    # `engine` is the single writer; reads go to their own pool
+    read_pool_metrics = PoolMetrics()
+    engine, read_engine, session_options["sync_session_class"] = sqlite_writer.create_engines(
+        db_url, pool_metrics, read_pool_metrics
+    )
+else:
+    engine_url, engine_kwargs = engine_options(db_url, db_profile, pool_metrics)
+    engine = create_async_engine(engine_url, **engine_kwargs)
+    read_engine = engine
+
+
+def pool_stats() -> dict:
+    if not isinstance(engine.pool, MeteredQueuePool):
+        return {"profile": db_profile, "pool": type(engine.pool).__name__}
+    stats = {"profile": db_profile, **pool_metrics.snapshot(engine.pool)}
+    if read_pool_metrics is not None:
+        stats["read_pool"] = read_pool_metrics.snapshot(read_engine.pool)
+    return stats
 
-engine = create_async_engine(db_url, echo=False)
 
 # session factory
 AsyncSessionLocal = sessionmaker(
     engine,
     class_=AsyncSession,
     expire_on_commit=False,
+    **session_options,
 )
 
 # FastAPI dependency to get DB session
@@ -0,0 +1,140 @@
+# app/db/sqlite_writer.py
+"""
+Single-writer SQLite (DB_PROFILE=sqlite_writer).
+
+SQLite allows one writer at a time per file. With every request committing
+through its own pooled connection, concurrent writers collide on the file
+lock and fail with "database is locked" or stall in busy-wait retries.
+Here all writes go through one connection instead:
+
+  writer engine - exactly one connection (pool_size=1, no overflow), so
+                  writers queue in the pool, in-process and in order,
+                  rather than on the file lock
+  read engine   - a pool of query_only connections; with WAL they read
+                  the last committed state without waiting on the writer
+
+Sessions from AsyncSessionLocal route themselves: statements go to the
+read engine until the session flushes or executes DML, and from then on to
+the writer until its transaction ends. The group-commit writers
+(app/db/message_writer.py, app/db/group_commit.py) batch the hot
+small writes so the one connection commits rarely.
+
+Meant for a single worker process: the writer is per process, so several
+workers on one file are back to sharing the lock (busy_timeout still applies).
+"""
+import re
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from app.config import settings
+from app.db.pool_metrics import PoolMetrics, metered_pool_class
+
+
+def _pragmas(writer: bool) -> list[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        # negative = KiB rather than pages
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if writer:
+        pragmas += [
+            # readers no longer block the writer (or each other); persistent in the file
+            "PRAGMA journal_mode=WAL",
+            # in WAL mode NORMAL only fsyncs at checkpoints: a power cut may lose the
+            # last commits but never corrupts the file
+            "PRAGMA synchronous=NORMAL",
+        ]
+    else:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+
+def install_pragmas(engine, writer: bool):
+    pragmas = _pragmas(writer)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def writer_options(metrics: PoolMetrics) -> dict:
+    return {
+        "echo": False,
+        "poolclass": metered_pool_class(metrics),
+        "pool_size": 1,
+        "max_overflow": 0,
+        # writers wait their turn here; a long queue shows up as checkout wait in /api/db/stats
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+
+def reader_options(metrics: PoolMetrics) -> dict:
+    return {
+        "echo": False,
+        "poolclass": metered_pool_class(metrics),
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+
+# text() that only reads; any other raw SQL is assumed to write
+_READ_ONLY_TEXT = re.compile(r"\s*(SELECT|PRAGMA|EXPLAIN)\b", re.IGNORECASE)
+
+
+def _is_write(mapper, clause) -> bool:
+    if clause is None:
+        # the unit of work asks for a connection with just the mapper when it flushes;
+        # every ORM read passes its statement
+        return mapper is not None
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return not _READ_ONLY_TEXT.match(clause.text)
+    return False
+
+
+class RoutingSession(Session):
+    """
+    Reads on the read engine, writes (and everything after them in the transaction) on the writer.
+
+    A write is a flush, Core DML, or text() that isn't a SELECT. A bare
+    session.connection() before any of those is a read connection: set
+    session.info["writing"] = True first to get the writer.
+    """
+
+    writer = None
+    reader = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("writing") or _is_write(mapper, clause):
+            # stay on the writer for the rest of the transaction so it reads its own writes
+            self.info["writing"] = True
+            return self.writer.sync_engine
+        return self.reader.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _end_writing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+def routing_session_class(writer, reader) -> type[RoutingSession]:
+    return type("RoutingSession", (RoutingSession,), {"writer": writer, "reader": reader})
+
+
+def create_engines(url: str, writer_metrics: PoolMetrics, reader_metrics: PoolMetrics):
+    """(writer engine, read engine, sync_session_class for AsyncSession) for one SQLite file."""
+    writer = create_async_engine(url, **writer_options(writer_metrics))
+    reader = create_async_engine(url, **reader_options(reader_metrics))
+    install_pragmas(writer, writer=True)
+    install_pragmas(reader, writer=False)
+    return writer, reader, routing_session_class(writer, reader)
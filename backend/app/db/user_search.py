@@ -0,0 +1,107 @@
+# app/db/user_search.py
+"""
+Indexed user search for the "new chat" box.
+
+Two kinds of match, each answered from an index:
+  * prefix of username / full_name: range scans on lower(...) expression indexes
+  * substring (3+ characters): SQLite FTS5 trigram table kept in sync by
+    triggers, or pg_trgm GIN indexes on Postgres
+
+Each branch fetches at most offset+limit ids; the union is ranked
+exact username > username prefix > full_name prefix > substring and paged.
+"""
+from sqlalchemy import select, union, func, case, and_, or_, text, table, column, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.user import User
+
+# substring matching needs whole trigrams
+MIN_SUBSTRING_LENGTH = 3
+
+_users_fts = table("users_fts", column("rowid"), column("users_fts"))
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, full_name, content='users', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, username, full_name) VALUES (new.id, new.username, new.full_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, full_name) VALUES ('delete', old.id, old.username, old.full_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, full_name ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, full_name) VALUES ('delete', old.id, old.username, old.full_name);
+        INSERT INTO users_fts(rowid, username, full_name) VALUES (new.id, new.username, new.full_name);
+    END""",
+    # (re)index whatever is already in users
+    "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm ON users USING gin (lower(full_name) gin_trgm_ops)",
+]
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix(expr, q: str, dialect: str):
+    if dialect == "postgresql":
+        return expr.like(_escape_like(q) + "%", escape="\\")
+    # SQLite won't use an expression index for LIKE; a range over it is equivalent
+    return and_(expr >= q, expr < q + "\U0010ffff")
+
+
+def _substring_ids(q: str, dialect: str, exclude_id: int):
+    if dialect == "postgresql":
+        pattern = "%" + _escape_like(q) + "%"
+        return (
+            select(User.id.label("id"))
+            .where(
+                or_(func.lower(User.username).like(pattern, escape="\\"), func.lower(User.full_name).like(pattern, escape="\\")),
+                User.id != exclude_id,
+            )
+            .order_by(User.id)
+        )
+    phrase = '"' + q.replace('"', '""') + '"'
+    return (
+        select(_users_fts.c.rowid.label("id"))
+        .where(_users_fts.c.users_fts.op("MATCH")(phrase), _users_fts.c.rowid != exclude_id)
+        .order_by(_users_fts.c.rowid)
+    )
+
+
+async def search_users(db: AsyncSession, q: str, exclude_id: int, limit: int = 20, offset: int = 0):
+    """Ranked page of (id, username, full_name, about, avatar_key, avatar_version) rows."""
+    q = q.strip().lower()
+    if not q:
+        return []
+    dialect = db.bind.dialect.name
+    window = offset + limit
+    username = func.lower(User.username)
+    full_name = func.lower(User.full_name)
+
+    branches = [
+        select(User.id.label("id")).where(_prefix(username, q, dialect), User.id != exclude_id).order_by(username).limit(window),
+        select(User.id.label("id")).where(_prefix(full_name, q, dialect), User.id != exclude_id).order_by(full_name).limit(window),
+    ]
+    if len(q) >= MIN_SUBSTRING_LENGTH:
+        branches.append(_substring_ids(q, dialect, exclude_id).limit(window))
+    # each branch is wrapped so its ORDER BY/LIMIT is legal inside the UNION
+    candidates = union(*(select(b.subquery().c.id) for b in branches)).subquery()
+
+    username_prefix = _prefix(username, q, dialect)
+    full_name_prefix = _prefix(full_name, q, dialect)
+    tier = case((username == q, 0), (username_prefix, 1), (full_name_prefix, 2), else_=3)
+    sort_key = case((username_prefix, username), (full_name_prefix, full_name), else_=literal(""))
+    result = await db.execute(
+        select(User.id, User.username, User.full_name, User.about, User.avatar_key, User.avatar_version)
+        .where(User.id.in_(select(candidates.c.id)))
+        .order_by(tier, sort_key, User.id)
+        .offset(offset)
+        .limit(limit)
+    )
+    return result.all()
+
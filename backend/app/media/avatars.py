@@ -0,0 +1,80 @@
+# app/media/avatars.py
+"""
+Avatars live on disk under their content hash, one directory per image with
+a JPEG per size in settings.AVATAR_SIZES. The users row only keeps the key
+and a version number, so listing a user costs a few bytes instead of the
+whole picture, and the URL for a key never changes (served as immutable).
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+from app.config import settings
+from app.media.images import run_in_pool, render_square_thumbnails
+
+AVATAR_DIR = os.path.join(settings.MEDIA_DIR, "avatars")
+KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def avatar_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def avatar_path(key: str, size: int) -> str:
+    return os.path.join(AVATAR_DIR, key[:2], key, f"{size}.jpg")
+
+
+def avatar_url(key: str | None, size: int | None = None) -> str | None:
+    if not key:
+        return None
+    return f"/api/avatars/{key}/{size or settings.AVATAR_DEFAULT_SIZE}.jpg"
+
+
+def avatar_fields(key: str | None, version: int | None) -> dict:
+    """The avatar part of every user payload."""
+    return {"profile_picture": avatar_url(key), "avatar_version": version or 0}
+
+
+async def store_avatar(data: bytes) -> str:
+    """
+    Store an uploaded image once under its content hash, rendering every size
+    in the process pool. Returns the key; raises ValueError for oversized or
+    undecodable input. Uploading a picture that is already stored is free.
+    """
+    if len(data) > settings.AVATAR_MAX_BYTES:
+        raise ValueError(f"avatar larger than {settings.AVATAR_MAX_BYTES} bytes")
+    key = avatar_key(data)
+    sizes = list(settings.AVATAR_SIZES)
+    if not all(os.path.exists(avatar_path(key, size)) for size in sizes):
+        directory = os.path.dirname(avatar_path(key, sizes[0]))
+        await run_in_pool(render_square_thumbnails, data, directory, sizes)
+    return key
+
+
+def decode_base64_avatar(value: str) -> bytes:
+    """The old storage format: a data: URL, or bare base64."""
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("avatar is not valid base64")
+
+
+def set_avatar(user, key: str | None):
+    if user.avatar_key != key:
+        user.avatar_key = key
+        user.avatar_version = (user.avatar_version or 0) + 1
+
+
+async def apply_profile_picture(user, value: str):
+    """
+    profile_picture as sent to PATCH /profile by older clients: a data: URL is
+    stored like an upload, "" removes the avatar, and anything else (the URL
+    we handed out, echoed back) leaves it unchanged. Raises ValueError.
+    """
+    if value == "":
+        set_avatar(user, None)
+    elif value.startswith("data:"):
+        set_avatar(user, await store_avatar(decode_base64_avatar(value)))
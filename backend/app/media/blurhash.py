@@ -0,0 +1,76 @@
+# app/media/blurhash.py
+"""
+BlurHash encoder (https://blurha.sh): a ~30 character string the client
+decodes into a blurred placeholder while the real thumbnail loads.
+
+Pure Python; callers pass an already-downscaled image (a few dozen pixels
+across), so the DCT below stays cheap. Runs inside the image process pool.
+"""
+import math
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def encode(img, x_components: int = 4, y_components: int = 3) -> str:
+    """BlurHash of an RGB PIL image."""
+    width, height = img.size
+    linear = [tuple(_srgb_to_linear(c) for c in px) for px in img.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                cy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantized_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantized_max + 1) / 166
+        result += _encode83(quantized_max, 1)
+    else:
+        max_value = 1
+        result += _encode83(0, 1)
+
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    def quantize(v):
+        return max(0, min(18, int(math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _encode83(quantize(r) * 19 * 19 + quantize(g) * 19 + quantize(b), 2)
+    return result
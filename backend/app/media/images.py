@@ -0,0 +1,124 @@
+# app/media/images.py
+"""
+Image decoding/resizing and other media post-processing, run in a process pool so a large upload never
+stalls the event loop (or the GIL for the other request handlers).
+
+Functions called through `run_in_pool` execute in a worker process: they
+must be top-level, take picklable arguments and do their own file writes.
+"""
+import asyncio
+import gzip
+import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from app.config import settings
+from app.media import blurhash
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent has an event loop and database threads running
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), fn, *args)
+
+
+def write_atomic(path: str, data: bytes):
+    """Write to a temp file in the same directory and rename, so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def open_image(data: bytes) -> Image.Image:
+    """Decode fully (so truncated files fail here), apply EXIF rotation, drop alpha. Raises ValueError."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            return ImageOps.exif_transpose(img).convert("RGB")
+    except Exception as e:
+        # includes Image.DecompressionBombError for absurd pixel counts
+        raise ValueError(f"not a usable image: {e}")
+
+
+def render_square_thumbnails(data: bytes, directory: str, sizes: list[int]):
+    """Center-crop data to a square and write {size}.jpg into directory for every size."""
+    img = open_image(data)
+    for size in sizes:
+        thumb = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        thumb.save(buf, "JPEG", quality=85, optimize=True, progressive=True)
+        write_atomic(os.path.join(directory, f"{size}.jpg"), buf.getvalue())
+
+
+# types worth storing a gzip variant of; images/video/audio are already compressed
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def is_image(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.startswith("image/") and content_type != "image/svg+xml"
+
+
+def is_compressible(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def process_media(path: str, content_type: str | None, thumb_dir: str, sizes: list[int]) -> dict:
+    """
+    Post-upload stage for one stored object. Images get a JPEG per size
+    (longest side, never upscaled) in thumb_dir plus a blurhash placeholder;
+    compressible types get path + ".gz" when that saves at least 10%.
+    Returns whatever of width/height/blurhash/gzip applies.
+    """
+    info = {}
+    if is_image(content_type):
+        with open(path, "rb") as f:
+            img = open_image(f.read())
+        info["width"], info["height"] = img.size
+        for size in sizes:
+            thumb = img.copy()
+            thumb.thumbnail((size, size), Image.LANCZOS)
+            buf = io.BytesIO()
+            thumb.save(buf, "JPEG", quality=80, optimize=True, progressive=True)
+            write_atomic(os.path.join(thumb_dir, f"{size}.jpg"), buf.getvalue())
+        tiny = img.copy()
+        tiny.thumbnail((32, 32))
+        info["blurhash"] = blurhash.encode(tiny)
+    elif is_compressible(content_type):
+        tmp_path = path + ".gz.tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as raw_out:
+            with gzip.GzipFile(fileobj=raw_out, mode="wb", compresslevel=9, mtime=0) as out:
+                while chunk := src.read(settings.UPLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+        if os.path.getsize(tmp_path) < os.path.getsize(path) * 0.9:
+            os.replace(tmp_path, path + ".gz")
+            info["gzip"] = True
+        else:
+            os.unlink(tmp_path)
+    return info
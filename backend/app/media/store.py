@@ -0,0 +1,144 @@
+# app/media/store.py
+"""
+Content-addressed storage for chat uploads.
+
+Uploads are streamed to a partial file in fixed-size chunks, hashed as they
+are written, then renamed to UPLOAD_DIR/<aa>/<sha256><ext>. The
+media_objects row keyed by the hash is what makes a second identical upload
+free: its partial file is dropped and the existing object is returned.
+
+Once stored, `process_object` runs the post-upload stage in the process pool
+(image previews + blurhash, gzip variants) and the object is served by
+app/api/media.py under an immutable URL.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from sqlalchemy.exc import IntegrityError
+from app.config import settings
+from app.media.images import run_in_pool, process_media
+from app.models.media_object import MediaObject
+import aiofiles
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def partial_path(name: str) -> str:
+    return os.path.join(settings.UPLOAD_PARTIAL_DIR, name)
+
+
+def object_path(sha256: str, ext: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, sha256[:2], sha256 + ext)
+
+
+def object_url(obj: MediaObject) -> str:
+    return f"/api/media/{obj.sha256}{obj.ext}"
+
+
+def thumb_path(sha256: str, size: int) -> str:
+    return os.path.join(settings.MEDIA_DIR, "thumbs", sha256[:2], sha256, f"{size}.jpg")
+
+
+def thumb_url(sha256: str, size: int) -> str:
+    return f"/api/media/{sha256}/thumb/{size}.jpg"
+
+
+def media_info(obj: MediaObject) -> dict:
+    """What a client needs to render an attachment: the original, previews and a placeholder."""
+    info = {"url": object_url(obj), "sha256": obj.sha256, "size": obj.size, "content_type": obj.content_type}
+    if obj.width:
+        info.update({
+            "width": obj.width,
+            "height": obj.height,
+            "blurhash": obj.blurhash,
+            "thumbnails": {str(size): thumb_url(obj.sha256, size) for size in settings.MEDIA_THUMB_SIZES},
+        })
+    return info
+
+
+def clean_ext(filename: str | None) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ""
+
+
+async def iter_upload_file(file, chunk_size: int):
+    """Chunks of a FastAPI UploadFile, without reading it whole."""
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def stream_to_file(chunks, path: str, max_bytes: int, mode: str = "wb", hasher=None) -> int:
+    """
+    Write an async iterator of byte chunks to path, feeding hasher if given.
+    Returns the number of bytes written; raises UploadTooLarge as soon as the
+    stream goes past max_bytes (bytes already written are the caller's to discard).
+    """
+    written = 0
+    async with aiofiles.open(path, mode) as out:
+        async for chunk in chunks:
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLarge(f"upload larger than {max_bytes} bytes")
+            if hasher is not None:
+                hasher.update(chunk)
+            await out.write(chunk)
+    return written
+
+
+def hash_file(path: str, chunk_size: int) -> str:
+    """sha256 of a file on disk, read in chunks (blocking; run it in a thread)."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def commit_object(db, tmp_path: str, sha256: str, size: int, filename: str | None, content_type: str | None) -> MediaObject:
+    """Move a fully received file into the store under its hash, or drop it if those bytes are already stored."""
+    existing = await db.get(MediaObject, sha256)
+    if existing:
+        os.unlink(tmp_path)
+        return existing
+
+    if not content_type or content_type == "application/octet-stream":
+        content_type = mimetypes.guess_type(filename or "")[0] or content_type
+    obj = MediaObject(sha256=sha256, size=size, content_type=content_type, ext=clean_ext(filename), processed=False)
+    path = object_path(sha256, obj.ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    db.add(obj)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # the same bytes were committed concurrently; keep theirs
+        await db.rollback()
+        existing = await db.get(MediaObject, sha256)
+        if existing.ext != obj.ext:
+            os.unlink(path)
+        return existing
+    return obj
+
+
+async def process_object(db, obj: MediaObject) -> MediaObject:
+    """Run the post-upload stage once per object (a re-upload of the same bytes finds it done)."""
+    if obj.processed:
+        return obj
+    sizes = list(settings.MEDIA_THUMB_SIZES)
+    thumb_dir = os.path.dirname(thumb_path(obj.sha256, sizes[0]))
+    try:
+        info = await run_in_pool(process_media, object_path(obj.sha256, obj.ext), obj.content_type, thumb_dir, sizes)
+    except ValueError as e:
+        # labelled as an image but not decodable; serve it as a plain file
+        print(f"ERROR processing media {obj.sha256}: {e}")
+        info = {}
+    obj.width = info.get("width")
+    obj.height = info.get("height")
+    obj.blurhash = info.get("blurhash")
+    obj.gzip = info.get("gzip", False)
+    obj.processed = True
+    await db.commit()
+    return obj
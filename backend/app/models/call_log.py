@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Index
 from sqlalchemy.sql import func
 from app.models.base import Base
 
 class CallLog(Base):
     __tablename__ = 'call_logs'
+    # call history is "my calls, newest first" from either side of the call
+    __table_args__ = (
+        Index('ix_call_logs_caller_created', 'caller_id', 'created_at'),
+        Index('ix_call_logs_receiver_created', 'receiver_id', 'created_at'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     caller_id = Column(Integer, nullable=False)
     receiver_id = Column(Integer, nullable=False)
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, DateTime
+from app.models.base import Base
+
+class CallStat(Base):
+    """Per-(user, contact) call totals, so call stats never aggregate call_logs."""
+    __tablename__ = 'call_stats'
+
+    user_id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, primary_key=True)
+    # closed calls user_id placed to / received from contact_id
+    outgoing = Column(Integer, nullable=False, default=0, server_default='0')
+    incoming = Column(Integer, nullable=False, default=0, server_default='0')
+    # incoming calls that ended without being answered
+    missed = Column(Integer, nullable=False, default=0, server_default='0')
+    # answered time, accept to hang-up
+    talk_seconds = Column(Integer, nullable=False, default=0, server_default='0')
+    last_call_at = Column(DateTime(timezone=True), nullable=True)
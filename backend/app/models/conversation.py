@@ -1,18 +1,27 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Boolean, String, UniqueConstraint, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.models.base import Base
 
 class Conversation(Base):
     __tablename__ = 'conversations'
+    # Pairs are stored canonically (user1_id < user2_id), so one unique index
+    # both serves the pair lookup and rejects duplicate conversations.
+    __table_args__ = (
+        UniqueConstraint('user1_id', 'user2_id', name='uq_conversations_pair'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    # For a simple 1-on-1 chat, we can just store the two user IDs
-    # In a real app, you might want a separate "ConversationMember" table for groups
-    user1_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    user2_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # The two users of a 1-on-1 chat. Groups leave both NULL (NULLs never collide in
+    # uq_conversations_pair) and list everyone in conversation_members.
+    user1_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    user2_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+
+    is_group = Column(Boolean, nullable=False, default=False, server_default=false())
+    title = Column(String(100), nullable=True)
+    created_by = Column(Integer, nullable=True)
     
     user1 = relationship("User", foreign_keys=[user1_id])
     user2 = relationship("User", foreign_keys=[user2_id])
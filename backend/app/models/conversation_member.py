@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, ForeignKey
+from app.models.base import Base
+
+class ConversationMember(Base):
+    """Per-(conversation, user) state, so the inbox never has to count message rows."""
+    __tablename__ = 'conversation_members'
+
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, index=True)
+    # bumped by the message writer on insert, reset by mark_messages_read (1-on-1 only;
+    # a group's unread count is its messages above last_read_message_id)
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # everything in the conversation up to this id has been read by user_id
+    last_read_message_id = Column(Integer, nullable=True)
+    # groups: everything up to this id has been pushed to user_id (1-on-1 uses messages.delivered)
+    last_delivered_message_id = Column(Integer, nullable=True)
+    # groups: 'admin' (may add and remove members) or 'member'
+    role = Column(String(20), nullable=False, default='member', server_default='member')
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean
+from sqlalchemy.sql import func
+from app.models.base import Base
+
+class MediaObject(Base):
+    """One row per distinct uploaded file; byte-identical uploads from anyone share it."""
+    __tablename__ = 'media_objects'
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String(100), nullable=True)
+    # extension taken from the first upload's filename, so static serving gets a content type
+    ext = Column(String(10), nullable=False, default='')
+    # filled in by the post-upload processing stage (app/media/store.py process_object)
+    processed = Column(Boolean, nullable=False, default=False, server_default='0')
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    blurhash = Column(String(64), nullable=True)
+    # a <file>.gz variant sits next to the original
+    gzip = Column(Boolean, nullable=False, default=False, server_default='0')
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
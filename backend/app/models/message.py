@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, Text, DateTime, Boolean
+from sqlalchemy import Column, Integer, ForeignKey, String, Text, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from app.models.base import Base
 
@@ -12,4 +12,14 @@ class Message(Base):
     attachment_url = Column(String(1024), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     delivered = Column(Boolean, default=False)
-    read = Column(Boolean, default=False)
\ No newline at end of file
+    read = Column(Boolean, default=False)
+
+    __table_args__ = (
+        # history pages are keyset scans of one conversation ordered by id
+        Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),
+        # partial indexes stay small: only the rows the offline push / read receipts still have to touch
+        Index('ix_messages_undelivered', 'conversation_id', 'id',
+              sqlite_where=delivered == False, postgresql_where=delivered == False),
+        Index('ix_messages_unread', 'conversation_id', 'sender_id',
+              sqlite_where=read == False, postgresql_where=read == False),
+    )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, BigInteger, ForeignKey, String, DateTime
+from sqlalchemy.sql import func
+from app.models.base import Base
+
+class UploadSession(Base):
+    """A resumable upload in progress. The bytes received so far are the partial file on disk."""
+    __tablename__ = 'upload_sessions'
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=True)
+    # declared total; appends past it are rejected and finalize requires exactly this many bytes
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
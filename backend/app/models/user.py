@@ -1,14 +1,25 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index, text
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from app.models.base import Base
 
 class User(Base):
     __tablename__ = 'users'
+    # prefix search over case-folded names (app/db/user_search.py)
+    __table_args__ = (
+        Index('ix_users_username_lower', text('lower(username)')),
+        Index('ix_users_full_name_lower', text('lower(full_name)')),
+    )
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(64), unique=True, index=True, nullable=False)
     full_name = Column(String(100), nullable=True)
     about = Column(String(255), default="Hey there! I am using WhatsApp.")
     password_hash = Column(String(255), nullable=False)
-    avatar = Column(Text, nullable=True)
+    # legacy base64 avatar; converted into the image store by migration 6 and never loaded
+    avatar = deferred(Column(Text, nullable=True))
+    # content hash of the current avatar in the image store (app/media/avatars.py)
+    avatar_key = Column(String(32), nullable=True)
+    # bumped on every avatar change so clients can tell a stale cached copy cheaply
+    avatar_version = Column(Integer, nullable=False, default=0, server_default='0')
     last_seen = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,264 @@
+# app/sockets/bus.py
+import asyncio
+import contextlib
+import json
+from typing import Awaitable, Callable
+from app.config import settings
+
+# deliver(user_id, message): user_id is None for a presence broadcast
+DeliverFn = Callable[[int | None, dict], Awaitable[None]]
+# deliver_many(user_ids, message): one message for several local users (group fan-out)
+DeliverManyFn = Callable[[list[int], dict], Awaitable[None]]
+
+# StreamReader line limit; frames carry whole chat payloads
+MAX_FRAME = 16 * 1024 * 1024
+
+
+def encode_frame(frame: dict) -> bytes:
+    return json.dumps(frame, separators=(",", ":")).encode() + b"\n"
+
+
+class DeliveryBus:
+    """
+    Carries websocket deliveries between workers.
+
+    ConnectionManager claims the users it holds sockets for, and publishes
+    messages for users it doesn't hold. The bus routes each publish only to
+    the worker(s) that claimed the recipient, and keeps every worker's view
+    of who is online anywhere.
+    """
+
+    def __init__(self):
+        self._deliver: DeliverFn | None = None
+        self._deliver_many: DeliverManyFn | None = None
+        self._online: dict[int, int] = {}  # user_id -> number of workers holding them
+
+    async def start(self, deliver: DeliverFn, deliver_many: DeliverManyFn | None = None):
+        self._deliver = deliver
+        self._deliver_many = deliver_many
+
+    async def stop(self):
+        self._deliver = None
+        self._deliver_many = None
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._online
+
+    def worker_count(self, user_id: int) -> int:
+        """How many workers (this one included) hold a socket for user_id."""
+        return self._online.get(user_id, 0)
+
+    async def claim(self, user_id: int):
+        raise NotImplementedError
+
+    async def release(self, user_id: int):
+        raise NotImplementedError
+
+    async def publish(self, user_id: int, message: dict):
+        raise NotImplementedError
+
+    async def publish_many(self, user_ids: list[int], message: dict):
+        """One message for many users: each worker holding some of them gets it once, with its share of the ids."""
+        for user_id in user_ids:
+            await self.publish(user_id, message)
+
+    async def broadcast(self, message: dict):
+        """Hand a presence event to every other worker, which delivers it to its local watchers."""
+        raise NotImplementedError
+
+    def _set_online(self, user_id: int, workers: int):
+        if workers > 0:
+            self._online[user_id] = workers
+        else:
+            self._online.pop(user_id, None)
+
+    async def _dispatch(self, user_id: int | None, message: dict):
+        if self._deliver:
+            try:
+                await self._deliver(user_id, message)
+            except Exception as e:
+                print(f"Error delivering bus message to {user_id}: {e}")
+
+    async def _dispatch_many(self, user_ids: list[int], message: dict):
+        if not self._deliver_many:
+            for user_id in user_ids:
+                await self._dispatch(user_id, message)
+            return
+        try:
+            await self._deliver_many(user_ids, message)
+        except Exception as e:
+            print(f"Error delivering bus message to {len(user_ids)} users: {e}")
+
+
+class InMemoryHub:
+    """Routing table shared by InMemoryBus instances, i.e. "workers" living in one process."""
+
+    def __init__(self):
+        self.buses: list["InMemoryBus"] = []
+        self.owners: dict[int, set["InMemoryBus"]] = {}
+
+    def _presence(self, user_id: int):
+        workers = len(self.owners.get(user_id, ()))
+        for bus in self.buses:
+            bus._set_online(user_id, workers)
+
+
+class InMemoryBus(DeliveryBus):
+    """Bus for tests: several ConnectionManagers in one process sharing an InMemoryHub."""
+
+    def __init__(self, hub: InMemoryHub | None = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+
+    async def start(self, deliver: DeliverFn, deliver_many: DeliverManyFn | None = None):
+        await super().start(deliver, deliver_many)
+        self.hub.buses.append(self)
+        for user_id, owners in self.hub.owners.items():
+            self._set_online(user_id, len(owners))
+
+    async def stop(self):
+        for user_id in [u for u, owners in self.hub.owners.items() if self in owners]:
+            await self.release(user_id)
+        if self in self.hub.buses:
+            self.hub.buses.remove(self)
+        await super().stop()
+
+    async def claim(self, user_id: int):
+        self.hub.owners.setdefault(user_id, set()).add(self)
+        self.hub._presence(user_id)
+
+    async def release(self, user_id: int):
+        owners = self.hub.owners.get(user_id)
+        if owners:
+            owners.discard(self)
+            if not owners:
+                del self.hub.owners[user_id]
+        self.hub._presence(user_id)
+
+    async def publish(self, user_id: int, message: dict):
+        for bus in list(self.hub.owners.get(user_id, ())):
+            if bus is not self:
+                await bus._dispatch(user_id, message)
+
+    async def publish_many(self, user_ids: list[int], message: dict):
+        shares: dict[InMemoryBus, list[int]] = {}
+        for user_id in user_ids:
+            for bus in self.hub.owners.get(user_id, ()):
+                if bus is not self:
+                    shares.setdefault(bus, []).append(user_id)
+        for bus, share in shares.items():
+            await bus._dispatch_many(share, message)
+
+    async def broadcast(self, message: dict):
+        for bus in list(self.hub.buses):
+            if bus is not self:
+                await bus._dispatch(None, message)
+
+
+class UnixSocketBus(DeliveryBus):
+    """
+    Bus client for the hub process in app/sockets/hub.py.
+
+    Frames are newline-delimited JSON. If the hub goes away the client keeps
+    reconnecting in the background and re-claims its users once it is back;
+    local deliveries are unaffected in the meantime.
+    """
+
+    def __init__(self, path: str | None = None, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.path = path or settings.BUS_SOCKET_PATH
+        self.reconnect_delay = reconnect_delay
+        self._claimed: set[int] = set()
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self, deliver: DeliverFn, deliver_many: DeliverManyFn | None = None):
+        await super().start(deliver, deliver_many)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close_writer()
+        await super().stop()
+
+    async def _close_writer(self):
+        # cleared first so nothing sends on it while it closes; the transport (and its fd) is freed now, not at GC
+        writer, self._writer = self._writer, None
+        if writer:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def _send(self, frame: dict):
+        if not self._writer:
+            return
+        try:
+            self._writer.write(encode_frame(frame))
+            await self._writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Delivery bus send failed: {e}")
+
+    async def claim(self, user_id: int):
+        self._claimed.add(user_id)
+        await self._send({"op": "claim", "user_id": user_id})
+
+    async def release(self, user_id: int):
+        self._claimed.discard(user_id)
+        await self._send({"op": "release", "user_id": user_id})
+
+    async def publish(self, user_id: int, message: dict):
+        await self._send({"op": "publish", "user_id": user_id, "message": message})
+
+    async def publish_many(self, user_ids: list[int], message: dict):
+        await self._send({"op": "publish_many", "user_ids": user_ids, "message": message})
+
+    async def broadcast(self, message: dict):
+        await self._send({"op": "broadcast", "message": message})
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME)
+            except (ConnectionError, OSError) as e:
+                print(f"Delivery bus hub unavailable at {self.path}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            for user_id in list(self._claimed):
+                await self._send({"op": "claim", "user_id": user_id})
+
+            try:
+                while line := await reader.readline():
+                    frame = json.loads(line)
+                    op = frame.get("op")
+                    if op == "deliver":
+                        await self._dispatch(frame.get("user_id"), frame["message"])
+                    elif op == "deliver_many":
+                        await self._dispatch_many(frame["user_ids"], frame["message"])
+                    elif op == "presence":
+                        self._set_online(frame["user_id"], frame["workers"])
+                    elif op == "snapshot":
+                        self._online = {int(u): n for u, n in frame["online"].items()}
+            except (ConnectionError, OSError, ValueError) as e:
+                print(f"Delivery bus connection lost: {e}")
+
+            await self._close_writer()
+            self._online.clear()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+def create_bus(kind: str | None = None) -> DeliveryBus | None:
+    kind = (kind or settings.DELIVERY_BUS).lower()
+    if kind == "local":
+        return None
+    if kind == "memory":
+        return InMemoryBus()
+    if kind == "unix":
+        return UnixSocketBus()
+    raise ValueError(f"Unknown DELIVERY_BUS {kind!r}")
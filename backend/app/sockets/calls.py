@@ -0,0 +1,271 @@
+# app/sockets/calls.py
+"""
+Server-side call sessions for the WebRTC signaling on /ws/chat/.
+
+  call_offer     caller  -> ringing: the CallLog row is written and the offer
+                            goes to the callee with its call_id; unanswered
+                            after CALL_OFFER_TIMEOUT_SECONDS it ends as missed
+  call_answer    callee  -> active: CallLog accepted (talk time starts here),
+                            answer forwarded to the caller
+  ice_candidate  either  -> held while ringing, then coalesced: candidates for
+                            the same peer within ICE_BATCH_MS go out as one
+                            "ice_candidates" frame
+  call_end       either  -> ended: CallLog closed and counted in the call
+                            rollups (app/db/call_stats.py), peer notified
+
+Clients don't POST/PATCH /api/calls/ for any of this. A user is in at most
+one call; frames are routed by the session, not by the client's receiver_id.
+
+A session lives on the worker that received the offer. With a delivery bus
+the callee may be connected to another worker, which has no session for
+them: it relays their frames to the caller marked "relay", and the owning
+worker feeds them into the session when the bus delivers them.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from sqlalchemy import update
+from app.config import settings
+from app.db import call_stats
+from app.db.session import AsyncSessionLocal
+from app.models.call_log import CallLog
+from app.sockets.connection_manager import ConnectionManager, manager
+
+SIGNALING_ACTIONS = {"call_offer", "call_answer", "ice_candidate", "call_end"}
+
+RINGING = "ringing"
+ACTIVE = "active"
+
+
+@dataclass(eq=False)
+class CallSession:
+    call_id: int | None
+    caller_id: int
+    receiver_id: int
+    state: str = RINGING
+    # offer timeout while ringing, reconnect grace while active
+    timer: asyncio.TimerHandle | None = None
+    # recipient -> ICE candidates not yet sent to them, and the timer that will send them
+    pending_ice: dict[int, list] = field(default_factory=dict)
+    ice_timers: dict[int, asyncio.TimerHandle] = field(default_factory=dict)
+
+    def peer(self, user_id: int) -> int:
+        return self.receiver_id if user_id == self.caller_id else self.caller_id
+
+
+class CallSessions:
+    def __init__(self, manager: ConnectionManager, session_factory=AsyncSessionLocal,
+                 offer_timeout: float | None = None, batch_ms: float | None = None):
+        self.manager = manager
+        self.session_factory = session_factory
+        self.offer_timeout = settings.CALL_OFFER_TIMEOUT_SECONDS if offer_timeout is None else offer_timeout
+        self.ice_window = (settings.ICE_BATCH_MS if batch_ms is None else batch_ms) / 1000
+        self.by_user: dict[int, CallSession] = {}
+        self._background: set[asyncio.Task] = set()
+        manager.relay_handler = self.handle_relayed
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def stop(self):
+        # calls still up are left open in call_logs; nothing can close them without the sockets
+        for call in set(self.by_user.values()):
+            self._forget(call)
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    # --- frames in ---------------------------------------------------------
+
+    async def handle(self, user_id: int, frame: dict):
+        """A signaling frame from one of user_id's sockets."""
+        action = frame.get("action")
+        if action == "call_offer":
+            receiver_id = self._receiver_id(frame)
+            if receiver_id is not None and receiver_id != user_id:
+                await self._offer(user_id, receiver_id, frame)
+            return
+        call = self.by_user.get(user_id)
+        if call is not None:
+            await self._signal(call, user_id, action, frame)
+            return
+        # the session is on another worker (or there is none): let the bus take the frame there
+        receiver_id = self._receiver_id(frame)
+        if self.manager.bus and receiver_id is not None:
+            await self.manager.send_personal_message({**frame, "sender_id": user_id, "relay": True}, receiver_id)
+
+    async def handle_relayed(self, user_id: int, frame: dict) -> bool:
+        """A relayed frame the bus delivered to user_id; True if a session here took it."""
+        call = self.by_user.get(user_id)
+        sender_id = frame.get("sender_id")
+        if call is None or sender_id != call.peer(user_id):
+            return False
+        await self._signal(call, sender_id, frame.get("action"), frame)
+        return True
+
+    @staticmethod
+    def _receiver_id(frame: dict) -> int | None:
+        try:
+            return int(frame.get("receiver_id"))
+        except (TypeError, ValueError):
+            return None
+
+    async def _offer(self, caller_id: int, receiver_id: int, frame: dict):
+        previous = self.by_user.get(caller_id)
+        if previous is not None:
+            # calling again means hanging up whatever call the caller was still in
+            await self._end(previous, caller_id, "hangup")
+        call_id = await self._create_log(caller_id, receiver_id)
+        if receiver_id in self.by_user:
+            await self._close_log(call_id, call_stats.MISSED)
+            await self._send(caller_id, receiver_id, call_id, {"action": "call_end", "reason": "busy"})
+            return
+
+        call = CallSession(call_id, caller_id, receiver_id)
+        self.by_user[caller_id] = self.by_user[receiver_id] = call
+        call.timer = asyncio.get_running_loop().call_later(self.offer_timeout, self._timed_out, call)
+        await self._send(receiver_id, caller_id, call_id, frame)
+
+    async def _signal(self, call: CallSession, sender_id: int, action: str, frame: dict):
+        if action == "call_answer":
+            if sender_id != call.receiver_id or call.state != RINGING:
+                return
+            call.state = ACTIVE
+            self._cancel(call.timer)
+            call.timer = None
+            await self._answer_log(call.call_id)
+            await self._send(call.caller_id, sender_id, call.call_id, frame)
+            # everything held while it rang goes out now, after the answer
+            for recipient in list(call.pending_ice):
+                await self._flush_ice(call, recipient)
+        elif action == "ice_candidate":
+            candidate = frame.get("candidate")
+            if candidate is not None:
+                self._queue_ice(call, call.peer(sender_id), candidate)
+        elif action == "call_end":
+            await self._end(call, sender_id, "hangup")
+
+    # --- ICE batching -------------------------------------------------------
+
+    def _queue_ice(self, call: CallSession, recipient: int, candidate):
+        pending = call.pending_ice.setdefault(recipient, [])
+        if len(pending) >= settings.ICE_MAX_PENDING:
+            return
+        pending.append(candidate)
+        if call.state == ACTIVE and recipient not in call.ice_timers:
+            loop = asyncio.get_running_loop()
+            call.ice_timers[recipient] = loop.call_later(
+                self.ice_window, lambda: self._spawn(self._flush_ice(call, recipient))
+            )
+
+    async def _flush_ice(self, call: CallSession, recipient: int):
+        self._cancel(call.ice_timers.pop(recipient, None))
+        candidates = call.pending_ice.pop(recipient, None)
+        if candidates and self.by_user.get(recipient) is call:
+            await self._send(recipient, call.peer(recipient), call.call_id,
+                             {"action": "ice_candidates", "candidates": candidates})
+
+    # --- ending -------------------------------------------------------------
+
+    def _timed_out(self, call: CallSession):
+        call.timer = None
+        if call.state == RINGING:
+            self._spawn(self._end(call, None, "timeout"))
+
+    async def user_left(self, user_id: int):
+        """user_id's socket closed; call when it may have been their last one."""
+        call = self.by_user.get(user_id)
+        if call is None or self.manager.is_online(user_id):
+            return
+        if call.state == RINGING:
+            await self._end(call, user_id, "disconnected")
+            return
+        # the media may well still be flowing: give the chat socket time to come back
+        self._cancel(call.timer)
+        call.timer = asyncio.get_running_loop().call_later(
+            settings.CALL_RECONNECT_GRACE_SECONDS, self._grace_over, call, user_id
+        )
+
+    def _grace_over(self, call: CallSession, user_id: int):
+        call.timer = None
+        if self.by_user.get(user_id) is call and not self.manager.is_online(user_id):
+            self._spawn(self._end(call, user_id, "disconnected"))
+
+    async def _end(self, call: CallSession, ended_by: int | None, reason: str):
+        if self.by_user.get(call.caller_id) is not call:
+            return  # already ended
+        self._forget(call)
+        if call.state == ACTIVE:
+            status = call_stats.ANSWERED
+        elif ended_by == call.receiver_id and reason == "hangup":
+            status = "rejected"
+        else:
+            status = call_stats.MISSED
+        await self._close_log(call.call_id, status)
+        # the side that hung up knows; a timeout or a drop is news to both
+        for user_id in (call.caller_id, call.receiver_id):
+            if user_id != ended_by or reason != "hangup":
+                await self._send(user_id, call.peer(user_id), call.call_id, {"action": "call_end", "reason": reason})
+
+    def _forget(self, call: CallSession):
+        for user_id in (call.caller_id, call.receiver_id):
+            if self.by_user.get(user_id) is call:
+                del self.by_user[user_id]
+        self._cancel(call.timer)
+        call.timer = None
+        for timer in call.ice_timers.values():
+            timer.cancel()
+        call.ice_timers.clear()
+        call.pending_ice.clear()
+
+    @staticmethod
+    def _cancel(timer: asyncio.TimerHandle | None):
+        if timer:
+            timer.cancel()
+
+    # --- frames out and call_logs -------------------------------------------
+
+    async def _send(self, user_id: int, sender_id: int, call_id: int | None, frame: dict):
+        message = {k: v for k, v in frame.items() if k != "relay"}
+        message.update(receiver_id=user_id, sender_id=sender_id, call_id=call_id)
+        await self.manager.send_personal_message(message, user_id)
+
+    async def _create_log(self, caller_id: int, receiver_id: int) -> int | None:
+        try:
+            async with self.session_factory() as db:
+                call = CallLog(caller_id=caller_id, receiver_id=receiver_id, status=call_stats.MISSED)
+                db.add(call)
+                await db.commit()
+                return call.id
+        except Exception as e:
+            # the call itself can go ahead without its log row
+            print(f"ERROR creating call log: {e}")
+            return None
+
+    async def _answer_log(self, call_id: int | None):
+        if call_id is None:
+            return
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(CallLog)
+                    .where(CallLog.id == call_id)
+                    .values(status=call_stats.ANSWERED, start_time=datetime.now(timezone.utc))
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"ERROR updating call log {call_id}: {e}")
+
+    async def _close_log(self, call_id: int | None, status: str):
+        if call_id is None:
+            return
+        try:
+            async with self.session_factory() as db:
+                await call_stats.close_call(db, call_id, status, datetime.now(timezone.utc))
+                await db.commit()
+        except Exception as e:
+            print(f"ERROR closing call log {call_id}: {e}")
+
+
+call_sessions = CallSessions(manager)
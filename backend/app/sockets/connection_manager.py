@@ -1,53 +1,320 @@
+import asyncio
 import json
 from datetime import datetime
 from fastapi import WebSocket
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import update
+from app.config import settings
 from app.models.user import User
-from app.db.session import AsyncSessionLocal
+from app.db.group_commit import statement_writer
+from app.sockets.bus import DeliveryBus, create_bus
+from app.sockets.presence import PresenceIndex
+from app.sockets.inbox import push_offline_backlog
+from app.sockets.replay import ReplayStore
+
+# Events that are only useful while fresh; safe to drop for a lagging receiver
+EPHEMERAL_EVENTS = {"user_status", "ice_candidate", "ice_candidates"}
+
+# Close code sent to a consumer that can't keep up with its outbound queue
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+def is_ephemeral(message: dict) -> bool:
+    # signaling frames are forwarded as sent by the client, so they carry "action" instead of "type"
+    return message.get("type") in EPHEMERAL_EVENTS or message.get("action") in EPHEMERAL_EVENTS
+
+
+class Connection:
+    """
+    One live websocket plus its bounded outbound queue.
+
+    Senders only enqueue; a dedicated writer task does the actual send_text,
+    so a stalled receiver never blocks whoever is sending to it. A worker can
+    hold tens of thousands of these, hence __slots__.
+    """
+
+    __slots__ = ("websocket", "user_id", "queue", "dropped", "closing", "writer")
+
+    def __init__(self, websocket: WebSocket, user_id: int, max_queue: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.closing = False
+        self.writer: asyncio.Task | None = None
+
+    def start(self, on_error):
+        self.writer = asyncio.create_task(self._write_loop(on_error))
+
+    async def _write_loop(self, on_error):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Send to user {self.user_id} failed: {e}")
+            await on_error(self)
+
+    def offer(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def stop(self):
+        # tells anything still waiting to queue to this connection (the backlog) to give up
+        self.closing = True
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, WebSocket] = {}
+    def __init__(self, bus: DeliveryBus | None = None, max_queue: int | None = None, overflow_policy: str | None = None,
+                 presence: PresenceIndex | None = None, presence_window_ms: float | None = None,
+                 replay: ReplayStore | None = None):
+        # user_id -> every live socket (tab/device) of that user
+        self.active_connections: dict[int, set[Connection]] = {}
+        # Users connected to other workers are reached through the bus (None = single worker)
+        self.bus = bus
+        self.max_queue = max_queue or settings.OUTBOUND_QUEUE_SIZE
+        self.overflow_policy = overflow_policy or settings.OUTBOUND_OVERFLOW_POLICY
+        # Presence goes only to local users who share a conversation with the changed user
+        self.presence = presence or PresenceIndex()
+        window_ms = settings.PRESENCE_COALESCE_MS if presence_window_ms is None else presence_window_ms
+        self.presence_window = window_ms / 1000
+        self._presence_sent: dict[int, str] = {}
+        self._presence_pending: dict[int, str] = {}
+        self._presence_timers: dict[int, asyncio.TimerHandle] = {}
+        self._background: set[asyncio.Task] = set()
+        # Recent chat events per user, so a reconnect can resume instead of resyncing
+        self.replay = replay or ReplayStore(settings.REPLAY_BUFFER_SIZE, settings.REPLAY_RETENTION_SECONDS)
+        # Takes call signaling relayed from another worker (app/sockets/calls.py); True if handled
+        self.relay_handler = None
+        self.fanout_batch = settings.FANOUT_BATCH_SIZE
 
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        await self.broadcast_status(user_id, "online")
+    async def start(self):
+        if self.bus:
+            await self.bus.start(self._deliver_from_bus, self._deliver_many_from_bus)
 
-    async def disconnect(self, user_id: int):
+    async def stop(self):
+        if self.bus:
+            await self.bus.stop()
+
+    def is_online(self, user_id: int) -> bool:
         if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            await self.update_last_seen(user_id)
-            await self.broadcast_status(user_id, "offline")
+            return True
+        return bool(self.bus and self.bus.is_online(user_id))
+
+    def queue_stats(self) -> list[dict]:
+        return [
+            {"user_id": conn.user_id, "queue_depth": conn.queue.qsize(), "dropped": conn.dropped}
+            for conns in self.active_connections.values()
+            for conn in conns
+        ]
+
+    async def connect(self, websocket: WebSocket, user_id: int,
+                      resume_token: str | None = None, last_seq: int | None = None) -> Connection:
+        await websocket.accept()
+        conn = Connection(websocket, user_id, self.max_queue)
+        conn.start(self._drop_connection)
+        conns = self.active_connections.setdefault(user_id, set())
+        conns.add(conn)
+        # before any await, so nothing sent to user_id can slip in between the replay and live events
+        self._open_session(conn, resume_token, last_seq)
+        # presence only changes with the first device in, on any worker
+        if len(conns) == 1:
+            elsewhere = self.bus.worker_count(user_id) if self.bus else 0
+            if self.bus:
+                await self.bus.claim(user_id)
+            await self.presence.load(user_id)
+            if not elsewhere:
+                await self.status_changed(user_id, "online")
+        self._spawn(self._push_backlog(conn))
+        return conn
+
+    def _open_session(self, conn: Connection, resume_token: str | None, last_seq: int | None):
+        log = self.replay.attach(conn.user_id)
+        missed = None
+        if resume_token and resume_token == log.token and last_seq is not None:
+            missed = log.since(last_seq)
+        # resumed=False: the client must re-fetch contacts/history (first connect, or the buffer moved on)
+        conn.offer(json.dumps({"type": "session", "resume_token": log.token, "seq": log.seq, "resumed": missed is not None}))
+        if missed:
+            conn.offer('{"type": "replay", "events": [' + ", ".join(missed) + "]}")
+
+    def _spawn(self, coro):
+        # held until done so the loop can't collect it mid-flight, and its failure is reported
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"ERROR in background task {task.get_coro().__qualname__}: {task.exception()}")
+
+    async def _push_backlog(self, conn: Connection):
+        try:
+            await push_offline_backlog(self, conn, settings.INBOX_BATCH_SIZE)
+        except Exception as e:
+            print(f"Error pushing offline backlog to user {conn.user_id}: {e}")
+
+    async def disconnect(self, conn: Connection):
+        conns = self.active_connections.get(conn.user_id)
+        # a slow consumer may already have been dropped
+        if not conns or conn not in conns:
+            return
+        conns.discard(conn)
+        conn.stop()
+        # ...and with the last device out
+        if not conns:
+            del self.active_connections[conn.user_id]
+            self.presence.unload(conn.user_id)
+            self.replay.detach(conn.user_id)
+            elsewhere = self.bus.worker_count(conn.user_id) - 1 if self.bus else 0
+            if self.bus:
+                await self.bus.release(conn.user_id)
+            if elsewhere <= 0:
+                await self.update_last_seen(conn.user_id)
+                await self.status_changed(conn.user_id, "offline")
+
+    async def _drop_connection(self, conn: Connection):
+        conn.closing = True
+        try:
+            await conn.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+        await self.disconnect(conn)
+
+    def _enqueue(self, conn: Connection, text: str, ephemeral: bool):
+        if conn.offer(text):
+            return
+        if ephemeral and self.overflow_policy == "drop_ephemeral":
+            conn.dropped += 1
+            return
+        conn.dropped += 1
+        if not conn.closing:
+            print(f"Outbound queue full for user {conn.user_id}, disconnecting slow consumer")
+            conn.closing = True
+            self._spawn(self._drop_connection(conn))
+
+    def _encode(self, user_id: int, message: dict, ephemeral: bool) -> str:
+        # chat events for a user with a replay log here get a seq and a copy in the log;
+        # call signaling (forwarded client frames, keyed by "action") is only useful live
+        log = None if ephemeral or "action" in message else self.replay.get(user_id)
+        return log.append(message) if log else json.dumps(message)
+
+    def _send_local(self, user_id: int, text: str, ephemeral: bool) -> bool:
+        conns = self.active_connections.get(user_id)
+        if not conns:
+            return False
+        for conn in list(conns):
+            self._enqueue(conn, text, ephemeral)
+        return True
 
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(json.dumps(message))
+        # fans out to every device of user_id; a user's devices may sit on different workers
+        ephemeral = is_ephemeral(message)
+        sent = self._send_local(user_id, self._encode(user_id, message, ephemeral), ephemeral)
+        if self.bus and (not sent or self.bus.worker_count(user_id) > 1):
+            await self.bus.publish(user_id, message)
+
+    async def send_to_many(self, message: dict, user_ids) -> None:
+        """
+        Group fan-out: one message for many users.
+
+        The message is serialized once; a recipient with a replay log gets that
+        text with its own seq spliced in. Users held on other workers go out as
+        one bus multicast rather than a publish each.
+        """
+        ephemeral = is_ephemeral(message)
+        elsewhere = await self._fan_out_local(user_ids, json.dumps(message), ephemeral)
+        if self.bus and elsewhere:
+            await self.bus.publish_many(elsewhere, message)
+
+    async def _fan_out_local(self, user_ids, body: str, ephemeral: bool) -> list[int]:
+        """Queue body to every local socket of user_ids; returns the users (also) held elsewhere."""
+        elsewhere = []
+        for n, user_id in enumerate(user_ids, 1):
+            conns = self.active_connections.get(user_id)
+            if conns:
+                log = None if ephemeral else self.replay.get(user_id)
+                text = log.append_encoded(body) if log else body
+                for conn in list(conns):
+                    self._enqueue(conn, text, ephemeral)
+            if self.bus and (self.bus.worker_count(user_id) > (1 if conns else 0)):
+                elsewhere.append(user_id)
+            if n % self.fanout_batch == 0:
+                # let other sockets' traffic through between batches of a big group
+                await asyncio.sleep(0)
+        return elsewhere
+
+    def link_contacts(self, user_a: int, user_b: int):
+        """Call when two users (may) have just started a conversation."""
+        self.presence.link(user_a, user_b)
+
+    async def status_changed(self, user_id: int, status: str):
+        # The first transition goes out at once; flaps inside the following
+        # window collapse into whatever the final state is when it closes.
+        if user_id in self._presence_timers:
+            self._presence_pending[user_id] = status
+            return
+        await self.broadcast_status(user_id, status)
+        if self.presence_window > 0:
+            self._presence_sent[user_id] = status
+            loop = asyncio.get_running_loop()
+            self._presence_timers[user_id] = loop.call_later(self.presence_window, self._close_presence_window, user_id)
+
+    def _close_presence_window(self, user_id: int):
+        del self._presence_timers[user_id]
+        sent = self._presence_sent.pop(user_id, None)
+        status = self._presence_pending.pop(user_id, None)
+        if status and status != sent:
+            self._spawn(self.status_changed(user_id, status))
 
     async def broadcast_status(self, user_id: int, status: str):
-        # In a real app, we'd only broadcast to contacts. 
-        # For now, broadcasting to all active connections is simpler but less scalable.
-        # To improve, we should fetch contacts of user_id and only send to them.
         message = {
             "type": "user_status",
             "user_id": user_id,
             "status": status,
             "last_seen": datetime.utcnow().isoformat() if status == "offline" else None
         }
-        for connection in self.active_connections.values():
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                pass
+        self._send_presence_local(message)
+        if self.bus:
+            await self.bus.broadcast(message)
+
+    def _send_presence_local(self, message: dict):
+        # serialized once, however many watchers there are
+        text = json.dumps(message)
+        for watcher_id in list(self.presence.watchers_of(message["user_id"])):
+            self._send_local(watcher_id, text, True)
+
+    async def _deliver_from_bus(self, user_id: int | None, message: dict):
+        if user_id is None:
+            self._send_presence_local(message)
+            return
+        if message.get("type") == "new_message":
+            # the conversation may have been created on another worker
+            self.presence.link(user_id, message["sender_id"])
+        if message.get("relay"):
+            # signaling from a worker without the call session; the session may be here
+            if self.relay_handler and await self.relay_handler(user_id, message):
+                return
+            message = {k: v for k, v in message.items() if k != "relay"}
+        ephemeral = is_ephemeral(message)
+        self._send_local(user_id, self._encode(user_id, message, ephemeral), ephemeral)
+
+    async def _deliver_many_from_bus(self, user_ids: list[int], message: dict):
+        await self._fan_out_local(user_ids, json.dumps(message), is_ephemeral(message))
 
     async def update_last_seen(self, user_id: int):
-        async with AsyncSessionLocal() as db:
-            try:
-                stmt = update(User).where(User.id == user_id).values(last_seen=datetime.utcnow())
-                await db.execute(stmt)
-                await db.commit()
-            except Exception as e:
-                print(f"Error updating last_seen: {e}")
-
-manager = ConnectionManager()
+        try:
+            # group-committed with other disconnects instead of a transaction each
+            await statement_writer.execute(update(User).where(User.id == user_id).values(last_seen=datetime.utcnow()))
+        except Exception as e:
+            print(f"Error updating last_seen: {e}")
+
+manager = ConnectionManager(bus=create_bus())
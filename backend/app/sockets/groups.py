@@ -0,0 +1,42 @@
+# app/sockets/groups.py
+from app.db import groups
+from app.db.groups import delivery_watermarks
+from app.db.message_writer import message_writer
+from app.db.session import AsyncSessionLocal
+from app.models.user import User
+from sqlalchemy import select
+
+
+async def send_group_message(manager, sender_id: int, conversation_id: int, content: str,
+                             session_factory=AsyncSessionLocal) -> int | None:
+    """
+    Store a group message and fan it out to every member (the sender's own
+    devices included, as its echo). Returns the message id, or None if
+    sender_id isn't a member.
+
+    The frame is built and serialized once for the whole group
+    (ConnectionManager.send_to_many); members online now have their delivered
+    watermark moved past it, everyone else gets it from the backlog on connect.
+    """
+    async with session_factory() as db:
+        members = await groups.member_ids(db, conversation_id)
+        if sender_id not in members:
+            return None
+        sender_username = (await db.execute(select(User.username).where(User.id == sender_id))).scalar()
+
+    message_id, created_at = await message_writer.submit(
+        conversation_id=conversation_id, sender_id=sender_id, content=content, group=True
+    )
+    await manager.send_to_many({
+        "type": "group_message",
+        "id": message_id,
+        "conversation_id": conversation_id,
+        "message": content,
+        "sender_id": sender_id,
+        "sender_username": sender_username,
+        "timestamp": created_at.isoformat(),
+    }, members)
+    delivery_watermarks.advance(
+        conversation_id, [m for m in members if m != sender_id and manager.is_online(m)], message_id
+    )
+    return message_id
@@ -0,0 +1,110 @@
+# app/sockets/hub.py
+"""
+Local delivery hub for running several uvicorn workers on one box.
+
+    python -m app.sockets.hub [--path /tmp/whatsap-bus.sock]
+    DELIVERY_BUS=unix uvicorn main:app --workers 4
+
+Each worker connects with UnixSocketBus and claims the users it holds
+sockets for. The hub forwards a publish only to the workers that claimed
+the recipient, and tells every worker when a user comes online or goes
+offline anywhere.
+"""
+import argparse
+import asyncio
+import json
+import os
+from app.config import settings
+from app.sockets.bus import MAX_FRAME, encode_frame
+
+
+class BusHub:
+    def __init__(self, max_buffer: int | None = None):
+        self.workers: set[asyncio.StreamWriter] = set()
+        self.owners: dict[int, set[asyncio.StreamWriter]] = {}
+        self.max_buffer = max_buffer or settings.BUS_WORKER_BUFFER_BYTES
+
+    def _send(self, writer: asyncio.StreamWriter, frame: dict):
+        # never waits on a worker: one that stops reading is cut off, like a slow websocket consumer
+        if writer.is_closing():
+            return
+        try:
+            writer.write(encode_frame(frame))
+        except (ConnectionError, OSError):
+            return
+        buffered = writer.transport.get_write_buffer_size()
+        if buffered > self.max_buffer:
+            print(f"Hub: worker not reading ({buffered} bytes buffered), disconnecting it")
+            # its read loop sees the connection drop and releases its users
+            writer.transport.abort()
+
+    def _presence(self, user_id: int):
+        frame = {"op": "presence", "user_id": user_id, "workers": len(self.owners.get(user_id, ()))}
+        for worker in self.workers:
+            self._send(worker, frame)
+
+    def _release(self, writer: asyncio.StreamWriter, user_id: int):
+        owners = self.owners.get(user_id)
+        if owners and writer in owners:
+            owners.discard(writer)
+            if not owners:
+                del self.owners[user_id]
+            self._presence(user_id)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.workers.add(writer)
+        self._send(writer, {"op": "snapshot", "online": {str(u): len(o) for u, o in self.owners.items()}})
+        try:
+            while line := await reader.readline():
+                frame = json.loads(line)
+                op = frame.get("op")
+                if op == "claim":
+                    user_id = int(frame["user_id"])
+                    self.owners.setdefault(user_id, set()).add(writer)
+                    self._presence(user_id)
+                elif op == "release":
+                    self._release(writer, int(frame["user_id"]))
+                elif op == "publish":
+                    out = {"op": "deliver", "user_id": frame["user_id"], "message": frame["message"]}
+                    for owner in self.owners.get(int(frame["user_id"]), ()):
+                        if owner is not writer:
+                            self._send(owner, out)
+                elif op == "publish_many":
+                    # one frame per worker holding any of the users, not one per user
+                    shares: dict[asyncio.StreamWriter, list[int]] = {}
+                    for user_id in frame["user_ids"]:
+                        for owner in self.owners.get(int(user_id), ()):
+                            if owner is not writer:
+                                shares.setdefault(owner, []).append(user_id)
+                    for owner, share in shares.items():
+                        self._send(owner, {"op": "deliver_many", "user_ids": share, "message": frame["message"]})
+                elif op == "broadcast":
+                    out = {"op": "deliver", "user_id": None, "message": frame["message"]}
+                    for worker in self.workers:
+                        if worker is not writer:
+                            self._send(worker, out)
+        except (ConnectionError, OSError, ValueError) as e:
+            print(f"Hub: worker connection error: {e}")
+        finally:
+            # a worker that died takes its users offline with it
+            self.workers.discard(writer)
+            for user_id in [u for u, owners in self.owners.items() if writer in owners]:
+                self._release(writer, user_id)
+            writer.close()
+
+
+async def serve(path: str):
+    if os.path.exists(path):
+        os.unlink(path)
+    hub = BusHub()
+    server = await asyncio.start_unix_server(hub.handle, path=path, limit=MAX_FRAME)
+    print(f"Delivery hub listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=settings.BUS_SOCKET_PATH)
+    args = parser.parse_args()
+    asyncio.run(serve(args.path))
@@ -0,0 +1,148 @@
+# app/sockets/inbox.py
+import asyncio
+import json
+from sqlalchemy import select, update, or_, and_, func
+from app.db.groups import advance_statement, delivery_watermarks
+from app.db.session import AsyncSessionLocal
+from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
+from app.models.message import Message
+
+# how often a backlog waiting for queue room re-checks that its socket is still there
+QUEUE_WAIT_SECONDS = 1.0
+
+
+def _backlog_frame(rows, group: bool = False) -> str:
+    return json.dumps({
+        "type": "inbox_batch",
+        "messages": [{
+            "id": row.id,
+            "conversation_id": row.conversation_id,
+            "message": row.content,
+            "message_type": row.type,
+            "attachment_url": row.attachment_url,
+            "sender_id": row.sender_id,
+            "timestamp": row.created_at.isoformat() if row.created_at else None,
+            "delivered": True,
+            "read": False,
+            **({"group": True} if group else {}),
+        } for row in rows],
+    })
+
+
+async def _queue_frame(conn, frame: str) -> bool:
+    """
+    Wait for room in conn's queue rather than tripping the overflow policy on
+    our own backlog, but give up once the connection is closing (its writer
+    is gone and nothing would ever make room). True if the frame was queued.
+    """
+    while not conn.closing:
+        try:
+            await asyncio.wait_for(conn.queue.put(frame), QUEUE_WAIT_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            continue
+    return False
+
+
+async def push_offline_backlog(manager, conn, batch_size: int, session_factory=AsyncSessionLocal) -> int:
+    """
+    Stream every message sent to conn.user_id while they were offline.
+
+    Messages go out as `inbox_batch` frames of up to batch_size, each batch is
+    marked delivered with one UPDATE once its frame is queued (a socket that
+    drops first leaves the rest undelivered for next time), and every sender gets a single
+    `messages_delivered` receipt covering all of their messages at the end.
+    Group messages follow, by the member's delivered watermark (no receipts:
+    a group's delivery counts are read off the watermarks).
+    Returns the number of messages pushed.
+    """
+    user_id = conn.user_id
+    delivered_by_sender: dict[int, dict[int, list[int]]] = {}  # sender -> conversation -> ids
+    last_id = 0
+    total = 0
+
+    while not conn.closing:
+        async with session_factory() as db:
+            result = await db.execute(
+                select(Message.id, Message.conversation_id, Message.sender_id, Message.content,
+                       Message.type, Message.attachment_url, Message.created_at)
+                .join(Conversation, Conversation.id == Message.conversation_id)
+                .where(
+                    or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id),
+                    Message.sender_id != user_id,
+                    Message.delivered == False,
+                    Message.id > last_id,
+                )
+                .order_by(Message.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+        if not rows or not await _queue_frame(conn, _backlog_frame(rows)):
+            break
+
+        ids = [row.id for row in rows]
+        async with session_factory() as db:
+            await db.execute(update(Message).where(Message.id.in_(ids)).values(delivered=True))
+            await db.commit()
+
+        for row in rows:
+            delivered_by_sender.setdefault(row.sender_id, {}).setdefault(row.conversation_id, []).append(row.id)
+        last_id = ids[-1]
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    for sender_id, conversations in delivered_by_sender.items():
+        for conversation_id, message_ids in conversations.items():
+            await manager.send_personal_message({
+                "type": "messages_delivered",
+                "conversation_id": conversation_id,
+                "receiver_id": user_id,
+                "message_ids": message_ids,
+            }, sender_id)
+    return total + await _push_group_backlog(conn, batch_size, session_factory)
+
+
+async def _push_group_backlog(conn, batch_size: int, session_factory) -> int:
+    user_id = conn.user_id
+    # marks still only in memory would have us re-push messages the user got live
+    await delivery_watermarks.flush()
+    last_id = 0
+    total = 0
+
+    while not conn.closing:
+        async with session_factory() as db:
+            result = await db.execute(
+                select(Message.id, Message.conversation_id, Message.sender_id, Message.content,
+                       Message.type, Message.attachment_url, Message.created_at)
+                .join(ConversationMember, and_(
+                    ConversationMember.conversation_id == Message.conversation_id,
+                    ConversationMember.user_id == user_id,
+                ))
+                .join(Conversation, Conversation.id == Message.conversation_id)
+                .where(
+                    Conversation.is_group == True,
+                    Message.id > func.coalesce(ConversationMember.last_delivered_message_id, 0),
+                    Message.sender_id != user_id,
+                    Message.id > last_id,
+                )
+                .order_by(Message.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+        if not rows or not await _queue_frame(conn, _backlog_frame(rows, group=True)):
+            break
+
+        # rows are in id order, so the last one seen per group is its new watermark
+        newest = {row.conversation_id: row.id for row in rows}
+        async with session_factory() as db:
+            await db.execute(advance_statement("last_delivered_message_id"), [
+                {"cid": cid, "uid": user_id, "mid": mid} for cid, mid in newest.items()
+            ])
+            await db.commit()
+        last_id = rows[-1].id
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+    return total
@@ -0,0 +1,52 @@
+# app/sockets/presence.py
+from sqlalchemy import select, or_
+from app.db.session import AsyncSessionLocal
+from app.models.conversation import Conversation
+
+
+class PresenceIndex:
+    """
+    Who should hear about whose presence, for the users connected to this worker.
+
+    contacts[u] is everyone u shares a conversation with (loaded when u's
+    first device connects); watchers[x] is the reverse edge restricted to
+    local users, so a status change for x is delivered to len(watchers[x])
+    sockets instead of to every socket on the worker.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.contacts: dict[int, set[int]] = {}
+        self.watchers: dict[int, set[int]] = {}
+
+    async def load(self, user_id: int):
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(Conversation.user1_id, Conversation.user2_id).where(
+                    or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
+                )
+            )
+            rows = result.all()
+        contacts = {u2 if u1 == user_id else u1 for u1, u2 in rows}
+        self.contacts[user_id] = contacts
+        for contact_id in contacts:
+            self.watchers.setdefault(contact_id, set()).add(user_id)
+
+    def unload(self, user_id: int):
+        for contact_id in self.contacts.pop(user_id, ()):
+            watchers = self.watchers.get(contact_id)
+            if watchers:
+                watchers.discard(user_id)
+                if not watchers:
+                    del self.watchers[contact_id]
+
+    def link(self, user_a: int, user_b: int):
+        """Record a (possibly new) conversation between two users; cheap and idempotent."""
+        for me, other in ((user_a, user_b), (user_b, user_a)):
+            contacts = self.contacts.get(me)
+            if contacts is not None and other not in contacts:
+                contacts.add(other)
+                self.watchers.setdefault(other, set()).add(me)
+
+    def watchers_of(self, user_id: int) -> set[int]:
+        return self.watchers.get(user_id, set())
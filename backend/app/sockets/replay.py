@@ -0,0 +1,84 @@
+# app/sockets/replay.py
+import asyncio
+import json
+import secrets
+from collections import deque
+
+
+class ReplayLog:
+    """
+    The last `size` chat events sent to one user on this worker, numbered by seq.
+
+    token identifies this log: a reconnect presenting it with the last seq it
+    saw gets exactly the events after that seq. A different token (another
+    worker, a restart, a log that expired) means the client must resync.
+    """
+
+    __slots__ = ("token", "seq", "events")
+
+    def __init__(self, size: int):
+        self.token = secrets.token_urlsafe(12)
+        self.seq = 0
+        self.events: deque[tuple[int, str, bool]] = deque(maxlen=size)
+
+    def append(self, message: dict) -> str:
+        """Number message and serialize it once for both live delivery and replay."""
+        # A new_message that found the receiver offline is still undelivered in
+        # the DB, so the inbox backlog pushes it on reconnect; replaying it too would duplicate it.
+        replayable = not (message.get("type") == "new_message" and not message.get("delivered"))
+        return self.append_encoded(json.dumps(message), replayable)
+
+    def append_encoded(self, body: str, replayable: bool = True) -> str:
+        """append() for a message already serialized (a non-empty JSON object): seq is spliced in, not re-encoded."""
+        self.seq += 1
+        text = f'{body[:-1]}, "seq": {self.seq}}}'
+        self.events.append((self.seq, text, replayable))
+        return text
+
+    def since(self, last_seq: int) -> list[str] | None:
+        """Events after last_seq, or None if the buffer has already rolled past it."""
+        if last_seq < 0 or last_seq > self.seq:
+            return None
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [text for seq, text, replayable in self.events if seq > last_seq and replayable]
+
+
+class ReplayStore:
+    """
+    user_id -> ReplayLog for users connected to this worker.
+
+    A log outlives its user's last socket by `retention` seconds, so a client
+    that drops and comes straight back (network handover, laptop lid) can
+    resume instead of re-fetching contacts and history.
+    """
+
+    def __init__(self, size: int, retention: float):
+        self.size = size
+        self.retention = retention
+        self.logs: dict[int, ReplayLog] = {}
+        self._expiry: dict[int, asyncio.TimerHandle] = {}
+
+    def get(self, user_id: int) -> ReplayLog | None:
+        return self.logs.get(user_id)
+
+    def attach(self, user_id: int) -> ReplayLog:
+        timer = self._expiry.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        log = self.logs.get(user_id)
+        if log is None:
+            log = self.logs[user_id] = ReplayLog(self.size)
+        return log
+
+    def detach(self, user_id: int):
+        """The user's last local socket is gone; keep the log around for retention seconds."""
+        if user_id not in self.logs or user_id in self._expiry:
+            return
+        loop = asyncio.get_running_loop()
+        self._expiry[user_id] = loop.call_later(self.retention, self._expire, user_id)
+
+    def _expire(self, user_id: int):
+        self._expiry.pop(user_id, None)
+        self.logs.pop(user_id, None)
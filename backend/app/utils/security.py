@@ -1,8 +1,12 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 from jose import jwt
 from app.config import settings
+import asyncio
 import hashlib
+import hmac
+import multiprocessing
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
@@ -11,21 +15,88 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _is_legacy_hash(hashed: str) -> bool:
+    # unsalted SHA256 from before passlib: 64 hex chars
+    if len(hashed) != 64:
+        return False
+    try:
+        int(hashed, 16)
+    except ValueError:
+        return False
+    return True
+
+
 def verify_password(plain: str, hashed: str) -> bool:
-    # Check for legacy SHA256 hash (64 hex chars)
-    if len(hashed) == 64:
-        try:
-            # Try to interpret as hex
-            int(hashed, 16)
-            # It is likely a SHA256 hash
-            legacy_hash = hashlib.sha256(plain.encode()).hexdigest()
-            return legacy_hash == hashed
-        except ValueError:
-            pass
-            
+    if _is_legacy_hash(hashed):
+        legacy_hash = hashlib.sha256(plain.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, hashed.lower())
+
     return pwd_context.verify(plain, hashed)
 
 
+def verify_and_update(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """(valid, replacement hash or None). Legacy and deprecated hashes get a fresh one on success."""
+    if _is_legacy_hash(hashed):
+        if not verify_password(plain, hashed):
+            return False, None
+        return True, pwd_context.hash(plain)
+    return pwd_context.verify_and_update(plain, hashed)
+
+
+# pbkdf2 holds the GIL for tens of milliseconds per call, so it runs in worker
+# processes. At most PASSWORD_WORKERS + PASSWORD_QUEUE_SIZE calls are admitted
+# at once; past that callers get PasswordHashBusy instead of queueing without bound.
+
+class PasswordHashBusy(Exception):
+    pass
+
+
+_pool: ProcessPoolExecutor | None = None
+_admitted = 0
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent has an event loop and database threads running
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def _release(_future):
+    global _admitted
+    _admitted -= 1
+
+
+async def _run_hashing(fn, *args):
+    global _admitted
+    if _admitted >= settings.PASSWORD_WORKERS + settings.PASSWORD_QUEUE_SIZE:
+        raise PasswordHashBusy()
+    _admitted += 1
+    future = asyncio.get_running_loop().run_in_executor(get_pool(), fn, *args)
+    # the slot is held until the worker finishes, even if the request goes away first
+    future.add_done_callback(_release)
+    return await asyncio.shield(future)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(hash_password, password)
+
+
+async def verify_and_update_async(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return await _run_hashing(verify_and_update, plain, hashed)
+
+
 def create_access_token(subject: str) -> str:
     # Default to 30 mins if not set
     expire_minutes = getattr(settings, "ACCESS_TOKEN_EXPIRE_MINUTES", 30)
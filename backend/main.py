@@ -5,7 +5,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from app.sockets.handlers import sio
-from app.api import auth, uploads, chat, calls
+from app.api import auth, uploads, chat, calls, avatars, media, groups
 from app.config import settings  # use your config/settings if you have one
 
 app = FastAPI(title="whatsap-backend")
@@ -17,20 +17,53 @@ print(f"DEBUG: DATABASE_URL used: {settings.DATABASE_URL}")
 from app.models.base import Base
 from app.models.user import User
 from app.models.conversation import Conversation
+from app.models.conversation_member import ConversationMember
 from app.models.message import Message
 from app.models.call_log import CallLog
-from app.db.session import engine
+from app.models.call_stat import CallStat
+from app.models.media_object import MediaObject
+from app.models.upload_session import UploadSession
+from app.db.session import engine, pool_stats
+from app.db.message_writer import message_writer
+from app.db.group_commit import statement_writer
+from app.db.conversations import conversation_resolver
+from app.db.groups import delivery_watermarks
+from app.db.principals import principal_cache
+from app.db.migrations import migrate
+from app.media.images import shutdown_pool
+from app.utils import security
+from app.sockets.connection_manager import manager
+from app.sockets.calls import call_sessions, SIGNALING_ACTIONS
+from app.sockets.groups import send_group_message
 
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # applies only the schema versions this database hasn't seen yet
+    await migrate(engine)
+    await message_writer.start()
+    await statement_writer.start()
+    await delivery_watermarks.start()
+    await manager.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # flush whatever is still queued before the process exits
+    await call_sessions.stop()
+    await message_writer.stop()
+    await statement_writer.stop()
+    await delivery_watermarks.stop()
+    await manager.stop()
+    shutdown_pool()
+    security.shutdown_pool()
 
 # include routers
 app.include_router(auth.router, prefix="/api", tags=["auth"])
 app.include_router(chat.router, prefix="/api", tags=["chat"])
 app.include_router(uploads.router, prefix="/api/uploads", tags=["uploads"])
 app.include_router(calls.router, prefix="/api", tags=["calls"])
+app.include_router(avatars.router, prefix="/api", tags=["avatars"])
+app.include_router(media.router, prefix="/api", tags=["media"])
+app.include_router(groups.router, prefix="/api", tags=["groups"])
 
 
 @app.get("/")
@@ -41,10 +74,24 @@ async def root():
 async def reset_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    await migrate(engine)
+    conversation_resolver.clear()
+    principal_cache.clear()
     return {"message": "Database reset successfully!"}
 
 
+@app.get("/api/db/stats")
+async def db_stats():
+    # connection pool use on this worker: checked out, overflow, and how long checkouts wait
+    return pool_stats()
+
+
+@app.get("/api/ws/stats")
+async def ws_stats():
+    # per-connection outbound queue depth, to spot clients that aren't keeping up
+    return {"connections": manager.queue_stats()}
+
+
 @app.get("/favicon.ico")
 async def favicon():
     path = "static/favicon.ico"
@@ -59,14 +106,12 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # mount uploads for dev / static serving
 # NOTE: serving user uploads directly from the webroot is fine for dev, but be careful in prod.
+# New uploads are served by app/api/media.py (/api/media/...); this keeps older links working.
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 
 import json
-from fastapi import WebSocket, WebSocketDisconnect, Query, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
-from app.db.session import get_db
+from fastapi import WebSocket, WebSocketDisconnect, Query
 from app.utils.security import decode_token
 from app.models.user import User
 from app.models.conversation import Conversation
@@ -102,9 +147,15 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# No session is held for the life of the socket: each action does its database
+# work in short sessions of its own (conversation_resolver, message_writer), so
+# pooled connections track traffic, not open sockets, and nothing piles up in an
+# identity map on a long-lived connection.
 @app.websocket("/ws/chat/")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), db: AsyncSession = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), resume: str = Query(None),
+                             last_seq: int = Query(None)):
     user_id = None
+    conn = None
     try:
         if not token:
             await websocket.close(code=4003)
@@ -126,7 +177,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), db:
             await websocket.close(code=4003)
             return
 
-        await manager.connect(websocket, user_id)
+        conn = await manager.connect(websocket, user_id, resume_token=resume, last_seq=last_seq)
         
         while True:
             data = await websocket.receive_text()
@@ -142,44 +193,28 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), db:
                         print(f"DEBUG: Processing message from {user_id} to {receiver_id}")
 
                         # 1. Find or Create Conversation
-                        # Check if conversation exists
-                        query = select(Conversation).where(
-                            or_(
-                                and_(Conversation.user1_id == user_id, Conversation.user2_id == receiver_id),
-                                and_(Conversation.user1_id == receiver_id, Conversation.user2_id == user_id)
-                            )
-                        )
-                        result = await db.execute(query)
-                        conversation = result.scalars().first()
-                        
-                        if not conversation:
-                            conversation = Conversation(user1_id=user_id, user2_id=receiver_id)
-                            db.add(conversation)
-                            await db.commit()
-                            await db.refresh(conversation)
+                        conversation_id = await conversation_resolver.get_or_create(user_id, receiver_id)
+                        manager.link_contacts(user_id, receiver_id)
                         
                         # Check if receiver is online
-                        is_delivered = receiver_id in manager.active_connections
+                        is_delivered = manager.is_online(receiver_id)
 
-                        # 2. Save Message
-                        new_message = Message(
-                            conversation_id=conversation.id,
+                        # 2. Save Message (group-committed with other senders' messages)
+                        message_id, created_at = await message_writer.submit(
+                            conversation_id=conversation_id,
                             sender_id=user_id,
                             content=content,
                             type='text',
                             delivered=is_delivered
                         )
-                        db.add(new_message)
-                        await db.commit()
-                        await db.refresh(new_message)
                         
                         # 3. Broadcast to Receiver
                         response = {
                             "type": "new_message",
-                            "id": new_message.id,
+                            "id": message_id,
                             "message": content,
                             "sender_id": user_id,
-                            "timestamp": new_message.created_at.isoformat(),
+                            "timestamp": created_at.isoformat(),
                             "delivered": is_delivered,
                             "read": False
                         }
@@ -188,10 +223,10 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), db:
                         # 4. Echo back to Sender
                         await manager.send_personal_message({
                             "type": "message_sent",
-                            "id": new_message.id,
+                            "id": message_id,
                             "message": content,
                             "sender_id": user_id,
-                            "timestamp": new_message.created_at.isoformat(),
+                            "timestamp": created_at.isoformat(),
                             "delivered": is_delivered,
                             "read": False
                         }, user_id)
@@ -205,20 +240,39 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None), db:
                             "message": f"Failed to send message: {str(e)}"
                         }, user_id)
 
-            # WebRTC Signaling
-            elif message_data.get("action") in ["call_offer", "call_answer", "ice_candidate", "call_end"]:
-                receiver_id = message_data.get("receiver_id")
-                if receiver_id:
-                    # Forward the signaling message directly to the receiver
-                    await manager.send_personal_message(message_data, receiver_id)
+            elif message_data.get("action") == "send_group_message":
+                conversation_id = message_data.get("conversation_id")
+                content = message_data.get("content")
+
+                if conversation_id and content:
+                    try:
+                        # stored once, serialized once, fanned out to every member's sockets
+                        message_id = await send_group_message(manager, user_id, int(conversation_id), content)
+                        if message_id is None:
+                            await manager.send_personal_message({
+                                "type": "error",
+                                "message": "Not a member of this group"
+                            }, user_id)
+                    except Exception as e:
+                        print(f"ERROR processing group message: {e}")
+                        await manager.send_personal_message({
+                            "type": "error",
+                            "message": f"Failed to send message: {str(e)}"
+                        }, user_id)
+
+            # WebRTC Signaling: call state, ICE batching and call_logs are kept server-side
+            elif message_data.get("action") in SIGNALING_ACTIONS:
+                await call_sessions.handle(user_id, message_data)
 
     except WebSocketDisconnect:
-        if user_id:
-            await manager.disconnect(user_id)
+        if conn:
+            await manager.disconnect(conn)
+            await call_sessions.user_left(user_id)
     except Exception as e:
         print(f"WebSocket Error: {e}")
-        if user_id:
-            await manager.disconnect(user_id)
+        if conn:
+            await manager.disconnect(conn)
+            await call_sessions.user_left(user_id)
 
 if __name__ == "__main__":
     import uvicorn
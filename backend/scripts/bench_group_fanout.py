@@ -0,0 +1,185 @@
+# scripts/bench_group_fanout.py
+# One message to a 1,000-member group: the per-recipient path a group would
+# take through the 1-on-1 code (a send_personal_message and an unread_count
+# bump per member) vs. the group path (app/sockets/groups.py: serialize once,
+# ConnectionManager.send_to_many in batches, delivered watermarks coalesced by
+# DeliveryWatermarks).
+#
+#   python scripts/bench_group_fanout.py --members 1000 --messages 200
+#
+# Members are in-process sockets on the real ConnectionManager (like
+# check_ws_memory.py); --online of them are connected. Reports messages/s,
+# fan-out latency (send until the last online member's socket has the frame)
+# and how many conversation_members rows each mode wrote. Uses a throwaway
+# SQLite file so it never touches test.db.
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+class MemberSocket:
+    """Just enough of starlette's WebSocket for ConnectionManager: counts each message's arrival."""
+
+    def __init__(self, arrivals):
+        self.arrivals = arrivals
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        message = json.loads(text).get("message")
+        if message in self.arrivals:
+            self.arrivals[message].arrived()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class Arrival:
+    def __init__(self, expected: int):
+        self.remaining = expected
+        self.started = time.perf_counter()
+        self.done = asyncio.Event()
+        self.latency_ms = 0.0
+
+    def arrived(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.latency_ms = (time.perf_counter() - self.started) * 1000
+            self.done.set()
+
+
+async def per_recipient(manager, conversation_id: int, sender_id: int, members: list[int], content: str):
+    """What a group costs pushed through the 1-on-1 path, member by member."""
+    from sqlalchemy import update
+    from app.db.message_writer import message_writer
+    from app.db.session import AsyncSessionLocal
+    from app.models.conversation_member import ConversationMember
+
+    message_id, created_at = await message_writer.submit(
+        conversation_id=conversation_id, sender_id=sender_id, content=content, group=True
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ConversationMember)
+            .where(ConversationMember.conversation_id == conversation_id, ConversationMember.user_id != sender_id)
+            .values(unread_count=ConversationMember.unread_count + 1)
+        )
+        await db.commit()
+    for user_id in members:
+        await manager.send_personal_message({
+            "type": "group_message",
+            "id": message_id,
+            "conversation_id": conversation_id,
+            "message": content,
+            "sender_id": sender_id,
+            "timestamp": created_at.isoformat(),
+        }, user_id)
+
+
+async def run(mode: str, send, members: list[int], online: int, messages: int, senders: int,
+              arrivals: dict[str, Arrival], written: list[int]) -> None:
+    from app.db.groups import delivery_watermarks
+
+    written.clear()
+    latencies: list[float] = []
+
+    async def sender(n: int):
+        sender_id = members[n]
+        for i in range(n, messages, senders):
+            content = f"{mode} {i}"
+            arrival = arrivals[content] = Arrival(online)
+            await send(sender_id, content)
+            await arrival.done.wait()
+            latencies.append(arrival.latency_ms)
+            del arrivals[content]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(senders)))
+    elapsed = time.perf_counter() - start
+    await delivery_watermarks.flush()
+    print(f"{mode:<14} {messages / elapsed:8.0f} msg/s  fan-out p50 {statistics.median(latencies):7.2f} ms"
+          f"  p99 {percentile(latencies, 99):7.2f} ms  member rows written {sum(written):>8}"
+          f"  ({sum(written) / messages:6.1f}/message)")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--online", type=float, default=0.8, help="fraction of members connected")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=4, help="members sending concurrently")
+    parser.add_argument("--modes", default="per-recipient,fan-out")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'group.db')}"
+    os.environ.setdefault("DB_PROFILE", "sqlite_writer")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from sqlalchemy import event, insert, select
+        from app.db import groups
+        from app.db.groups import delivery_watermarks
+        from app.db.message_writer import message_writer
+        from app.db.migrations import migrate
+        from app.db.session import engine, AsyncSessionLocal
+        from app.models.user import User
+        from app.sockets.connection_manager import manager
+        from app.sockets.groups import send_group_message
+        await migrate(engine)
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"username": f"member{i}", "password_hash": "x"} for i in range(args.members)])
+        members = list((await db.execute(select(User.id).order_by(User.id))).scalars().all())
+        conversation_id = await groups.create_group(db, members[0], "bench", set(members[1:]))
+        await db.commit()
+
+    written: list[int] = []
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def count_member_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("UPDATE CONVERSATION_MEMBERS"):
+            written.append(max(cursor.rowcount, 0))
+
+    await message_writer.start()
+    await delivery_watermarks.start()
+    arrivals: dict[str, Arrival] = {}
+    online = members[:max(args.senders, int(len(members) * args.online))]
+    # connecting loads presence per user, which prints nothing useful here
+    with contextlib.redirect_stdout(io.StringIO()):
+        conns = [await manager.connect(MemberSocket(arrivals), user_id) for user_id in online]
+
+    modes = {
+        "per-recipient": lambda sender_id, content: per_recipient(manager, conversation_id, sender_id, members, content),
+        "fan-out": lambda sender_id, content: send_group_message(manager, sender_id, conversation_id, content),
+    }
+    print(f"group of {len(members)}, {len(online)} online, {args.messages} messages from {args.senders} concurrent senders")
+    for mode in args.modes.split(","):
+        await run(mode, modes[mode], members, len(online), args.messages, args.senders, arrivals, written)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for conn in conns:
+            await manager.disconnect(conn)
+    await delivery_watermarks.stop()
+    await message_writer.stop()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+# scripts/bench_message_writer.py
+# Throughput of the old per-message commit vs. the group-commit MessageWriter.
+#
+#   python scripts/bench_message_writer.py --messages 5000 --senders 50
+#
+# Uses a throwaway SQLite file (or --url) so it never touches test.db.
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+
+async def per_message_commit(session_factory, senders: int, per_sender: int):
+    from app.models.message import Message
+
+    async def sender(sender_id: int):
+        # what websocket_endpoint used to do: add + commit + refresh per message
+        async with session_factory() as db:
+            for i in range(per_sender):
+                msg = Message(conversation_id=1, sender_id=sender_id, content=f"msg {i}", type="text")
+                db.add(msg)
+                await db.commit()
+                await db.refresh(msg)
+
+    await asyncio.gather(*(sender(s) for s in range(senders)))
+
+
+async def group_commit(session_factory, senders: int, per_sender: int, batch: int, linger_ms: float):
+    from app.db.message_writer import MessageWriter
+
+    writer = MessageWriter(session_factory, max_batch_size=batch, max_linger_ms=linger_ms)
+    await writer.start()
+
+    async def sender(sender_id: int):
+        for i in range(per_sender):
+            await writer.submit(conversation_id=1, sender_id=sender_id, content=f"msg {i}")
+
+    await asyncio.gather(*(sender(s) for s in range(senders)))
+    await writer.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--linger-ms", type=float, default=5.0)
+    parser.add_argument("--url", default=None, help="database url (default: temp sqlite file)")
+    args = parser.parse_args()
+
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from app.models.base import Base
+    # register every table the writer touches
+    import app.models.user, app.models.conversation, app.models.message, app.models.conversation_member  # noqa: F401
+
+    per_sender = max(1, args.messages // args.senders)
+    total = per_sender * args.senders
+
+    async def run(label, fn, *extra):
+        tmp = tempfile.mkdtemp()
+        url = args.url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_async_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        start = time.perf_counter()
+        await fn(factory, args.senders, per_sender, *extra)
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+        print(f"{label:<22} {total:>7} msgs  {elapsed:8.3f}s  {total / elapsed:10.0f} msg/s")
+        return elapsed
+
+    print(f"{args.senders} concurrent senders, {per_sender} messages each")
+    baseline = await run("per-message commit", per_message_commit)
+    grouped = await run("group commit", group_commit, args.batch, args.linger_ms)
+    print(f"speedup: {baseline / grouped:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
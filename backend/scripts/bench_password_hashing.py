@@ -0,0 +1,81 @@
+# scripts/bench_password_hashing.py
+# Event-loop stall during a burst of logins: pbkdf2 verified inline on the loop
+# (the old /auth/login) vs. through the hashing pool in app/utils/security.py.
+#
+#   python scripts/bench_password_hashing.py --logins 200
+#
+# A ticker task sleeps 5 ms in a loop and records how late each wake-up is;
+# that lateness is what every websocket on the worker sees during the burst.
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+TICK = 0.005
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append((loop.time() - start - TICK) * 1000)
+
+
+async def burst(label: str, verify, logins: int):
+    lags: list[float] = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.05)
+
+    results = {"ok": 0, "busy": 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(verify(results) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick
+    print(f"{label:<8} {logins} logins in {elapsed:6.2f}s  ok {results['ok']:>4}  503 {results['busy']:>4}"
+          f"  loop lag p50 {statistics.median(lags):7.2f} ms  p99 {percentile(lags, 99):7.2f} ms  max {max(lags):7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    args = parser.parse_args()
+
+    from app.utils import security
+
+    password = "correct horse battery staple"
+    hashed = security.hash_password(password)
+
+    async def inline(results):
+        await asyncio.sleep(0)
+        security.verify_password(password, hashed)
+        results["ok"] += 1
+
+    async def pooled(results):
+        try:
+            await security.verify_and_update_async(password, hashed)
+            results["ok"] += 1
+        except security.PasswordHashBusy:
+            results["busy"] += 1
+
+    await security.verify_and_update_async(password, hashed)  # start the workers before timing
+    await burst("inline", inline, args.logins)
+    await burst("pooled", pooled, args.logins)
+    security.shutdown_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+# scripts/bench_sqlite_writer.py
+# Mixed chat load on one SQLite file: the plain "sqlite" profile (every session
+# commits on its own pooled connection) vs. "sqlite_writer" (WAL, one writer
+# connection, read-only read pool; app/db/sqlite_writer.py).
+#
+#   python scripts/bench_sqlite_writer.py --clients 200 --seconds 10
+#
+# Each client loops: send a message (MessageWriter) and, for a --mix fraction
+# of messages, mark the conversation read in its own session (an UPDATE +
+# commit, like /messages/{id}/read/) and read the latest page of messages.
+# Reports messages/s, read latency and how many operations failed with
+# "database is locked".
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def make_session_factory(profile: str, url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from app.db import sqlite_writer
+    from app.db.pool_metrics import PoolMetrics
+    from app.db.profiles import engine_options
+
+    if profile == "sqlite_writer":
+        writer, reader, session_class = sqlite_writer.create_engines(url, PoolMetrics(), PoolMetrics())
+        factory = sessionmaker(writer, class_=AsyncSession, expire_on_commit=False, sync_session_class=session_class)
+        return factory, [writer, reader]
+    url, kwargs = engine_options(url, profile, PoolMetrics())
+    engine = create_async_engine(url, **kwargs)
+    return sessionmaker(engine, class_=AsyncSession, expire_on_commit=False), [engine]
+
+
+async def run(profile: str, clients: int, seconds: float, conversations: int, mix: float, batched_reads: bool):
+    from sqlalchemy import select, update, insert, func
+    from app.db.migrations import migrate
+    from app.db.message_writer import MessageWriter
+    from app.db.group_commit import StatementWriter
+    from app.models.conversation import Conversation
+    from app.models.conversation_member import ConversationMember
+    from app.models.message import Message
+
+    url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    factory, engines = make_session_factory(profile, url)
+    await migrate(engines[0])
+    async with factory() as db:
+        await db.execute(insert(Conversation), [{"user1_id": i, "user2_id": i + 1} for i in range(1, conversations * 2, 2)])
+        ids = (await db.execute(select(Conversation.id, Conversation.user1_id, Conversation.user2_id))).all()
+        await db.execute(insert(ConversationMember), [
+            {"conversation_id": cid, "user_id": u, "unread_count": 0} for cid, a, b in ids for u in (a, b)
+        ])
+        await db.commit()
+
+    writer = MessageWriter(factory)
+    await writer.start()
+    statements = StatementWriter(factory)
+    await statements.start()
+    sent = 0
+    locked = 0
+    other_errors = 0
+    read_ms: list[float] = []
+    deadline = time.perf_counter() + seconds
+
+    async def client(n: int):
+        nonlocal sent, locked, other_errors
+        rng = random.Random(n)
+        while time.perf_counter() < deadline:
+            cid, a, b = ids[rng.randrange(len(ids))]
+            try:
+                await writer.submit(conversation_id=cid, sender_id=a, content=f"hello {n}")
+                sent += 1
+                if rng.random() >= mix:
+                    continue
+                mark_read = (
+                    update(ConversationMember)
+                    .where(ConversationMember.conversation_id == cid, ConversationMember.user_id == b)
+                    .values(unread_count=0)
+                )
+                if batched_reads:
+                    await statements.execute(mark_read)
+                else:
+                    async with factory() as db:
+                        await db.execute(mark_read)
+                        await db.commit()
+                start = time.perf_counter()
+                async with factory() as db:
+                    await db.execute(
+                        select(Message.id, Message.content).where(Message.conversation_id == cid)
+                        .order_by(Message.id.desc()).limit(50)
+                    )
+                read_ms.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                if "locked" in str(e):
+                    locked += 1
+                else:
+                    other_errors += 1
+                    print(f"{profile}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    await writer.stop()
+    await statements.stop()
+    async with factory() as db:
+        stored = (await db.execute(select(func.count()).select_from(Message))).scalar()
+    for engine in engines:
+        await engine.dispose()
+    label = profile + (" +batched" if batched_reads else "")
+    print(f"{label:<24} {sent / elapsed:8.0f} msg/s  stored {stored:>7}  locked errors {locked:>5}  other {other_errors:>3}"
+          f"  read p50 {statistics.median(read_ms) if read_ms else 0:7.2f} ms  p99 {percentile(read_ms, 99):7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--mix", type=float, default=0.25, help="fraction of messages followed by a mark-read and a page read")
+    parser.add_argument("--profiles", default="sqlite,sqlite_writer")
+    parser.add_argument("--batched-read-marks", action="store_true",
+                        help="also run with the mark-read UPDATEs group-committed through StatementWriter")
+    args = parser.parse_args()
+
+    print(f"{args.clients} concurrent clients for {args.seconds:.0f}s each, {args.mix:.0%} of messages followed by a mark-read and a read")
+    for profile in args.profiles.split(","):
+        await run(profile, args.clients, args.seconds, args.conversations, args.mix, False)
+        if args.batched_read_marks:
+            await run(profile, args.clients, args.seconds, args.conversations, args.mix, True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
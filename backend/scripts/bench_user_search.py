@@ -0,0 +1,120 @@
+# scripts/bench_user_search.py
+# Latency of /search/ on a synthetic user table: the old unbounded ilike('%q%')
+# scan vs. the indexed, ranked search in app/db/user_search.py.
+#
+#   python scripts/bench_user_search.py --users 1000000 --queries 500
+#
+# Uses a throwaway SQLite file (or --url) so it never touches test.db.
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+SYLLABLES = ["ka", "ri", "to", "mi", "sa", "no", "lu", "ve", "an", "el", "jo", "ha", "de", "qu", "zo", "pe", "ix", "ra", "be", "on"]
+
+
+def fake_name(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def populate(engine, users: int, rng: random.Random):
+    from sqlalchemy import insert
+    from app.models.user import User
+
+    batch = 20000
+    seen = set()
+    start = time.perf_counter()
+    for offset in range(0, users, batch):
+        rows = []
+        for i in range(offset, min(users, offset + batch)):
+            username = f"{fake_name(rng)}{i}"
+            seen.add(username)
+            rows.append({
+                "username": username,
+                "full_name": f"{fake_name(rng).title()} {fake_name(rng).title()}",
+                "password_hash": "x",
+            })
+        async with engine.begin() as conn:
+            await conn.execute(insert(User), rows)
+    print(f"inserted {users} users (search index maintained by triggers) in {time.perf_counter() - start:.1f}s")
+
+
+def make_queries(rng: random.Random, count: int) -> list[str]:
+    queries = []
+    for _ in range(count):
+        name = fake_name(rng) + fake_name(rng)
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(name[:rng.randint(1, 6)])           # autocomplete, keystroke by keystroke
+        else:
+            start = rng.randint(0, max(0, len(name) - 4))
+            queries.append(name[start:start + rng.randint(3, 5)])  # substring
+    return queries
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--legacy-queries", type=int, default=20, help="the old scan is slow; sample fewer")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--url", default=None, help="database url (default: temp sqlite file)")
+    args = parser.parse_args()
+
+    from sqlalchemy import select, or_, and_
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from app.db.migrations import migrate
+    from app.db.user_search import search_users
+    from app.models.user import User
+
+    rng = random.Random(42)
+    url = args.url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_async_engine(url)
+    await migrate(engine)
+    await populate(engine, args.users, rng)
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    queries = make_queries(rng, args.queries)
+
+    async def timed(fn, qs):
+        samples = []
+        async with factory() as db:
+            for q in qs:
+                start = time.perf_counter()
+                await fn(db, q)
+                samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    async def legacy(db, q):
+        # what search_users did before: unbounded, unranked, full rows
+        result = await db.execute(select(User).where(and_(
+            User.id != 0, or_(User.username.ilike(f"%{q}%"), User.full_name.ilike(f"%{q}%"))
+        )))
+        return result.scalars().all()
+
+    async def indexed(db, q):
+        return await search_users(db, q, exclude_id=0, limit=args.limit)
+
+    await timed(indexed, queries[:20])  # warm the page cache
+    for label, fn, qs in (("ilike scan", legacy, queries[:args.legacy_queries]), ("indexed", indexed, queries)):
+        samples = await timed(fn, qs)
+        print(f"{label:<12} {len(qs):>5} queries  p50 {statistics.median(samples):8.2f} ms"
+              f"  p95 {percentile(samples, 95):8.2f} ms  p99 {percentile(samples, 99):8.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+# scripts/check_ws_memory.py
+# Per-connection memory of /ws/chat/ over a long-lived socket: drives the real
+# websocket_endpoint with one in-process socket sending --messages chat
+# messages, and fails if memory keeps growing after warm-up.
+#
+#   python scripts/check_ws_memory.py --messages 100000
+#
+# Memory is measured as live Python objects after a full gc (what a growing
+# identity map or per-socket cache would show up as), with RSS alongside.
+# Uses a throwaway SQLite file so it never touches test.db. Exit status 1 if
+# more than --max-object-growth objects accumulated between warm-up and the end.
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import resource
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+
+
+class ScriptedSocket:
+    """Just enough of starlette's WebSocket for websocket_endpoint: plays back frames, discards output."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.sent = 0
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        from fastapi import WebSocketDisconnect
+        try:
+            return next(self.frames)
+        except StopIteration:
+            raise WebSocketDisconnect()
+
+    async def send_text(self, text: str):
+        self.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class IdleSocket(ScriptedSocket):
+    """The receiving user: connected, never says anything."""
+
+    def __init__(self):
+        super().__init__(iter(()))
+        self._closed = asyncio.Event()
+
+    async def receive_text(self) -> str:
+        await self._closed.wait()
+        return await super().receive_text()
+
+
+def live_objects() -> int:
+    gc.collect()
+    return len(gc.get_objects())
+
+
+def rss_kb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak, not current, off Linux
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--sample-every", type=int, default=10_000)
+    parser.add_argument("--max-object-growth", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'ws.db')}"
+    os.environ.setdefault("DB_PROFILE", "sqlite_writer")
+    # one sender awaits each message; don't make it wait out a linger window per message
+    os.environ.setdefault("MESSAGE_BATCH_MAX_LINGER_MS", "0")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main as app_main
+        from app.db.migrations import migrate
+        from app.db.message_writer import message_writer
+        from app.db.session import engine, pool_stats
+        from app.sockets.connection_manager import manager
+        from app.utils.security import create_access_token
+        await migrate(engine)
+    await message_writer.start()
+
+    sender_id, receiver_id = 1, 2
+    receiver = IdleSocket()
+    receiver_conn = await manager.connect(receiver, receiver_id)
+
+    samples: list[tuple[int, int, float]] = []
+    started = time.perf_counter()
+
+    def frames():
+        for i in range(1, args.messages + 1):
+            yield json.dumps({"action": "send_message", "receiver_id": receiver_id, "content": f"message {i}"})
+            if i % args.sample_every == 0:
+                samples.append((i, live_objects(), rss_kb()))
+                print(f"{i:>8} messages  {samples[-1][1]:>9} objects  rss {samples[-1][2]:9.0f} KiB"
+                      f"  {i / (time.perf_counter() - started):6.0f} msg/s", file=sys.__stdout__)
+
+    sender = ScriptedSocket(frames())
+    # the endpoint's per-message DEBUG prints would dominate the run (and a buffer for them would be the leak)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await app_main.websocket_endpoint(sender, token=create_access_token(sender_id))
+
+    receiver._closed.set()
+    await manager.disconnect(receiver_conn)
+    await message_writer.stop()
+    stats = pool_stats()
+    await engine.dispose()
+
+    warm_count, warm_objects, warm_rss = samples[0]
+    end_count, end_objects, end_rss = samples[-1]
+    growth = end_objects - warm_objects
+    print(f"after {warm_count} messages: {warm_objects} objects, rss {warm_rss:.0f} KiB; "
+          f"after {end_count}: {end_objects} objects ({growth:+d}), rss {end_rss:.0f} KiB ({end_rss - warm_rss:+.0f})")
+    print(f"receiver got {receiver.sent} frames; peak pooled connections checked out: {stats.get('peak_checked_out')}")
+    if growth > args.max_object_growth:
+        print(f"FAIL: {growth} objects accumulated (limit {args.max_object_growth})")
+        sys.exit(1)
+    print("OK: per-connection memory is flat")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
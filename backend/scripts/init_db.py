@@ -8,14 +8,10 @@ sys.path.insert(0, str(root))
 async def main():
     # import config/engine
     from app.db.session import engine
-    # import models so they register with Base.metadata
-    import app.models.user
-    import app.models.message   # if you have it
-    from app.models.base import Base
+    from app.db.migrations import migrate
 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("✅ DB tables created")
+    version = await migrate(engine)
+    print(f"✅ DB schema at version {version}")
 
 if __name__ == "__main__":
     asyncio.run(main())
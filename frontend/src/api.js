@@ -16,4 +16,7 @@ api.interceptors.request.use(config => {
     return config;
 });
 
+// Server-relative media paths (e.g. /api/avatars/...) live on the API host, not the page's
+export const mediaUrl = (path) => (path && path.startsWith('/') ? new URL(path, api.defaults.baseURL).href : path);
+
 export default api;
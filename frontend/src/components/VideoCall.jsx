@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { FaPhone, FaPhoneSlash, FaMicrophone, FaMicrophoneSlash, FaVideo, FaVideoSlash } from 'react-icons/fa';
-import api from '../api';
+import { mediaUrl } from '../api';
 
 import ringtoneUrl from '../assets/ringtone.wav';
 
@@ -111,17 +111,21 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
                     setCallAccepted(true);
                     setStatusMessage("");
                 }
-            } else if (data.action === 'ice_candidate') {
+            } else if (data.action === 'ice_candidates' || data.action === 'ice_candidate') {
+                // the server coalesces trickled candidates into one ice_candidates frame
                 if (data.receiver_id === user.id) {
-                    if (peerConnection.current) {
-                        try {
-                            await peerConnection.current.addIceCandidate(new RTCIceCandidate(data.candidate));
-                        } catch (e) {
-                            console.error("Error adding received ice candidate", e);
+                    const candidates = data.candidates || [data.candidate];
+                    for (const candidate of candidates) {
+                        if (peerConnection.current) {
+                            try {
+                                await peerConnection.current.addIceCandidate(new RTCIceCandidate(candidate));
+                            } catch (e) {
+                                console.error("Error adding received ice candidate", e);
+                            }
+                        } else {
+                            console.log("Buffering ICE candidate");
+                            iceCandidatesBuffer.current.push(candidate);
                         }
-                    } else {
-                        console.log("Buffering ICE candidate");
-                        iceCandidatesBuffer.current.push(data.candidate);
                     }
                 }
             } else if (data.action === 'call_end') {
@@ -223,25 +227,12 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
                 pc.addTrack(track, stream);
             });
 
-            // 2. Create Call Log (Non-blocking)
+            // 2. Create Offer
             setStatusMessage("Connecting...");
-            let callId = null;
-            try {
-                const res = await api.post('calls/', {
-                    receiver_id: activeChat.contact_user.id,
-                    status: 'missed'
-                });
-                callId = res.data.id;
-                setCallId(callId);
-            } catch (logErr) {
-                console.error("Failed to create call log:", logErr);
-            }
-
-            // 3. Create Offer
             const offer = await pc.createOffer();
-            await pc.setLocalDescription(offer);
 
-            // 4. Send Offer
+            // 3. Send Offer (the server writes the call log and tells the callee its call_id).
+            // Sent before setLocalDescription so no ICE candidate can overtake it.
             socket.send(JSON.stringify({
                 action: 'call_offer',
                 receiver_id: activeChat.contact_user.id,
@@ -249,9 +240,9 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
                 sender_name: user.full_name || user.username,
                 sender_id: user.id,
                 sender_picture: user.profile_picture,
-                call_id: callId,
                 call_type: callType
             }));
+            await pc.setLocalDescription(offer);
 
             setStatusMessage("Calling...");
 
@@ -269,13 +260,8 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
         setStatusMessage("Connecting...");
 
         try {
-            // Update Call Log (if call_id was sent)
-            if (incomingCall.call_id) {
-                setCallId(incomingCall.call_id);
-                await api.patch(`calls/${incomingCall.call_id}`, {
-                    status: 'accepted'
-                });
-            }
+            // the server marks the call log accepted when it sees our call_answer
+            if (incomingCall.call_id) setCallId(incomingCall.call_id);
 
             const constraints = {
                 video: incomingCall.call_type === 'video' ? true : false,
@@ -347,18 +333,7 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
             }));
         }
 
-        // Update Call Log on End
-        if (callId) {
-            try {
-                const status = callAccepted ? 'accepted' : 'missed';
-                await api.patch(`calls/${callId}`, {
-                    status: status,
-                    end_time: new Date().toISOString()
-                });
-            } catch (e) {
-                console.error("Error updating call log", e);
-            }
-        }
+        // the call log is closed server-side on call_end
 
         if (peerConnection.current) {
             peerConnection.current.close();
@@ -402,7 +377,7 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
                     <div className="w-24 h-24 bg-gray-600 rounded-full mx-auto mb-4 overflow-hidden border-4 border-gray-700">
                         {/* Placeholder or sender image */}
                         {incomingCall.sender_picture ? (
-                            <img src={incomingCall.sender_picture} className="w-full h-full object-cover" />
+                            <img src={mediaUrl(incomingCall.sender_picture)} className="w-full h-full object-cover" />
                         ) : (
                             <div className="w-full h-full flex items-center justify-center text-3xl">📞</div>
                         )}
@@ -442,7 +417,7 @@ const VideoCall = ({ socket, user, activeChat, onClose, isInitiator, callType =
                     <div className="absolute inset-0 flex flex-col items-center justify-center z-10 pointer-events-auto">
                         <div className="w-32 h-32 bg-gray-600 rounded-full mb-4 flex items-center justify-center text-4xl overflow-hidden border-4 border-gray-700 shadow-lg">
                             {activeChat?.contact_user?.profile_picture ?
-                                <img src={activeChat.contact_user.profile_picture} className="w-full h-full object-cover" /> :
+                                <img src={mediaUrl(activeChat.contact_user.profile_picture)} className="w-full h-full object-cover" /> :
                                 (activeChat?.contact_user?.full_name?.[0] || activeChat?.contact_user?.username?.[0] || "U")
                             }
                         </div>
@@ -1,6 +1,6 @@
-import React, { useState, useEffect, useContext, useRef } from 'react';
+import React, { useState, useEffect, useLayoutEffect, useContext, useRef } from 'react';
 import { AuthContext } from '../context/AuthContext';
-import api from '../api';
+import api, { mediaUrl } from '../api';
 import { FaUser, FaSignOutAlt, FaPlus, FaSmile, FaPaperPlane, FaBars, FaEllipsisV, FaTimes, FaSearch, FaArrowLeft, FaCamera, FaCog, FaVideo, FaPhone, FaCheck, FaCheckDouble } from 'react-icons/fa';
 import VideoCall from '../components/VideoCall';
 // import EmojiPicker from 'emoji-picker-react';
@@ -13,8 +13,16 @@ export const Chat = () => {
     const [input, setInput] = useState('');
     const [socket, setSocket] = useState(null);
     const messagesEndRef = useRef(null);
+    const messagesContainerRef = useRef(null);
+    // scroll-back paging of the open chat: before_id cursor for the next older page, and
+    // the scrollHeight to restore from once a page has been prepended
+    const olderPageRef = useRef({ cursor: null, loading: false, restoreFrom: null });
     const menuRef = useRef(null);
     const emojiPickerRef = useRef(null);
+    // resume token + last event seq from the server, so a dropped socket can pick up where it left off
+    const wsSessionRef = useRef({ token: null, seq: 0 });
+    const activeChatRef = useRef(null);
+    const unmountedRef = useRef(false);
 
     // UI States
     const [sidebarOpen, setSidebarOpen] = useState(true);
@@ -35,6 +43,7 @@ export const Chat = () => {
         about: '',
         profile_picture: ''
     });
+    const [avatarFile, setAvatarFile] = useState(null);
 
     // Search States
     const [searchQuery, setSearchQuery] = useState('');
@@ -55,6 +64,7 @@ export const Chat = () => {
         document.addEventListener('mousedown', handleClickOutside);
 
         return () => {
+            unmountedRef.current = true;
             if (socket) socket.close();
             document.removeEventListener('mousedown', handleClickOutside);
         };
@@ -65,6 +75,7 @@ export const Chat = () => {
     };
 
     useEffect(() => {
+        activeChatRef.current = activeChat;
         if (activeChat) {
             fetchHistory(activeChat.contact_user.id);
             markMessagesRead(activeChat.contact_user.id);
@@ -72,7 +83,15 @@ export const Chat = () => {
         }
     }, [activeChat]);
 
-    useEffect(() => {
+    useLayoutEffect(() => {
+        const older = olderPageRef.current;
+        const container = messagesContainerRef.current;
+        if (older.restoreFrom !== null && container) {
+            // an older page was prepended: keep the same messages in view rather than jumping to the bottom
+            container.scrollTop += container.scrollHeight - older.restoreFrom;
+            older.restoreFrom = null;
+            return;
+        }
         scrollToBottom();
     }, [messages]);
 
@@ -89,9 +108,11 @@ export const Chat = () => {
     const connectWebSocket = () => {
         const token = localStorage.getItem('token');
         const wsUrl = import.meta.env.VITE_WS_URL || 'ws://127.0.0.1:8000';
-        const ws = new WebSocket(`${wsUrl}/ws/chat/?token=${token}`);
-        ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+        const session = wsSessionRef.current;
+        const resume = session.token ? `&resume=${session.token}&last_seq=${session.seq}` : '';
+        const ws = new WebSocket(`${wsUrl}/ws/chat/?token=${token}${resume}`);
+        const handleEvent = (data) => {
+            if (data.seq) wsSessionRef.current.seq = data.seq;
             if (data.type === 'new_message' || data.type === 'message_sent') {
                 setMessages(prev => [...prev, {
                     id: data.id,
@@ -103,11 +124,37 @@ export const Chat = () => {
                     delivered: data.delivered // Capture delivered status
                 }]);
                 fetchContacts();
+            } else if (data.type === 'inbox_batch') {
+                // Messages that arrived while we were offline: they aren't in the replay,
+                // so the open chat only gets them from here. Refresh unread counts too.
+                const chat = activeChatRef.current;
+                const incoming = chat ? data.messages.filter(m =>
+                    !m.group && m.sender_id === chat.contact_user.id
+                ) : [];
+                if (incoming.length) {
+                    setMessages(prev => {
+                        const seen = new Set(prev.map(msg => msg.id));
+                        return [...prev, ...incoming.filter(m => !seen.has(m.id)).map(m => ({
+                            id: m.id,
+                            sender_username: chat.contact_user.username,
+                            content: m.message,
+                            timestamp: m.timestamp,
+                            sender: m.sender_id,
+                            read: false,
+                            delivered: m.delivered
+                        }))];
+                    });
+                }
+                fetchContacts();
+            } else if (data.type === 'messages_delivered') {
+                setMessages(prev => prev.map(msg =>
+                    data.message_ids.includes(msg.id) ? { ...msg, delivered: true } : msg
+                ));
             } else if (data.type === 'messages_read') {
                 // Update local messages to read
                 if (activeChat && activeChat.contact_user.id === data.reader_id) {
                     setMessages(prev => prev.map(msg =>
-                        data.message_ids.includes(msg.id) ? { ...msg, read: true } : msg
+                        msg.id <= data.last_read_message_id ? { ...msg, read: true } : msg
                     ));
                 }
             } else if (data.type === 'user_status') {
@@ -124,6 +171,26 @@ export const Chat = () => {
                 }
             }
         };
+        ws.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'session') {
+                const reconnecting = wsSessionRef.current.token !== null;
+                wsSessionRef.current = { token: data.resume_token, seq: data.seq };
+                if (reconnecting && !data.resumed) {
+                    // the server couldn't replay what we missed; reload from the API
+                    fetchContacts();
+                    if (activeChatRef.current) fetchHistory(activeChatRef.current.contact_user.id);
+                }
+            } else if (data.type === 'replay') {
+                data.events.forEach(handleEvent);
+            } else {
+                handleEvent(data);
+            }
+        };
+        ws.onclose = (event) => {
+            // 4003: bad token, reconnecting won't help
+            if (!unmountedRef.current && event.code !== 4003) setTimeout(connectWebSocket, 1000);
+        };
         setSocket(ws);
     };
 
@@ -135,7 +202,7 @@ export const Chat = () => {
     const fetchCalls = async () => {
         try {
             const res = await api.get('calls/');
-            setCallHistory(res.data);
+            setCallHistory(res.data.calls);
         } catch (err) {
             console.error("Failed to fetch calls", err);
         }
@@ -151,8 +218,33 @@ export const Chat = () => {
     };
 
     const fetchHistory = async (userId) => {
+        // newest page only; older pages load as the user scrolls up
         const res = await api.get(`messages/${userId}/`);
-        setMessages(res.data);
+        olderPageRef.current = { cursor: res.data.prev_cursor, loading: false, restoreFrom: null };
+        setMessages(res.data.messages);
+    };
+
+    const fetchOlderMessages = async () => {
+        const older = olderPageRef.current;
+        const chat = activeChatRef.current;
+        if (!chat || !older.cursor || older.loading) return;
+        older.loading = true;
+        try {
+            const res = await api.get(`messages/${chat.contact_user.id}/`, { params: { before_id: older.cursor } });
+            // the user switched chats (or history was reloaded) while this page was in flight
+            if (activeChatRef.current !== chat || olderPageRef.current !== older) return;
+            older.cursor = res.data.prev_cursor;
+            older.restoreFrom = messagesContainerRef.current?.scrollHeight ?? null;
+            setMessages(prev => [...res.data.messages, ...prev]);
+        } catch (err) {
+            console.error("Failed to load older messages", err);
+        } finally {
+            older.loading = false;
+        }
+    };
+
+    const handleMessagesScroll = (e) => {
+        if (e.currentTarget.scrollTop < 80) fetchOlderMessages();
     };
 
     const sendMessage = () => {
@@ -199,45 +291,22 @@ export const Chat = () => {
     const handleImageUpload = (e) => {
         const file = e.target.files[0];
         if (file) {
-            const reader = new FileReader();
-            reader.onload = (event) => {
-                const img = new Image();
-                img.onload = () => {
-                    const canvas = document.createElement('canvas');
-                    let width = img.width;
-                    let height = img.height;
-                    const MAX_WIDTH = 800;
-                    const MAX_HEIGHT = 800;
-
-                    if (width > height) {
-                        if (width > MAX_WIDTH) {
-                            height *= MAX_WIDTH / width;
-                            width = MAX_WIDTH;
-                        }
-                    } else {
-                        if (height > MAX_HEIGHT) {
-                            width *= MAX_HEIGHT / height;
-                            height = MAX_HEIGHT;
-                        }
-                    }
-
-                    canvas.width = width;
-                    canvas.height = height;
-                    const ctx = canvas.getContext('2d');
-                    ctx.drawImage(img, 0, 0, width, height);
-
-                    const dataUrl = canvas.toDataURL('image/jpeg', 0.7); // Compress to 70% quality
-                    setProfileData({ ...profileData, profile_picture: dataUrl });
-                };
-                img.src = event.target.result;
-            };
-            reader.readAsDataURL(file);
+            // sent as-is on save; the server stores it once and renders the thumbnails
+            setAvatarFile(file);
+            setProfileData({ ...profileData, profile_picture: URL.createObjectURL(file) });
         }
     };
 
     const saveProfile = async () => {
         try {
-            await api.patch('auth/profile', profileData);
+            if (avatarFile) {
+                const form = new FormData();
+                form.append('file', avatarFile);
+                await api.post('avatars/', form);
+                setAvatarFile(null);
+            }
+            const { profile_picture, ...fields } = profileData;
+            await api.patch('auth/profile', fields);
             await checkUser();
             setShowProfileModal(false);
             alert("Profile updated successfully!");
@@ -267,7 +336,7 @@ export const Chat = () => {
                 <div className="p-4 bg-gray-800 border-b border-gray-700 flex items-center justify-between h-16 shrink-0">
                     <div className="flex items-center cursor-pointer" onClick={() => setShowProfileModal(true)}>
                         <div className="w-10 h-10 bg-gray-600 rounded-full mr-3 overflow-hidden shrink-0">
-                            {user?.profile_picture ? <img src={user.profile_picture} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
+                            {user?.profile_picture ? <img src={mediaUrl(user.profile_picture)} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
                         </div>
                         <span className="font-bold truncate w-32">{user?.full_name || user?.username}</span>
                     </div>
@@ -293,7 +362,7 @@ export const Chat = () => {
                             >
                                 <div className="w-12 h-12 bg-gray-600 rounded-full mr-3 overflow-hidden flex-shrink-0 relative">
                                     {contact.contact_user.profile_picture ?
-                                        <img src={contact.contact_user.profile_picture} className="w-full h-full object-cover" /> :
+                                        <img src={mediaUrl(contact.contact_user.profile_picture)} className="w-full h-full object-cover" /> :
                                         <div className="w-full h-full flex items-center justify-center"><FaUser /></div>
                                     }
                                 </div>
@@ -313,7 +382,7 @@ export const Chat = () => {
                             <div key={call.id} className="p-4 flex items-center border-b border-gray-700/50 hover:bg-gray-700">
                                 <div className="w-12 h-12 bg-gray-600 rounded-full mr-3 overflow-hidden flex-shrink-0">
                                     {call.other_user?.profile_picture ?
-                                        <img src={call.other_user.profile_picture} className="w-full h-full object-cover" /> :
+                                        <img src={mediaUrl(call.other_user.profile_picture)} className="w-full h-full object-cover" /> :
                                         <div className="w-full h-full flex items-center justify-center"><FaUser /></div>
                                     }
                                 </div>
@@ -374,7 +443,7 @@ export const Chat = () => {
                             <div className="flex items-center cursor-pointer" onClick={() => setShowContactProfileModal(true)}>
                                 <div className="w-10 h-10 bg-gray-600 rounded-full mr-3 overflow-hidden">
                                     {activeChat.contact_user.profile_picture ?
-                                        <img src={activeChat.contact_user.profile_picture} className="w-full h-full object-cover" /> :
+                                        <img src={mediaUrl(activeChat.contact_user.profile_picture)} className="w-full h-full object-cover" /> :
                                         <div className="w-full h-full flex items-center justify-center"><FaUser /></div>
                                     }
                                 </div>
@@ -456,11 +525,11 @@ export const Chat = () => {
                 {activeChat ? (
                     <>
                         {/* Messages */}
-                        <div className="flex-1 overflow-y-auto p-4 pb-36 space-y-2 bg-[url('https://user-images.githubusercontent.com/15075759/28719144-86dc0f70-73b1-11e7-911d-60d70fcded21.png')] bg-fixed">
+                        <div ref={messagesContainerRef} onScroll={handleMessagesScroll} className="flex-1 overflow-y-auto p-4 pb-36 space-y-2 bg-[url('https://user-images.githubusercontent.com/15075759/28719144-86dc0f70-73b1-11e7-911d-60d70fcded21.png')] bg-fixed">
                             {messages.map((msg, idx) => {
                                 const isMe = msg.sender_username === user.username;
                                 return (
-                                    <div key={idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
+                                    <div key={msg.id ?? idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
                                         <div className={`max-w-[70%] p-2 px-3 rounded-lg shadow ${isMe ? 'bg-green-700 rounded-tr-none' : 'bg-gray-700 rounded-tl-none'}`}>
                                             <p className="text-sm md:text-base">{msg.content}</p>
                                             <div className="flex items-center justify-end mt-1 space-x-1">
@@ -541,7 +610,7 @@ export const Chat = () => {
                                 {searchResults.map(u => (
                                     <div key={u.id} onClick={() => startChat(u)} className="flex items-center p-3 hover:bg-gray-700 cursor-pointer rounded">
                                         <div className="w-10 h-10 bg-gray-600 rounded-full mr-3 overflow-hidden">
-                                            {u.profile_picture ? <img src={u.profile_picture} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
+                                            {u.profile_picture ? <img src={mediaUrl(u.profile_picture)} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
                                         </div>
                                         <div>
                                             <p className="font-bold">{u.full_name || u.username}</p>
@@ -578,7 +647,7 @@ export const Chat = () => {
                                 {filteredContacts.map(c => (
                                     <div key={c.id} onClick={() => startChat(c.contact_user)} className="flex items-center p-3 hover:bg-gray-700 cursor-pointer rounded">
                                         <div className="w-10 h-10 bg-gray-600 rounded-full mr-3 overflow-hidden">
-                                            {c.contact_user.profile_picture ? <img src={c.contact_user.profile_picture} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
+                                            {c.contact_user.profile_picture ? <img src={mediaUrl(c.contact_user.profile_picture)} className="w-full h-full object-cover" /> : <div className="w-full h-full flex items-center justify-center"><FaUser /></div>}
                                         </div>
                                         <div>
                                             <p className="font-bold">{c.contact_user.full_name || c.contact_user.username}</p>
@@ -605,7 +674,7 @@ export const Chat = () => {
                             <div className="relative w-32 h-32 mb-6 group">
                                 <div className="w-full h-full rounded-full overflow-hidden border-4 border-gray-700">
                                     {profileData.profile_picture ?
-                                        <img src={profileData.profile_picture} className="w-full h-full object-cover" /> :
+                                        <img src={mediaUrl(profileData.profile_picture)} className="w-full h-full object-cover" /> :
                                         <div className="w-full h-full bg-gray-600 flex items-center justify-center"><FaUser size={40} /></div>
                                     }
                                 </div>
@@ -652,7 +721,7 @@ export const Chat = () => {
                         <div className="p-6 flex flex-col items-center">
                             <div className="w-32 h-32 mb-6 rounded-full overflow-hidden border-4 border-gray-700">
                                 {activeChat.contact_user.profile_picture ?
-                                    <img src={activeChat.contact_user.profile_picture} className="w-full h-full object-cover" /> :
+                                    <img src={mediaUrl(activeChat.contact_user.profile_picture)} className="w-full h-full object-cover" /> :
                                     <div className="w-full h-full bg-gray-600 flex items-center justify-center"><FaUser size={40} /></div>
                                 }
                             </div>